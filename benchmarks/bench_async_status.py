@@ -0,0 +1,51 @@
+"""非同步傳輸效能測試：N 個並行 check_kitting_status 呼叫
+
+對一個每次回應延遲 LATENCY 秒的本機模擬伺服器同時發出 N 個呼叫，
+非同步傳輸下總耗時應接近單次延遲 (max-latency)，而非 N 倍延遲
+(sum-of-latency)。
+
+用法:
+    python benchmarks/bench_async_status.py [N] [LATENCY]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+os.environ.setdefault("SAP_MAX_CONCURRENCY_STATUS", str(N))
+os.environ.setdefault("SAP_POOL_SIZE", str(N))
+
+import sap_server  # noqa: E402
+from sap_stub import SAPStubServer  # noqa: E402
+
+
+async def run(base_url: str):
+    sap_server.SAPConfig.set_base_url(base_url)
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(sap_server.check_kitting_status(BATCH_ID=str(i)) for i in range(N))
+    )
+    elapsed = time.perf_counter() - start
+    assert all(r.startswith("LAST_ACTION:") for r in results), results[0]
+    return elapsed
+
+
+def main():
+    with SAPStubServer(latency=LATENCY) as stub:
+        elapsed = asyncio.run(run(stub.base_url))
+    print(f"concurrent calls   : {N}")
+    print(f"stub latency       : {LATENCY:.3f}s")
+    print(f"wall time          : {elapsed:.3f}s")
+    print(f"sum-of-latency     : {N * LATENCY:.3f}s")
+    print(f"speedup vs serial  : {N * LATENCY / elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""背景作業測試：start_background_job 的回應時間與同時執行多個慢速 SAP 呼叫
+
+對本機模擬伺服器 (每個請求 --latency 秒) 比較：
+1. 直接呼叫 create_sto_po：代理的工具呼叫被 SAP 延遲佔住
+2. start_background_job：立即回傳 job_id，之後以 await_background_job 取得結果
+3. 同時啟動 --jobs 個背景作業後逐一等待：總耗時約為單次延遲而非 N 倍
+
+以 mcp.call_tool() 呼叫 (與 MCP 客戶端相同的參數驗證與序列化路徑)。
+
+用法:
+    python benchmarks/bench_background_jobs.py [--latency 2] [--jobs 16]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+os.environ.setdefault("SAP_JOURNAL_PATH", os.path.join(tempfile.mkdtemp(), "journal.sqlite3"))
+# 並行上限與連線池不成為瓶頸
+os.environ.setdefault("SAP_MAX_CONCURRENCY", "64")
+os.environ.setdefault("SAP_POOL_SIZE", "64")
+
+import sap_server  # noqa: E402
+from sap_stub import SAPStubServer  # noqa: E402
+
+
+def args_for(n: int) -> dict:
+    return {"PR_NUMBER": f"{n:010d}", "PR_ITEM": "00010"}
+
+
+async def call(name: str, arguments: dict) -> dict:
+    content, _ = await sap_server.mcp.call_tool(name, arguments)
+    return json.loads(content[0].text)
+
+
+async def main(opts):
+    with SAPStubServer(latency=opts.latency) as stub:
+        sap_server.SAPConfig.set_base_url(stub.base_url)
+
+        t = time.perf_counter()
+        await call("create_sto_po", args_for(0))
+        direct = time.perf_counter() - t
+
+        t = time.perf_counter()
+        job = await call("start_background_job", {"TOOL": "create_sto_po", "ARGUMENTS": args_for(1)})
+        started = time.perf_counter() - t
+        result = await call("await_background_job", {"JOB_ID": job["job_id"]})
+        awaited = time.perf_counter() - t
+        assert result["state"] == "done", result
+
+        t = time.perf_counter()
+        jobs = [await call("start_background_job", {"TOOL": "create_sto_po", "ARGUMENTS": args_for(n)})
+                for n in range(2, opts.jobs + 2)]
+        start_all = time.perf_counter() - t
+        results = [await call("await_background_job", {"JOB_ID": j["job_id"]}) for j in jobs]
+        total = time.perf_counter() - t
+        done = sum(1 for r in results if r["state"] == "done")
+
+    print(f"SAP 延遲 {opts.latency:g} 秒\n")
+    print(f"直接呼叫 create_sto_po:              {direct * 1000:9.1f} ms (工具呼叫被佔住)")
+    print(f"start_background_job 回傳:           {started * 1000:9.1f} ms")
+    print(f"  await_background_job 取得結果:     {awaited * 1000:9.1f} ms")
+    print(f"啟動 {opts.jobs} 個背景作業:                {start_all * 1000:9.1f} ms")
+    print(f"  全部完成 ({done}/{opts.jobs} done):            {total * 1000:9.1f} ms "
+          f"(逐一直接呼叫約 {direct * opts.jobs * 1000:.0f} ms)")
+    print(f"\n{json.dumps(json.loads(sap_server.get_background_job_stats()), ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="背景作業回應時間測試")
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--jobs", type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""主資料批次作業測試：run_master_data_job 的吞吐量、速率限制與中斷接續
+
+對本機模擬伺服器 (每個請求 --latency 秒) 以 MATERIALS 筆物料 × 4 個維護項目執行：
+1. 逐筆 (CONCURRENCY=1，不限速)：相當於代理逐一呼叫 maintain_* 工具
+2. 工作者池 (CONCURRENCY=--concurrency，不限速)
+3. 工作者池 + 每個服務 --rate 次/秒的 token bucket：實際送到 SAP 的速率不超過上限
+4. 中斷接續：執行到一半取消，以相同參數重新呼叫，確認 SAP 收到的請求數等於項目總數
+   (已完成的項目不重送)
+
+用法:
+    python benchmarks/bench_bulk_job.py [--materials 200] [--latency 0.05] [--concurrency 8] [--rate 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+# 不寫入專案目錄，也不讓「已維護」快取略過請求
+os.environ.setdefault("SAP_JOURNAL_PATH", os.path.join(tempfile.mkdtemp(), "journal.sqlite3"))
+os.environ.setdefault("SAP_MAINT_CACHE_TTL", "0")
+
+import sap_server  # noqa: E402
+from sap_stub import SAPStubServer  # noqa: E402
+
+TASKS = "info_record,source_list,sales_view,warehouse_view"
+
+
+def sent(stub) -> int:
+    return sum(sum(c.values()) for c in stub.counters.values())
+
+
+def set_rate(rate: float):
+    for bucket in sap_server.bulk_rate_limits.values():
+        bucket.rate = rate
+        bucket._tokens = float(bucket.burst)
+        bucket._updated = time.monotonic()
+
+
+async def run_job(materials: str, job_id: str, concurrency: int) -> dict:
+    content, _ = await sap_server.mcp.call_tool("run_master_data_job", {
+        "MATERIALS": materials, "TASKS": TASKS, "JOB_ID": job_id, "CONCURRENCY": concurrency,
+    })
+    return json.loads(content[0].text)
+
+
+async def main(opts):
+    materials = "\n".join(["MATERIAL,SALES_ORG"] + [f"NEW-{i:05d},TW01" for i in range(opts.materials)])
+    total = opts.materials * 4
+    with SAPStubServer(latency=opts.latency) as stub:
+        sap_server.SAPConfig.set_base_url(stub.base_url)
+        print(f"{opts.materials} 筆物料 × 4 個維護項目 = {total} 次呼叫，SAP 延遲 {opts.latency * 1000:.0f} ms\n")
+        print(f"{'模式':<28}{'秒':>8}{'calls/s':>10}{'SAP req/s (每服務最高)':>26}")
+        cases = (("逐筆 (CONCURRENCY=1)", 1, 0.0),
+                 (f"工作者池 (CONCURRENCY={opts.concurrency})", opts.concurrency, 0.0),
+                 (f"工作者池 + {opts.rate:g}/s token bucket", opts.concurrency, opts.rate))
+        for n, (name, concurrency, rate) in enumerate(cases):
+            set_rate(rate)
+            stub.counters.clear()
+            result = await run_job(materials, f"bench-{n}", concurrency)
+            per_service = max(sum(c.values()) for c in stub.counters.values()) / result["elapsed_s"]
+            print(f"{name:<28}{result['elapsed_s']:>8.2f}{result['calls_per_second']:>10.1f}{per_service:>26.1f}")
+            assert result["ok"] == total, result
+
+        # 中斷接續
+        set_rate(opts.rate)
+        stub.counters.clear()
+        try:
+            await asyncio.wait_for(run_job(materials, "bench-resume", opts.concurrency), timeout=opts.cancel_after)
+        except asyncio.TimeoutError:
+            pass
+        progress = json.loads(sap_server.get_master_data_job("bench-resume"))
+        first = sent(stub)
+        result = await run_job(materials, "bench-resume", opts.concurrency)
+        skipped = sum(t["skipped"] for t in result["tasks"].values())
+        print(f"\n中斷接續: 第一次 {opts.cancel_after:g} 秒後取消 (狀態 {progress['state']}，完成 {progress['ok']} 項，"
+              f"送出 {first} 個請求)；重新執行略過 {skipped} 項、送出 {result['calls']} 項；"
+              f"SAP 共收到 {sent(stub)} 個請求 / {total} 項")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run_master_data_job 吞吐量與中斷接續測試")
+    parser.add_argument("--materials", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=20.0, help="每個服務每秒的請求上限")
+    parser.add_argument("--cancel-after", type=float, default=3.0, help="中斷接續測試在幾秒後取消第一次執行")
+    asyncio.run(main(parser.parse_args()))
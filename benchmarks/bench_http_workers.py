@@ -0,0 +1,171 @@
+"""多工作程序 HTTP 部署的擴充性測試：1..N 個 uvicorn 工作程序的吞吐量與延遲
+
+對每個工作程序數啟動一次 `sap_server.py` (SAP_TRANSPORT=streamable-http、無狀態 HTTP、
+SQLite 共用狀態)，指向本機 SAP 模擬伺服器，由多個負載程序以 JSON-RPC tools/call
+呼叫 check_kitting_status (不同 BATCH_ID，避開狀態快取) 與 create_sto_po，
+輸出每秒請求數、p50/p95 延遲與相對 1 個工作程序的加速比。
+
+負載程序與伺服器在同一台主機上，加速比受 CPU 核心數限制。
+
+用法:
+    python benchmarks/bench_http_workers.py --max-workers 4 --duration 10 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVER = os.path.join(os.path.dirname(HERE), "sap_server.py")
+sys.path.insert(0, os.path.dirname(HERE))
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+
+HEADERS = {"accept": "application/json, text/event-stream", "content-type": "application/json"}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"伺服器未在 {timeout:.0f} 秒內啟動 (port {port})")
+
+
+def _request(rng, n: int) -> dict:
+    if rng.random() < 0.8:
+        name, args = "check_kitting_status", {"BATCH_ID": str(rng.randrange(1, 10 ** 9))}
+    else:
+        name, args = "create_sto_po", {"PR_NUMBER": f"{rng.randrange(10 ** 10):010d}", "PR_ITEM": "00010"}
+    return {"jsonrpc": "2.0", "id": n, "method": "tools/call", "params": {"name": name, "arguments": args}}
+
+
+async def _drive(url: str, concurrency: int, duration: float, seed: int, session: str):
+    import httpx
+
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    headers = dict(HEADERS, **{"x-sap-session": session})
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def worker(w):
+            nonlocal errors
+            n = 0
+            while time.perf_counter() < deadline:
+                n += 1
+                start = time.perf_counter()
+                try:
+                    r = await client.post(url, headers=headers, json=_request(rng, w * 10 ** 6 + n))
+                    ok = r.status_code == 200 and '"isError":false' in r.text.replace(" ", "")
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    return latencies, errors
+
+
+def _load_process(args):
+    return asyncio.run(_drive(*args))
+
+
+def run_level(workers: int, opts, stub_url: str, state_dir: str) -> dict:
+    port = _free_port()
+    env = dict(
+        os.environ,
+        SAP_BASE_URL=stub_url,
+        SAP_TRANSPORT="streamable-http",
+        SAP_HTTP_HOST="127.0.0.1",
+        SAP_HTTP_PORT=str(port),
+        SAP_HTTP_WORKERS=str(workers),
+        SAP_HTTP_STATELESS="1",
+        SAP_STATE_BACKEND=opts.state_backend,
+        SAP_STATE_PATH=os.path.join(state_dir, f"state-{workers}.sqlite3"),
+        SAP_JOURNAL_PATH=os.path.join(state_dir, f"journal-{workers}.sqlite3"),
+        SAP_MAX_CONCURRENCY=str(opts.concurrency),
+        SAP_POOL_SIZE=str(opts.concurrency),
+        FASTMCP_LOG_LEVEL="WARNING",
+    )
+    server = subprocess.Popen([sys.executable, SERVER], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_port(port)
+        url = f"http://127.0.0.1:{port}/mcp"
+        per_proc = max(1, opts.concurrency // opts.load_procs)
+        # 暖機：每個工作程序建立連線池與 SAPClient
+        _load_process((url, per_proc, 1.0, 0, "bench"))
+        jobs = [(url, per_proc, opts.duration, seed, "bench") for seed in range(1, opts.load_procs + 1)]
+        with multiprocessing.Pool(opts.load_procs) as pool:
+            results = pool.map(_load_process, jobs)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    latencies = sorted(lat for lats, _ in results for lat in lats)
+    errors = sum(err for _, err in results)
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] if latencies else 0.0
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / opts.duration,
+        "p50_ms": pct(50) * 1000,
+        "p95_ms": pct(95) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多工作程序 streamable-HTTP 擴充性測試")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--duration", type=float, default=10.0, help="每個工作程序數的測試秒數")
+    parser.add_argument("--concurrency", type=int, default=32, help="同時進行的請求數 (所有負載程序合計)")
+    parser.add_argument("--load-procs", type=int, default=2, help="負載程序數")
+    parser.add_argument("--latency", type=float, default=0.02, help="模擬 SAP 的回應延遲 (秒)")
+    parser.add_argument("--state-backend", default="sqlite", choices=("memory", "sqlite"))
+    parser.add_argument("--json", help="將結果寫入此檔案")
+    opts = parser.parse_args()
+
+    from sap_stub import SAPStubServer
+
+    levels = sorted({1, *range(2, opts.max_workers + 1, 2), opts.max_workers})
+    results = []
+    with tempfile.TemporaryDirectory() as state_dir, SAPStubServer(latency=opts.latency) as stub:
+        for workers in levels:
+            results.append(run_level(workers, opts, stub.base_url, state_dir))
+            r = results[-1]
+            print(f"workers={r['workers']:<3} {r['rps']:8.1f} req/s  p50 {r['p50_ms']:7.1f} ms  "
+                  f"p95 {r['p95_ms']:7.1f} ms  errors {r['errors']}", flush=True)
+
+    base = results[0]["rps"] or 1.0
+    print(f"\n{'workers':>8}{'req/s':>10}{'speedup':>9}{'p50 ms':>9}{'p95 ms':>9}")
+    for r in results:
+        print(f"{r['workers']:>8}{r['rps']:>10.1f}{r['rps'] / base:>9.2f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}")
+    print(f"\n(CPU 核心數 {os.cpu_count()}，{opts.load_procs} 個負載程序，同時 {opts.concurrency} 個請求)")
+    if opts.json:
+        with open(opts.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
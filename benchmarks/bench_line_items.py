@@ -0,0 +1,96 @@
+"""多明細測試：N 筆明細逐筆呼叫與 ITEMS 單次 (分段) 呼叫的 SAP 請求數與耗時
+
+對本機模擬伺服器 (每個請求 --latency 秒、每多一列明細 --row-latency 秒) 比較：
+1. 逐筆：create_sales_order 呼叫 N 次 (N 張銷售訂單)，與目前代理的做法相同
+2. ITEMS：create_sales_order 一次帶入 N 筆明細，依 SAP_ITEM_CHUNK_SIZE_SO 分段
+create_outbound_delivery / change_kitting_qty 同樣比較，並以業務錯誤比例 1 的模擬伺服器
+確認錯誤訊息 (RETURN 的 ROW) 對應回輸入的明細。
+
+以 mcp.call_tool() 呼叫 (與 MCP 客戶端相同的參數驗證與序列化路徑)。
+
+用法:
+    python benchmarks/bench_line_items.py [--lines 120] [--chunk-size 50] [--latency 0.2] [--row-latency 0.002]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+os.environ.setdefault("SAP_JOURNAL_PATH", os.path.join(tempfile.mkdtemp(), "journal.sqlite3"))
+
+import sap_server  # noqa: E402
+from sap_stub import SAPStubServer  # noqa: E402
+
+
+async def call(name: str, arguments: dict) -> dict:
+    content, _ = await sap_server.mcp.call_tool(name, arguments)
+    return json.loads(content[0].text)
+
+
+def cases(n: int):
+    """(工具, 逐筆呼叫的參數 list, ITEMS 呼叫的參數)"""
+    header = {"CUST_PO": "PO-LINES", "CUST_PO_DATE": "20260101"}
+    return (
+        ("create_sales_order",
+         [dict(header, MATERIAL=f"MAT-{i:05d}", QTY=i % 9 + 1) for i in range(n)],
+         dict(header, ITEMS=[{"MATERIAL": f"MAT-{i:05d}", "QTY": i % 9 + 1} for i in range(n)])),
+        ("create_outbound_delivery",
+         [{"PO_NUMBER": "4500000001", "ITEM_NO": f"{(i + 1) * 10:05d}", "QUANTITY": 1} for i in range(n)],
+         {"PO_NUMBER": "4500000001", "ITEMS": [{"QUANTITY": 1} for _ in range(n)]}),
+        ("change_kitting_qty",
+         [{"KITTING_PO": "4500000001", "PO_ITEM": f"{(i + 1) * 10:05d}", "QUANTITY": 2} for i in range(n)],
+         {"KITTING_PO": "4500000001", "ITEMS": [{"QUANTITY": 2} for _ in range(n)]}),
+    )
+
+
+def requests_sent(stub) -> int:
+    return sum(sum(c.values()) for c in stub.counters.values())
+
+
+async def main(opts):
+    sap_server.SAPConfig.ITEM_CHUNK_SIZE = opts.chunk_size
+    print(f"{opts.lines} 筆明細，每段最多 {opts.chunk_size} 筆，SAP 延遲 {opts.latency * 1000:.0f} ms "
+          f"+ 每列 {opts.row_latency * 1000:g} ms\n")
+    print(f"{'tool':<26}{'mode':<8}{'SAP 請求':>10}{'秒':>9}{'status':>10}")
+    with SAPStubServer(latency=opts.latency, row_latency=opts.row_latency) as stub:
+        sap_server.SAPConfig.set_base_url(stub.base_url)
+        for name, single, multi in cases(opts.lines):
+            stub.counters.clear()
+            t = time.perf_counter()
+            # 代理逐筆呼叫：每次等前一次結果
+            statuses = {(await call(name, args))["status"] for args in single}
+            print(f"{name:<26}{'逐筆':<8}{requests_sent(stub):>10}{time.perf_counter() - t:>9.2f}"
+                  f"{'/'.join(sorted(statuses)):>10}")
+
+            stub.counters.clear()
+            t = time.perf_counter()
+            result = await call(name, multi)
+            elapsed = time.perf_counter() - t
+            assert len(result["lines"]) == opts.lines, result
+            print(f"{'':<26}{'ITEMS':<8}{requests_sent(stub):>10}{elapsed:>9.2f}{result['status']:>10}")
+
+    # 錯誤訊息對應回明細
+    with SAPStubServer(business_error_rate=1.0, seed=1) as stub:
+        sap_server.SAPConfig.set_base_url(stub.base_url)
+        _, _, multi = cases(opts.lines)[0]
+        result = await call("create_sales_order", multi)
+        flagged = [line for line in result["lines"] if line.get("messages")]
+        print(f"\n業務錯誤: {len(result['chunks'])} 段皆為 {result['status']}，"
+              f"RETURN 指向的明細: " + ", ".join(f"line {l['line']} ({l['material']})" for l in flagged))
+        assert len(flagged) == len(result["chunks"]), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多明細單次呼叫測試")
+    parser.add_argument("--lines", type=int, default=120)
+    parser.add_argument("--chunk-size", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--row-latency", type=float, default=0.002)
+    asyncio.run(main(parser.parse_args()))
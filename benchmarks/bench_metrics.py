@@ -0,0 +1,72 @@
+"""效能指標開銷測試：service_metrics 的記錄成本與對整體呼叫的影響
+
+1. 單次 observe() / exchange() / timer() 的耗時
+2. 對本機模擬伺服器 (延遲 0) 連續呼叫 create_sto_po，比較開啟與關閉指標時的每次呼叫耗時
+
+用法:
+    python benchmarks/bench_metrics.py [CALLS]
+"""
+import asyncio
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CALLS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+
+import sap_server  # noqa: E402
+from sap_stub import SAPStubServer  # noqa: E402
+
+
+def micro():
+    metrics = sap_server.ServiceMetrics()
+    n = 200000
+    cases = {
+        "observe()": lambda: metrics.observe("SO", "network", 0.0123),
+        "exchange()": lambda: metrics.exchange("SO", 1500, 800, 200),
+        "with timer()": lambda: metrics.timer("SO", "format").__enter__().__exit__(None, None, None),
+    }
+    print(f"{'操作':<16}{'ns/次':>10}")
+    for name, fn in cases.items():
+        best = min(timeit.repeat(fn, number=n, repeat=5)) / n
+        print(f"{name:<16}{best * 1e9:>10.0f}")
+
+
+async def create_sto_po(client, values) -> str:
+    """create_sto_po 的 build -> 送出 -> 解析 -> format 流程 (不經過 FastMCP)"""
+    return sap_server._format_result("STO", "", await client.apost_soap_dict(client.build(values)), False)
+
+
+async def calls(enabled: bool) -> float:
+    sap_server.service_metrics.enabled = enabled
+    client = sap_server.session_registry.client("default", "STO")
+    values = {"PR_NUMBER": "0010000001", "PUR_ITEM": [{"BNFPO": "00010"}]}
+    for _ in range(50):
+        await create_sto_po(client, values)
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        await create_sto_po(client, values)
+    return (time.perf_counter() - start) / CALLS
+
+
+async def end_to_end():
+    rounds = {True: [], False: []}
+    for _ in range(3):
+        for enabled in (False, True):
+            rounds[enabled].append(await calls(enabled))
+    off, on = min(rounds[False]), min(rounds[True])
+    print(f"\n每次 create_sto_po 往返 (延遲 0 的模擬伺服器，{CALLS} 次取 3 輪最佳)")
+    print(f"  關閉指標: {off * 1e6:8.1f} µs")
+    print(f"  開啟指標: {on * 1e6:8.1f} µs  (+{(on - off) * 1e6:.1f} µs, {(on / off - 1) * 100:+.1f}%)")
+
+
+if __name__ == "__main__":
+    micro()
+    with SAPStubServer(latency=0) as stub:
+        sap_server.SAPConfig.set_base_url(stub.base_url)
+        asyncio.run(end_to_end())
@@ -0,0 +1,93 @@
+"""SOAP 回應解析效能測試：串流擷取 vs. xmltodict.parse + recursive_find
+
+產生含有大型 LAST_IMPORT / LAST_EXPORT JSON 內容的狀態回應，
+比較兩種解析方式的耗時與峰值記憶體 (tracemalloc)。
+
+用法:
+    python benchmarks/bench_parser.py [SIZE_MB ...]
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+
+import xmltodict  # noqa: E402
+
+import sap_server  # noqa: E402
+
+CHUNK = 65536
+REPEAT = 5
+
+
+def build_response(size_mb: float, prefix: str = "soap-env") -> bytes:
+    rows = max(1, int(size_mb * 1024 * 1024 / 2 / 120))
+    blob = json.dumps([
+        {"ITEM": f"{i:06d}", "MATERIAL": f"MAT-{i:08d}", "QTY": i % 97, "PLANT": "TP01", "NOTE": "x" * 40}
+        for i in range(rows)
+    ])
+    return (
+        f'<{prefix}:Envelope xmlns:{prefix}="http://schemas.xmlsoap.org/soap/envelope/">'
+        f'<{prefix}:Header/><{prefix}:Body>'
+        '<n0:ZAI_FLOW_STATUSResponse xmlns:n0="urn:sap-com:document:sap:rfc:functions">'
+        '<RETURN_DATA><LAST_ACTION>DN_CREATED</LAST_ACTION>'
+        f'<LAST_IMPORT>{escape(blob)}</LAST_IMPORT><LAST_EXPORT>{escape(blob)}</LAST_EXPORT>'
+        f'</RETURN_DATA></n0:ZAI_FLOW_STATUSResponse></{prefix}:Body></{prefix}:Envelope>'
+    ).encode("utf-8")
+
+
+def legacy_parse(payload: bytes):
+    # 舊流程: response.text -> xmltodict.parse -> Body -> recursive_find
+    text = payload.decode("utf-8")
+    parsed = xmltodict.parse(text)
+    env = parsed.get("soap-env:Envelope") or parsed.get("soapenv:Envelope") or parsed.get("SOAP-ENV:Envelope")
+    body = env.get("soap-env:Body") or env.get("soapenv:Body") or env.get("SOAP-ENV:Body")
+    return sap_server.recursive_find("RETURN_DATA", body)
+
+
+def stream_parse(payload: bytes):
+    extractor = sap_server.SOAPStreamExtractor(["RETURN_DATA"])
+    view = memoryview(payload)
+    for i in range(0, len(payload), CHUNK):
+        if extractor.feed(bytes(view[i:i + CHUNK])):
+            break
+    return extractor.results()["RETURN_DATA"]
+
+
+def measure(fn, payload):
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(payload)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    result = fn(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def main():
+    sizes = [float(a) for a in sys.argv[1:]] or [1, 4, 16]
+    print(f"{'size':>8} {'parser':>10} {'best time':>12} {'peak mem':>12}")
+    for size_mb in sizes:
+        for prefix in ("soap-env", "soapenv", "SOAP-ENV"):
+            payload = build_response(size_mb, prefix)
+            t_old, m_old, r_old = measure(legacy_parse, payload)
+            t_new, m_new, r_new = measure(stream_parse, payload)
+            assert r_old == r_new
+            if prefix != "soap-env":
+                continue
+            mb = len(payload) / 1024 / 1024
+            print(f"{mb:>6.1f}MB {'xmltodict':>10} {t_old * 1000:>10.1f}ms {m_old / 1024 / 1024:>10.1f}MB")
+            print(f"{mb:>6.1f}MB {'stream':>10} {t_new * 1000:>10.1f}ms {m_new / 1024 / 1024:>10.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""建立 / 維護工具結果大小測試：完整回應 (RAW=True) 與精簡 JSON 的 MCP 傳輸位元組數
+
+對本機模擬伺服器 (帶回請求表格參數，與實際 RFC 相同) 以 mcp.call_tool() 呼叫每個工具，
+將結果包成 tools/call 的 JSON-RPC 回應 (content + structuredContent) 後計算位元組數，
+分別量測成功與業務錯誤 (RETURN TYPE=E) 的回應。
+
+用法:
+    python benchmarks/bench_result_size.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+# 不寫入專案目錄的冪等日誌，也不讓維護快取影響結果
+os.environ.setdefault("SAP_JOURNAL_PATH", os.path.join(tempfile.mkdtemp(), "journal.sqlite3"))
+os.environ.setdefault("SAP_MAINT_CACHE_TTL", "0")
+
+import mcp.types as types  # noqa: E402
+
+import sap_server  # noqa: E402
+from sap_stub import SAPStubServer  # noqa: E402
+
+ARGUMENTS = {
+    "create_sales_order": {"CUST_PO": "PO20260101", "CUST_PO_DATE": "20260101", "MATERIAL": "MAT-000001", "QTY": 5},
+    "create_sto_po": {"PR_NUMBER": "0010000001", "PR_ITEM": "00010"},
+    "create_outbound_delivery": {"PO_NUMBER": "4500000001", "ITEM_NO": "00010", "QUANTITY": 5},
+    "maintain_info_record": {"MATERIAL": "MAT-000001"},
+    "maintain_sales_view": {"MATERIAL": "MAT-000001", "SALES_ORG": "TW01", "DISTR_CHAN": "03"},
+    "maintain_warehouse_view": {"MATERIAL": "MAT-000001"},
+    "maintain_source_list": {"MATERIAL": "MAT-000001", "VALID_FROM": "20260101"},
+    "change_kitting_qty": {"KITTING_PO": "4500000001", "PO_ITEM": "00010", "QUANTITY": 5},
+}
+
+
+def wire_bytes(content, structured) -> int:
+    """tools/call 回應在 MCP 傳輸上的 JSON 位元組數"""
+    result = types.CallToolResult(content=list(content), structuredContent=structured, isError=False)
+    response = types.JSONRPCResponse(jsonrpc="2.0", id=1, result=result.model_dump(by_alias=True, exclude_none=True))
+    return len(response.model_dump_json(by_alias=True, exclude_none=True).encode("utf-8"))
+
+
+async def measure(raw: bool) -> dict:
+    sizes = {}
+    for name, args in ARGUMENTS.items():
+        content, structured = await sap_server.mcp.call_tool(name, dict(args, RAW=raw))
+        sizes[name] = wire_bytes(content, structured)
+    return sizes
+
+
+async def main():
+    print(f"{'tool':<26}{'case':<10}{'RAW B':>9}{'compact B':>11}{'ratio':>8}")
+    totals = {}
+    for case, rate in (("success", 0.0), ("error", 1.0)):
+        with SAPStubServer(business_error_rate=rate, echo_tables=True) as stub:
+            sap_server.SAPConfig.set_base_url(stub.base_url)
+            raw, compact = await measure(True), await measure(False)
+        for name in ARGUMENTS:
+            print(f"{name:<26}{case:<10}{raw[name]:>9}{compact[name]:>11}{compact[name] / raw[name]:>8.2f}")
+            totals.setdefault(case, [0, 0])
+            totals[case][0] += raw[name]
+            totals[case][1] += compact[name]
+    for case, (r, c) in totals.items():
+        print(f"{'(total)':<26}{case:<10}{r:>9}{c:>11}{c / r:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+"""工作階段登錄記憶體測試：長時間多租戶使用下的記憶體用量與 session ID 解析成本
+
+以模擬時鐘重播 DAYS 天的使用：每小時有 SESSIONS_PER_HOUR 個新的 MCP 工作階段
+設定憑證並呼叫三個服務。比較無上限 (等同舊版 dict) 與預設 SESSION_MAX / SESSION_TTL
+的 SessionRegistry 在每天結束時的 tracemalloc 記憶體用量。
+
+用法:
+    python benchmarks/bench_sessions.py [DAYS] [SESSIONS_PER_HOUR]
+"""
+import gc
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DAYS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+SESSIONS_PER_HOUR = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+
+import sap_server  # noqa: E402
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class _RequestContext:
+    request_id = 1
+    # stdio 傳輸沒有 HTTP 請求
+    request = None
+
+
+class _ClientParams:
+    """模擬 InitializeRequestParams：str() 需要序列化整個結構"""
+    def __init__(self, n):
+        self.client_info = {"name": f"agent-{n}", "version": "1.0.0"}
+        self.capabilities = {"roots": {"listChanged": True}, "sampling": {}, "experimental": {"x": list(range(20))}}
+
+    def __str__(self):
+        return f"protocolVersion='2025-06-18' capabilities={self.capabilities} clientInfo={self.client_info}"
+
+
+class _Session:
+    def __init__(self, n):
+        self.client_params = _ClientParams(n)
+
+
+class _Context:
+    request_context = _RequestContext()
+
+    def __init__(self, session):
+        self.session = session
+
+
+def simulate(registry, clock) -> list:
+    usage = []
+    n = 0
+    for day in range(DAYS):
+        for hour in range(24):
+            for _ in range(SESSIONS_PER_HOUR):
+                n += 1
+                clock.now = (day * 24 + hour) * 3600 + n % 3600
+                ctx = _Context(_Session(n))
+                session_id = sap_server._get_session_id(ctx)
+                registry.set_credentials(session_id, f"USER{n % 50}", "secret")
+                for key in ("SO", "STO", "STATUS"):
+                    registry.client(session_id, key)
+                # MCP 工作階段結束
+                del ctx
+        gc.collect()
+        usage.append(tracemalloc.get_traced_memory()[0])
+    return usage
+
+
+def resolution_cost():
+    session = _Session(0)
+    ctx = _Context(session)
+    sap_server._get_session_id(ctx)
+    n = 200000
+    cached = min(timeit.repeat(lambda: sap_server._get_session_id(ctx), number=n, repeat=5)) / n
+
+    def uncached():
+        sap_server._session_ids.pop(session, None)
+        sap_server._get_session_id(ctx)
+    fresh = min(timeit.repeat(uncached, number=n, repeat=5)) / n
+    return cached, fresh
+
+
+if __name__ == "__main__":
+    cached, fresh = resolution_cost()
+    print(f"_get_session_id: 每次重新計算 {fresh * 1e9:.0f} ns，工作階段快取 {cached * 1e9:.0f} ns")
+
+    results = {}
+    for name, max_sessions, ttl in (
+        ("無上限", 10 ** 9, float("inf")),
+        (f"SESSION_MAX={sap_server.SAPConfig.SESSION_MAX}, TTL={sap_server.SAPConfig.SESSION_TTL:g}s",
+         sap_server.SAPConfig.SESSION_MAX, sap_server.SAPConfig.SESSION_TTL),
+    ):
+        clock = _Clock()
+        gc.collect()
+        tracemalloc.start()
+        registry = sap_server.SessionRegistry(max_sessions=max_sessions, ttl=ttl, clock=clock)
+        results[name] = (simulate(registry, clock), registry.stats())
+        del registry
+        tracemalloc.stop()
+
+    print(f"\n{DAYS} 天，每小時 {SESSIONS_PER_HOUR} 個新工作階段 (每天結束時的記憶體用量)")
+    for name, (usage, stats) in results.items():
+        days = "  ".join(f"{u / 2 ** 20:7.1f}" for u in usage)
+        print(f"  {name:<40} MiB: {days}   (保留 {stats['sessions']} 個工作階段)")
@@ -0,0 +1,149 @@
+"""冷啟動測試：匯入耗時分解 (-X importtime) 與第一次 tools/list 的回應時間
+
+1. 以 `python -X importtime -c "import sap_server"` 取得每個頂層套件的累計匯入耗時
+   以及 sap_server 本身 (模組層級程式碼) 的耗時
+2. 如同 MCP 客戶端，以 stdio 啟動 `sap_server.py`，送出 initialize / initialized /
+   tools/list，量測由啟動程序到收到 tools/list 回應的時間
+
+3. 確認 LAZY_MODULES 在啟動時沒有被匯入 (只在第一次使用時載入)
+
+取 RUNS 次的中位數；超過 --budget-ms 或有延遲載入的模組被提早匯入時以結束碼 1 結束
+(可放在 CI 追蹤)。
+
+用法:
+    python benchmarks/bench_startup.py [--runs 5] [--budget-ms 1500] [--import-budget-ms 1000]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+SERVER = os.path.join(ROOT, "sap_server.py")
+
+# sap_server 在第一次使用時才匯入的模組
+LAZY_MODULES = ("xmltodict", "sqlite3")
+
+ENV = dict(os.environ, SAP_USER=os.environ.get("SAP_USER", "BENCH"), SAP_PASSWORD=os.environ.get("SAP_PASSWORD", "BENCH"))
+
+
+def import_breakdown():
+    """回傳 (總耗時 µs, {sap_server 直接匯入的模組: 累計 µs}, sap_server 本身 µs)"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import sap_server"],
+        cwd=ROOT, env=ENV, capture_output=True, text=True, check=True,
+    )
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # 每一層巢狀匯入縮排 2 格；子模組先於父模組輸出
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(self_us), int(cumulative_us)))
+
+    modules = {}
+    total = own = 0
+    for index, (depth, name, self_us, cumulative_us) in enumerate(entries):
+        if depth == 0 and name == "sap_server":
+            total, own = cumulative_us, self_us
+            # sap_server 之前、直到上一個深度 0 項目為止的都是它匯入的模組
+            for child_depth, child, _, child_us in reversed(entries[:index]):
+                if child_depth == 0:
+                    break
+                if child_depth == 1:
+                    modules[child] = modules.get(child, 0) + child_us
+    return total, modules, own
+
+
+def eager_lazy_modules() -> list:
+    """匯入 sap_server 後已載入的 LAZY_MODULES"""
+    proc = subprocess.run(
+        [sys.executable, "-c", f"import sys, sap_server; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"],
+        cwd=ROOT, env=ENV, capture_output=True, text=True, check=True,
+    )
+    return [m for m in proc.stdout.strip().split(",") if m]
+
+
+def time_to_tools_list() -> tuple:
+    """回傳 (啟動到 initialize 回應秒數, 啟動到 tools/list 回應秒數, 工具數)"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, SERVER], cwd=ROOT, env=ENV,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+
+    def send(message):
+        proc.stdin.write(json.dumps(message) + "\n")
+        proc.stdin.flush()
+
+    def receive(request_id):
+        while True:
+            line = proc.stdout.readline()
+            if not line:
+                raise RuntimeError("sap_server.py 提早結束")
+            message = json.loads(line)
+            if message.get("id") == request_id:
+                return message
+
+    try:
+        send({"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {
+            "protocolVersion": "2025-06-18", "capabilities": {},
+            "clientInfo": {"name": "bench_startup", "version": "1.0"},
+        }})
+        receive(1)
+        initialized = time.perf_counter() - start
+        send({"jsonrpc": "2.0", "method": "notifications/initialized"})
+        send({"jsonrpc": "2.0", "id": 2, "method": "tools/list"})
+        tools = receive(2)["result"]["tools"]
+        listed = time.perf_counter() - start
+    finally:
+        proc.stdin.close()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return initialized, listed, len(tools)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sap_server.py 冷啟動測試")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="啟動到第一次 tools/list 回應的上限")
+    parser.add_argument("--import-budget-ms", type=float, default=1000.0, help="import sap_server 的上限")
+    parser.add_argument("--top", type=int, default=12, help="列出耗時最多的模組數")
+    args = parser.parse_args()
+
+    imports = [import_breakdown() for _ in range(args.runs)]
+    best_total, best_packages, best_own = min(imports, key=lambda r: r[0])
+    print(f"import sap_server (最佳 {args.runs} 次): {best_total / 1000:.1f} ms，模組本身 {best_own / 1000:.1f} ms")
+    print(f"{'sap_server 匯入的模組':<40}{'累計 ms':>10}")
+    for name, us in sorted(best_packages.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"  {name:<38}{us / 1000:>10.1f}")
+
+    runs = [time_to_tools_list() for _ in range(args.runs)]
+    initialized = statistics.median(r[0] for r in runs) * 1000
+    listed = statistics.median(r[1] for r in runs) * 1000
+    print(f"\n啟動 -> initialize 回應: {initialized:7.1f} ms (中位數)")
+    print(f"啟動 -> tools/list 回應: {listed:7.1f} ms (中位數，{runs[0][2]} 個工具)，上限 {args.budget_ms:.0f} ms")
+
+    eager = eager_lazy_modules()
+    print(f"啟動時已匯入的延遲載入模組: {', '.join(eager) or '(無)'}")
+
+    import_ms = statistics.median(r[0] for r in imports) / 1000
+    over = [f"提早匯入 {', '.join(eager)}"] if eager else []
+    if import_ms > args.import_budget_ms:
+        over.append(f"import {import_ms:.0f} ms > {args.import_budget_ms:.0f} ms")
+    if listed > args.budget_ms:
+        over.append(f"tools/list {listed:.0f} ms > {args.budget_ms:.0f} ms")
+    if over:
+        print("超過預算: " + "; ".join(over))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
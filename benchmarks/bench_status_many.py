@@ -0,0 +1,54 @@
+"""批次狀態查詢吞吐量測試：check_kitting_status_many 在不同並行上限下的表現
+
+對每次回應延遲 LATENCY 秒的本機模擬伺服器查詢 N 個不同的 BATCH_ID，
+量測各並行上限下每秒可完成的查詢數。
+
+用法:
+    python benchmarks/bench_status_many.py [N] [LATENCY]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+CONCURRENCY = (1, 4, 8, 16, 32)
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+os.environ.setdefault("SAP_MAX_CONCURRENCY_STATUS", str(max(CONCURRENCY)))
+os.environ.setdefault("SAP_POOL_SIZE", str(max(CONCURRENCY)))
+# 每一輪都查詢相同的 BATCH_ID，關閉快取以量測真正的上游吞吐量
+os.environ.setdefault("SAP_STATUS_CACHE_TTL", "0")
+
+import sap_server  # noqa: E402
+from sap_stub import SAPStubServer  # noqa: E402
+
+
+async def run(base_url: str):
+    sap_server.SAPConfig.set_base_url(base_url)
+    batch_ids = [str(i) for i in range(1, N + 1)]
+    results = []
+    for concurrency in CONCURRENCY:
+        start = time.perf_counter()
+        table = await sap_server.check_kitting_status_many(BATCH_IDS=batch_ids, MAX_CONCURRENCY=concurrency)
+        elapsed = time.perf_counter() - start
+        assert f"成功 {N}，" in table, table.splitlines()[-1]
+        results.append((concurrency, elapsed))
+    return results
+
+
+def main():
+    with SAPStubServer(latency=LATENCY) as stub:
+        results = asyncio.run(run(stub.base_url))
+    print(f"batch ids: {N}, stub latency: {LATENCY * 1000:.0f}ms")
+    print(f"{'concurrency':>12} {'wall time':>10} {'ids/s':>10}")
+    for concurrency, elapsed in results:
+        print(f"{concurrency:>12} {elapsed:>9.2f}s {N / elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""狀態查詢輸出測試：完整縮排輸出與欄位選取 / 分頁 / 摘要的回應大小與格式化耗時
+
+以合成的 RETURN_DATA (LAST_IMPORT 含 ROWS 筆明細) 直接呼叫 check_kitting_status 的格式化函式，
+不經過網路。「首次」為清除解析快取後的耗時，「分頁」為同一份資料連續翻頁時每頁的耗時。
+
+用法:
+    python benchmarks/bench_status_projection.py [ROWS]
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+
+import sap_server  # noqa: E402
+
+BATCH_ID = "0000000000000001"
+
+
+def make_found(rows: int) -> dict:
+    items = [{"ITEM": f"{(i + 1) * 10:06d}", "MATERIAL": f"MAT-{i:06d}", "QTY": i % 7 + 1,
+              "PLANT": "TP01", "STATUS": "OPEN", "TEXT": f"Kitting component {i}"} for i in range(rows)]
+    last_import = json.dumps({"BATCH_ID": BATCH_ID, "ITEMS": items})
+    last_export = json.dumps({"RESULT": "S", "DOCUMENTS": [f"{4500000000 + i}" for i in range(rows // 10)]})
+    return {"RETURN_DATA": {"LAST_ACTION": "DN_CREATED", "LAST_IMPORT": last_import, "LAST_EXPORT": last_export}}
+
+
+def main():
+    found = make_found(ROWS)
+    raw_bytes = sum(len(v.encode("utf-8")) for v in found["RETURN_DATA"].values())
+    cases = {
+        "完整 (縮排)": lambda: sap_server._format_status(BATCH_ID, found, None),
+        "SUMMARY": lambda: sap_server._project_status(BATCH_ID, found, None, "", "", 0, True),
+        "FIELDS=/LAST_EXPORT/RESULT": lambda: sap_server._project_status(
+            BATCH_ID, found, None, "/LAST_EXPORT/RESULT", "", 0, False),
+        "ITEMS LIMIT=50": lambda: sap_server._project_status(
+            BATCH_ID, found, None, "/LAST_IMPORT/ITEMS", "", 50, False),
+    }
+    print(f"LAST_IMPORT / LAST_EXPORT 原始大小 {raw_bytes / 1024:.0f} KiB ({ROWS} 筆明細)\n")
+    print(f"{'模式':<30}{'回應 KiB':>10}{'首次 ms':>10}{'分頁 ms':>10}")
+    for name, fn in cases.items():
+        size = len(fn().encode("utf-8"))
+
+        def cold():
+            sap_server._parsed_status_json.clear()
+            fn()
+        first = min(timeit.repeat(cold, number=1, repeat=5))
+        warm = min(timeit.repeat(fn, number=1, repeat=5))
+        print(f"{name:<30}{size / 1024:>10.1f}{first * 1000:>10.1f}{warm * 1000:>10.1f}")
+
+    # 逐頁讀完全部明細
+    pages, cursor = 0, ""
+    while True:
+        page = json.loads(sap_server._project_status(BATCH_ID, found, None, "/LAST_IMPORT/ITEMS", cursor, 500, False))
+        pages += 1
+        cursor = page.get("next_cursor")
+        if not cursor:
+            break
+    print(f"\nLIMIT=500 翻完 {ROWS} 筆明細共 {pages} 頁")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""端對端負載測試：透過 MCP 工具呼叫對 SAP (或本機模擬伺服器) 施加負載
+
+以 mcp.call_tool() 呼叫工具 (與 MCP 客戶端相同的參數驗證與序列化路徑)，
+N 個虛擬客戶端依權重隨機挑選工具，持續 DURATION 秒或總共 REQUESTS 次，
+最後輸出每個工具的呼叫數、錯誤分類、吞吐量與 p50/p95/p99 延遲。
+
+未指定 --base-url 時在同一個程序內啟動 benchmarks/sap_stub.py 的模擬伺服器。
+
+用法:
+    python benchmarks/load_harness.py --clients 16 --duration 10 --latency 0.05
+    python benchmarks/load_harness.py --base-url http://127.0.0.1:8080 --requests 2000
+    python benchmarks/load_harness.py --mix check_kitting_status=5,create_sales_order=1
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 預設工具權重：狀態查詢為主，其餘為建立單據與主資料維護
+DEFAULT_MIX = {
+    "check_kitting_status": 10,
+    "create_sales_order": 2,
+    "create_sto_po": 2,
+    "create_outbound_delivery": 2,
+    "maintain_info_record": 1,
+    "maintain_sales_view": 1,
+    "maintain_warehouse_view": 1,
+    "maintain_source_list": 1,
+    "change_kitting_qty": 1,
+}
+
+
+def _material(rng):
+    return f"MAT-{rng.randrange(1000000):06d}"
+
+
+# 每個工具的隨機參數產生器
+ARGUMENTS = {
+    "check_kitting_status": lambda rng: {"BATCH_ID": str(rng.randrange(1, 500))},
+    "create_sales_order": lambda rng: {
+        "CUST_PO": f"PO{rng.randrange(10 ** 8):08d}", "CUST_PO_DATE": "20260101",
+        "MATERIAL": _material(rng), "QTY": rng.randrange(1, 100),
+    },
+    "create_sto_po": lambda rng: {"PR_NUMBER": f"{rng.randrange(10 ** 10):010d}", "PR_ITEM": "00010"},
+    "create_outbound_delivery": lambda rng: {
+        "PO_NUMBER": str(4500000000 + rng.randrange(10 ** 6)), "ITEM_NO": "00010", "QUANTITY": rng.randrange(1, 100),
+    },
+    "maintain_info_record": lambda rng: {"MATERIAL": _material(rng)},
+    "maintain_sales_view": lambda rng: {"MATERIAL": _material(rng), "SALES_ORG": "TW01", "DISTR_CHAN": "03"},
+    "maintain_warehouse_view": lambda rng: {"MATERIAL": _material(rng)},
+    "maintain_source_list": lambda rng: {"MATERIAL": _material(rng), "VALID_FROM": "20260101"},
+    "run_kitting_pipeline": lambda rng: {
+        "CUST_PO": f"PO{rng.randrange(10 ** 8):08d}", "CUST_PO_DATE": "20260101",
+        "MATERIAL": _material(rng), "QTY": rng.randrange(1, 100),
+    },
+    "change_kitting_qty": lambda rng: {
+        "KITTING_PO": str(4500000000 + rng.randrange(10 ** 6)), "PO_ITEM": "00010", "QUANTITY": rng.randrange(1, 100),
+    },
+}
+
+
+def classify(text: str) -> str:
+    """依工具回傳文字分類結果：ok / business / http / connection / parse"""
+    if text.startswith("連線錯誤") or "TYPE:          連線錯誤" in text:
+        return "connection"
+    if text.startswith("HTTP 錯誤") or text.startswith("[ERROR] HTTP"):
+        return "http"
+    if text.startswith("{\n  \"status\": \"FAILED\""):
+        return "business"
+    if text.startswith('{"service"'):
+        # 建立 / 維護工具的精簡 JSON 結果
+        status = json.loads(text).get("status")
+        return {"OK": "ok", "ERROR": "business", "CONFLICT": "business", "HTTP_ERROR": "http",
+                "CONNECTION_ERROR": "connection", "PARSE_ERROR": "parse"}.get(status, "ok")
+    if text.startswith("[ERROR]"):
+        return "parse" if "解析" in text else "business"
+    # 工具回傳 RFC 回應的 dict 文字，RETURN 表格中 TYPE 為 E/A 即為業務錯誤
+    if "'TYPE': 'E'" in text or "'TYPE': 'A'" in text:
+        return "business"
+    return "ok"
+
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ARGUMENTS:
+            raise SystemExit(f"未知的工具: {name} (可用: {', '.join(ARGUMENTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def client(sap_server, mix, rng, deadline, budget, samples):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    while time.perf_counter() < deadline:
+        if budget is not None:
+            if budget[0] <= 0:
+                return
+            budget[0] -= 1
+        name = rng.choices(names, weights)[0]
+        args = ARGUMENTS[name](rng)
+        start = time.perf_counter()
+        try:
+            content, _ = await sap_server.mcp.call_tool(name, args)
+            outcome = classify(content[0].text if content else "")
+        except Exception:
+            outcome = "exception"
+        samples.append((name, time.perf_counter() - start, outcome))
+
+
+def report(samples, elapsed: float):
+    outcomes = ("ok", "business", "http", "connection", "parse", "exception")
+    by_tool = {}
+    for name, latency, outcome in samples:
+        by_tool.setdefault(name, []).append((latency, outcome))
+
+    header = f"{'tool':<26}{'calls':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  errors"
+    lines = [header, "-" * len(header)]
+    rows = sorted(by_tool.items()) + [("(total)", [(lat, out) for _, lat, out in samples])]
+    for name, entries in rows:
+        latencies = sorted(lat for lat, _ in entries)
+        counts = {o: 0 for o in outcomes}
+        for _, out in entries:
+            counts[out] += 1
+        errors = ", ".join(f"{o}={counts[o]}" for o in outcomes[1:] if counts[o]) or "-"
+        lines.append(
+            f"{name:<26}{len(entries):>7}{len(entries) / elapsed:>9.1f}"
+            f"{percentile(latencies, 50) * 1000:>9.1f}{percentile(latencies, 95) * 1000:>9.1f}"
+            f"{percentile(latencies, 99) * 1000:>9.1f}  {errors}"
+        )
+    return "\n".join(lines)
+
+
+async def run(args, sap_server):
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    rng = random.Random(args.seed)
+    samples = []
+    budget = [args.requests] if args.requests else None
+    start = time.perf_counter()
+    deadline = start + (args.duration if not args.requests else float("inf"))
+    await asyncio.gather(*(
+        client(sap_server, mix, random.Random(rng.random()), deadline, budget, samples)
+        for _ in range(args.clients)
+    ))
+    elapsed = time.perf_counter() - start
+    print(report(samples, elapsed))
+    print(f"\n{args.clients} 個虛擬客戶端，{elapsed:.2f} 秒，共 {len(samples)} 次呼叫")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"elapsed": elapsed, "clients": args.clients,
+                       "samples": [{"tool": n, "latency": lat, "outcome": o} for n, lat, o in samples]}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SAP MCP 工具端對端負載測試")
+    parser.add_argument("--base-url", help="SAP (或已啟動的模擬伺服器) 位址；未指定時啟動內建模擬伺服器")
+    parser.add_argument("--clients", type=int, default=8, help="虛擬客戶端數")
+    parser.add_argument("--duration", type=float, default=10.0, help="測試秒數")
+    parser.add_argument("--requests", type=int, default=0, help="總呼叫次數 (指定時忽略 --duration)")
+    parser.add_argument("--mix", help="工具權重，例如 check_kitting_status=5,create_sales_order=1")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="將每次呼叫的原始樣本寫入此檔案")
+    stub_opts = parser.add_argument_group("內建模擬伺服器")
+    stub_opts.add_argument("--latency", type=float, default=0.05)
+    stub_opts.add_argument("--jitter", type=float, default=0.01)
+    stub_opts.add_argument("--fault-rate", type=float, default=0.0)
+    stub_opts.add_argument("--business-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    # 必須在匯入 sap_server 之前設定，SAPConfig 在匯入時讀取環境變數
+    os.environ.setdefault("SAP_USER", "BENCH")
+    os.environ.setdefault("SAP_PASSWORD", "BENCH")
+    os.environ.setdefault("SAP_POOL_SIZE", str(args.clients))
+    os.environ.setdefault("SAP_MAX_CONCURRENCY", str(args.clients))
+    if args.base_url:
+        os.environ["SAP_BASE_URL"] = args.base_url
+
+    import sap_server
+    from sap_stub import SAPStubServer
+
+    stub = None
+    if not args.base_url:
+        stub = SAPStubServer(
+            latency=args.latency, jitter=args.jitter, fault_rate=args.fault_rate,
+            business_error_rate=args.business_error_rate,
+            user=os.environ["SAP_USER"], password=os.environ["SAP_PASSWORD"], seed=args.seed,
+        ).start()
+        sap_server.SAPConfig.set_base_url(stub.base_url)
+    try:
+        asyncio.run(run(args, sap_server))
+    finally:
+        if stub is not None:
+            stub.stop()
+            print(f"模擬伺服器計數: {json.dumps(stub.counters, sort_keys=True)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""流量重播測試：以目前版本的 SAPClient 重新送出紀錄的 SAP 流量並比較效能
+
+1. 讀取 SAP_RECORD_PATH 紀錄 (例如正式環境一天的流量)
+2. 在同一個程序內啟動 benchmarks/sap_replay.py 的重播伺服器，依紀錄回傳相同的回應與耗時
+3. 依紀錄的送出時間 (除以 --speed) 排程，以 SAPClient 送出每個請求：
+   STATUS 與 check_kitting_status 相同以串流擷取 RETURN_DATA，其餘與建立 / 維護工具相同
+   解析整個 Envelope
+4. 輸出每個服務的呼叫數、吞吐量、p50/p95 延遲與 service_metrics 的 parse / network 耗時
+
+--json 將結果寫入檔案；--compare 讀取另一個版本的結果並列出差異，
+例如在兩個 commit 上各執行一次比較解析器與吞吐量。
+
+用法:
+    python benchmarks/replay_traffic.py traffic.jsonl.gz --speed 10 --json new.json --compare old.json
+    python benchmarks/replay_traffic.py traffic.jsonl.gz --speed 0 --concurrency 32   # 不依紀錄時間，盡快送出
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SAP_USER", "BENCH")
+os.environ.setdefault("SAP_PASSWORD", "BENCH")
+
+import sap_server  # noqa: E402
+from sap_replay import SAPReplayServer, read_log  # noqa: E402
+
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def send(client, request: bytes) -> bool:
+    """送出一個紀錄的請求，回傳是否成功取得 (已解析的) 回應"""
+    if client.key == "STATUS":
+        found, _ = await client.apost_soap_extract(request, ["RETURN_DATA"])
+        return found is not None
+    body, _ = await client.apost_soap_dict(request)
+    return body is not None
+
+
+async def replay(entries, speed: float, concurrency: int) -> tuple:
+    """回傳 ({service: [(latency, ok), ...]}, elapsed)"""
+    clients = {key: sap_server.SAPClient(key, os.environ["SAP_USER"], os.environ["SAP_PASSWORD"])
+               for key in sap_server.SAPConfig.SERVICES}
+    semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+    samples = {}
+    t0 = entries[0]["ts"] if entries else 0.0
+    start = time.perf_counter()
+
+    async def one(entry):
+        if speed > 0:
+            delay = (entry["ts"] - t0) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            sent = time.perf_counter()
+            # 每個請求給予獨立的工具期限
+            sap_server._deadline.set(time.monotonic() + sap_server.SAPConfig.TOOL_DEADLINE)
+            ok = await send(clients[entry["service"]], entry["request"].encode("utf-8"))
+            samples.setdefault(entry["service"], []).append((time.perf_counter() - sent, ok))
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    await asyncio.gather(*(one(entry) for entry in entries if entry["service"] in clients))
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples: dict, elapsed: float) -> dict:
+    metrics = sap_server.service_metrics.stats()["services"]
+    results = {}
+    for key in sorted(samples):
+        latencies = sorted(lat for lat, _ in samples[key])
+        phases = metrics.get(key, {}).get("phases", {})
+        results[key] = {
+            "calls": len(latencies),
+            "errors": sum(1 for _, ok in samples[key] if not ok),
+            "rps": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "parse_avg_ms": phases.get("parse", {}).get("avg_ms", 0.0),
+            "parse_p95_ms": phases.get("parse", {}).get("p95_ms", 0.0),
+            "network_avg_ms": phases.get("network", {}).get("avg_ms", 0.0),
+        }
+    all_latencies = sorted(lat for rows in samples.values() for lat, _ in rows)
+    results["(total)"] = {
+        "calls": len(all_latencies),
+        "errors": sum(r["errors"] for r in results.values()),
+        "rps": len(all_latencies) / elapsed,
+        "p50_ms": percentile(all_latencies, 50) * 1000,
+        "p95_ms": percentile(all_latencies, 95) * 1000,
+        "parse_avg_ms": sum(r["parse_avg_ms"] * r["calls"] for r in results.values()) / max(1, len(all_latencies)),
+        "parse_p95_ms": max((r["parse_p95_ms"] for r in results.values()), default=0.0),
+        "network_avg_ms": sum(r["network_avg_ms"] * r["calls"] for r in results.values()) / max(1, len(all_latencies)),
+    }
+    return {"elapsed": elapsed, "services": results}
+
+
+COLUMNS = (("calls", "calls", "d"), ("errors", "err", "d"), ("rps", "req/s", ".1f"), ("p50_ms", "p50 ms", ".1f"),
+           ("p95_ms", "p95 ms", ".1f"), ("parse_avg_ms", "parse ms", ".3f"), ("parse_p95_ms", "parse p95", ".3f"))
+
+
+def report(result: dict, baseline: dict = None) -> str:
+    header = f"{'service':<10}" + "".join(f"{title:>11}" for _, title, _ in COLUMNS)
+    lines = [header, "-" * len(header)]
+    for key, row in result["services"].items():
+        lines.append(f"{key:<10}" + "".join(f"{row[name]:>11{fmt}}" for name, _, fmt in COLUMNS))
+        old = (baseline or {}).get("services", {}).get(key)
+        if old:
+            # 相對基準的變化 (正值 = 較多 / 較慢)
+            cells = []
+            for name, _, _ in COLUMNS:
+                cells.append(f"{(row[name] / old[name] - 1) * 100:>+10.1f}%" if old[name] else f"{'-':>11}")
+            lines.append(f"{'  vs base':<10}" + "".join(cells))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SAP 流量重播測試")
+    parser.add_argument("log", help="SAP_RECORD_PATH 寫入的紀錄檔")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="時間縮放：送出間隔與 SAP 回應時間皆除以此值 (0 = 盡快送出且不等待)")
+    parser.add_argument("--concurrency", type=int, default=0, help="同時進行的請求上限 (0 = 不限制)")
+    parser.add_argument("--limit", type=int, default=0, help="只重播前 N 筆")
+    parser.add_argument("--json", help="將結果寫入此檔案")
+    parser.add_argument("--compare", help="與另一次執行的 --json 結果比較")
+    args = parser.parse_args()
+
+    entries = read_log(args.log)
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        raise SystemExit(f"{args.log} 沒有任何紀錄")
+    span = entries[-1]["ts"] - entries[0]["ts"]
+    print(f"{len(entries)} 筆紀錄，涵蓋 {span:.1f} 秒，speed={args.speed:g}\n")
+
+    if args.concurrency:
+        sap_server.SAPConfig.MAX_CONCURRENCY = max(sap_server.SAPConfig.MAX_CONCURRENCY, args.concurrency)
+    with SAPReplayServer(entries, speed=args.speed) as server:
+        sap_server.SAPConfig.set_base_url(server.base_url)
+        samples, elapsed = asyncio.run(replay(entries, args.speed, args.concurrency))
+    result = summarize(samples, elapsed)
+    result["speed"] = args.speed
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(report(result, baseline))
+    print(f"\n{elapsed:.2f} 秒；重播伺服器: {json.dumps(server.counters, sort_keys=True)}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""SAP 流量重播伺服器：依 SAP_RECORD_PATH 紀錄的回應重播 SAP ICM SOAP 端點
+
+讀取 sap_server.TrafficRecorder 寫入的 gzip JSON Lines 紀錄，對每個請求：
+- 以請求 Envelope (密碼類欄位遮蔽後) 的 SHA-256 找出紀錄中相同的請求，依序回傳其回應；
+  同一請求出現多次時依紀錄順序輪流回傳
+- 找不到相同請求時，回傳該服務紀錄中的下一筆回應 (依紀錄順序輪流)
+- 回應前等待紀錄的 network 耗時除以 speed (speed=0 表示不等待)
+- 回傳紀錄的 HTTP 狀態碼與回應本文
+
+與 sap_stub.py 相同以 ThreadingHTTPServer 實作，接受任何 Basic 認證。
+
+用法:
+    SAP_RECORD_PATH=traffic.jsonl.gz uv run sap_server.py        # 紀錄
+    python benchmarks/sap_replay.py traffic.jsonl.gz --port 8080 --speed 2
+    SAP_BASE_URL=http://127.0.0.1:8080 uv run sap_server.py      # 以紀錄的回應執行
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sap_server import SAPConfig, _SECRET_ELEMENTS  # noqa: E402
+from sap_stub import _Server, _fault  # noqa: E402
+
+
+def read_log(path: str) -> list:
+    """讀取流量紀錄，回傳依 ts 排序的紀錄 list (略過寫入中斷的最後一行)"""
+    entries = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        except EOFError:
+            # 程序中途結束時最後一個 gzip member 可能不完整
+            pass
+    entries.sort(key=lambda e: e["ts"])
+    return entries
+
+
+def request_digest(request: str) -> str:
+    return hashlib.sha256(_SECRET_ELEMENTS.sub(r"\1***\3", request).encode("utf-8")).hexdigest()
+
+
+class _Rotation:
+    """依紀錄順序輪流取出回應"""
+    __slots__ = ("entries", "next")
+
+    def __init__(self):
+        self.entries = []
+        self.next = 0
+
+    def take(self) -> dict:
+        entry = self.entries[self.next % len(self.entries)]
+        self.next += 1
+        return entry
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _reply(self, status: int, payload: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        replay = self.server.stub
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8", "replace")
+
+        key = replay.routes.get(urlsplit(self.path).path)
+        if key is None or not (self.headers.get("Authorization") or "").startswith("Basic "):
+            replay.count("unknown" if key is None else key, "rejected")
+            self._reply(404 if key is None else 401, _fault(f"No replay for {self.path}", "soap-env:Client"))
+            return
+
+        entry, outcome = replay.lookup(key, body)
+        if entry is None:
+            replay.count(key, "missing")
+            self._reply(500, _fault(f"No recorded response for service {key}"))
+            return
+        replay.count(key, outcome)
+        if replay.speed > 0 and entry["network"] > 0:
+            time.sleep(entry["network"] / replay.speed)
+        self._reply(entry["status"], entry["response"].encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SAPReplayServer:
+    """在背景執行緒中啟動的 SAP 流量重播伺服器
+
+    參數:
+        entries: read_log() 的結果或紀錄檔路徑
+        speed: 回應時間的縮放 (2 = 以紀錄的一半時間回應；0 = 不等待)
+    """
+
+    def __init__(self, entries, host: str = "127.0.0.1", port: int = 0, speed: float = 1.0):
+        if isinstance(entries, str):
+            entries = read_log(entries)
+        self.speed = speed
+        self.routes = {urlsplit(cfg["path"]).path: key for key, cfg in SAPConfig.SERVICES.items()}
+        self._by_request = {}
+        self._by_service = {}
+        for entry in entries:
+            self._by_request.setdefault((entry["service"], request_digest(entry["request"])), _Rotation()).entries.append(entry)
+            self._by_service.setdefault(entry["service"], _Rotation()).entries.append(entry)
+        self._lock = threading.Lock()
+        self.counters = {}
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.stub = self
+        self._thread = None
+
+    def lookup(self, key: str, request: str):
+        """回傳 (紀錄, "exact" | "fallback")；該服務沒有任何紀錄時為 (None, None)"""
+        with self._lock:
+            rotation = self._by_request.get((key, request_digest(request)))
+            if rotation is not None:
+                return rotation.take(), "exact"
+            rotation = self._by_service.get(key)
+            if rotation is not None:
+                return rotation.take(), "fallback"
+            return None, None
+
+    def count(self, key: str, outcome: str):
+        with self._lock:
+            per_key = self.counters.setdefault(key, {})
+            per_key[outcome] = per_key.get(outcome, 0) + 1
+
+    # ── 生命週期 ──
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SAP 流量重播伺服器")
+    parser.add_argument("log", help="SAP_RECORD_PATH 寫入的紀錄檔")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--speed", type=float, default=1.0, help="回應時間縮放 (0 = 不等待)")
+    args = parser.parse_args()
+
+    entries = read_log(args.log)
+    server = SAPReplayServer(entries, host=args.host, port=args.port, speed=args.speed)
+    services = sorted({e["service"] for e in entries})
+    print(f"SAP replay listening on {server.base_url} ({len(entries)} 筆紀錄: {', '.join(services)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.counters, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""本機 SAP ICM SOAP 模擬伺服器 (供效能測試與回歸測試使用)
+
+提供 SAPConfig.SERVICES 全部八個服務端點：
+- 檢查 Basic 認證與 SOAPAction 標頭
+- 依請求的 RFC 操作回傳擬真的成功 Envelope (RETURN 訊息表格與單據號碼)
+- 可設定延遲、抖動、SOAP Fault 比例與業務錯誤 (RETURN TYPE=E) 比例
+
+以 ThreadingHTTPServer 實作，每個請求在獨立執行緒中處理。
+
+用法:
+    python benchmarks/sap_stub.py --port 8080 --latency 0.2 --jitter 0.05 --fault-rate 0.01
+    SAP_BASE_URL=http://127.0.0.1:8080 uv run sap_server.py
+"""
+import argparse
+import base64
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sap_server import SAPConfig  # noqa: E402
+
+ENVELOPE = (
+    '<soap-env:Envelope xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/">'
+    "<soap-env:Header/><soap-env:Body>{}</soap-env:Body></soap-env:Envelope>"
+)
+
+# 業務錯誤 (HTTP 200 + RETURN TYPE=E) 的訊息範本，對應實際 SAP 常見的主資料缺漏
+BUSINESS_ERRORS = {
+    "SO": ("V1", "382", "Material {MATERIAL} is not defined for sales org.TW01, distr.chan.03"),
+    "STO": ("06", "218", "No info record for vendor ICC-CP60 and material in plant TP01"),
+    "DN": ("VL", "150", "Material is not maintained in warehouse number WH1"),
+    "MAT": ("M3", "305", "Material {MATERIAL} is locked by another user"),
+    "SRC": ("06", "039", "Source list for material {MATERIAL} could not be saved"),
+    "INF": ("06", "305", "Vendor ICC-CP60 is blocked for purchasing"),
+    "QTY": ("06", "029", "Kitting PO {KITTING_PO} is already delivered"),
+    "STATUS": ("ZAI", "001", "Batch not found"),
+}
+
+FLOW_ACTIONS = ("SO_CREATED", "STO_CREATED", "DN_CREATED", "DONE")
+
+
+# BAPIRET2 其餘欄位：實際 SAP 回應中即使為空也會出現
+_BAPIRET2_REST = (
+    "<LOG_NO/><LOG_MSG_NO>000000</LOG_MSG_NO><MESSAGE_V1/><MESSAGE_V2/><MESSAGE_V3/><MESSAGE_V4/>"
+    "<PARAMETER>{parameter}</PARAMETER><ROW>{row}</ROW><FIELD/><SYSTEM>PRDCLNT100</SYSTEM>"
+)
+
+# 每個服務的明細表格參數 (業務錯誤指向其中一列時填入 PARAMETER / ROW)
+ITEM_TABLES = {"SO": "IT_SO_ITEM", "DN": "PO_ITEM", "QTY": "PR_ITEM"}
+
+
+def _return_table(rows):
+    """rows: (TYPE, ID, NUMBER, MESSAGE) 或 (TYPE, ID, NUMBER, MESSAGE, PARAMETER, ROW)"""
+    items = "".join(
+        f"<item><TYPE>{t}</TYPE><ID>{i}</ID><NUMBER>{n}</NUMBER><MESSAGE>{escape(m)}</MESSAGE>"
+        + _BAPIRET2_REST.format(parameter=rest[0] if rest else "", row=rest[1] if rest else 0)
+        + "</item>"
+        for t, i, n, m, *rest in rows
+    )
+    return f"<RETURN>{items}</RETURN>"
+
+
+def _fault(message: str, code: str = "soap-env:Server") -> bytes:
+    return ENVELOPE.format(
+        f"<soap-env:Fault><faultcode>{code}</faultcode>"
+        f'<faultstring xml:lang="en">{escape(message)}</faultstring></soap-env:Fault>'
+    ).encode("utf-8")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 標頭與本文分開送出時避免 Nagle + delayed ACK 造成的 40ms 延遲
+    disable_nagle_algorithm = True
+
+    def _reply(self, status: int, payload: bytes, extra_headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in extra_headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+
+        key = stub.routes.get(urlsplit(self.path).path)
+        if key is None:
+            stub.count("unknown", "not_found")
+            self._reply(404, _fault(f"No service at {self.path}", "soap-env:Client"))
+            return
+
+        if not stub.check_auth(self.headers.get("Authorization")):
+            stub.count(key, "unauthorized")
+            self._reply(401, b"Unauthorized", [("WWW-Authenticate", 'Basic realm="SAP NetWeaver Application Server"')])
+            return
+
+        if self.headers.get("SOAPAction") != SAPConfig.SERVICES[key]["action"]:
+            stub.count(key, "fault")
+            self._reply(500, _fault(f"SOAPAction mismatch: {self.headers.get('SOAPAction')}", "soap-env:Client"))
+            return
+
+        try:
+            operation, values = _parse_request(body)
+        except ElementTree.ParseError as e:
+            stub.count(key, "fault")
+            self._reply(500, _fault(f"XML parse error: {e}", "soap-env:Client"))
+            return
+
+        stub.sleep(key, values.get("ROWS", 1))
+
+        roll = stub.random()
+        if roll < stub.fault_rate:
+            stub.count(key, "fault")
+            self._reply(500, _fault("Internal error in ABAP (simulated SYSTEM_FAILURE)"))
+            return
+        business_error = roll < stub.fault_rate + stub.business_error_rate
+        stub.count(key, "business_error" if business_error else "ok")
+        tables = _request_tables(body) if stub.echo_tables else ""
+        self._reply(200, stub.respond(key, operation, values, business_error, tables))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _parse_request(body: bytes):
+    """回傳 (RFC 操作名稱, 第一層欄位值 dict)"""
+    root = ElementTree.fromstring(body)
+    soap_body = next(el for el in root if el.tag.endswith("Body"))
+    op = soap_body[0]
+    operation = op.tag.rsplit("}", 1)[-1]
+    values = {child.tag: (child.text or "") for child in op if len(child) == 0}
+    # 表格參數只取第一列供訊息範本使用
+    for child in op:
+        if len(child) and len(child[0]):
+            values.setdefault("ROWS", len(child))
+            for col in child[0]:
+                values.setdefault(col.tag, col.text or "")
+        elif len(child):
+            for col in child:
+                values.setdefault(col.tag, col.text or "")
+    return operation, values
+
+
+def _request_tables(body: bytes) -> str:
+    """請求中的表格參數 XML (RFC 的 TABLES 參數會在回應中原樣帶回)"""
+    root = ElementTree.fromstring(body)
+    soap_body = next(el for el in root if el.tag.endswith("Body"))
+    return "".join(
+        ElementTree.tostring(child, encoding="unicode")
+        for child in soap_body[0] if len(child) and len(child[0])
+    )
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 大量並行連線時避免 listen backlog 過小造成 SYN 重送
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # 客戶端逾時後關閉連線 (BrokenPipe / ConnectionReset) 屬預期情況
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class SAPStubServer:
+    """在背景執行緒中啟動的 SAP 模擬伺服器
+
+    參數:
+        latency: 每個請求的平均處理時間 (秒)
+        jitter: 延遲的均勻抖動範圍 (± 秒)
+        service_latency: 個別服務的平均延遲，例如 {"SO": 1.5}
+        row_latency: 表格參數每多一列增加的處理時間 (秒)
+        fault_rate: 回傳 HTTP 500 SOAP Fault 的比例
+        business_error_rate: 回傳 HTTP 200 但 RETURN TYPE=E 的比例；多列明細的請求
+                             錯誤訊息指向其中一列 (PARAMETER / ROW)
+        user / password: 設定後只接受此組 Basic 認證；未設定時接受任何 Basic 認證
+        status_payload_bytes: 狀態查詢 LAST_IMPORT / LAST_EXPORT JSON 的大約大小
+        echo_tables: 成功回應中帶回請求的表格參數 (與實際 RFC 的 TABLES 參數相同)
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 service_latency=None, fault_rate: float = 0.0, business_error_rate: float = 0.0,
+                 user: str = None, password: str = None, status_payload_bytes: int = 256, seed: int = None,
+                 echo_tables: bool = False, row_latency: float = 0.0):
+        self.latency = latency
+        self.row_latency = row_latency
+        self.jitter = jitter
+        self.service_latency = dict(service_latency or {})
+        self.fault_rate = fault_rate
+        self.business_error_rate = business_error_rate
+        self.user = user
+        self.password = password
+        self.status_payload_bytes = status_payload_bytes
+        self.echo_tables = echo_tables
+        self.routes = {urlsplit(cfg["path"]).path: key for key, cfg in SAPConfig.SERVICES.items()}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._doc_numbers = itertools.count(1)
+        self.counters = {}
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.stub = self
+        self._thread = None
+
+    # ── 請求處理 ──
+    def random(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def sleep(self, key: str, rows: int = 1):
+        base = self.service_latency.get(key, self.latency) + self.row_latency * max(rows - 1, 0)
+        if self.jitter:
+            with self._lock:
+                base += self._random.uniform(-self.jitter, self.jitter)
+        if base > 0:
+            time.sleep(base)
+
+    def count(self, key: str, outcome: str):
+        with self._lock:
+            per_key = self.counters.setdefault(key, {})
+            per_key[outcome] = per_key.get(outcome, 0) + 1
+
+    def check_auth(self, header: str) -> bool:
+        if not header or not header.startswith("Basic "):
+            return False
+        if self.user is None:
+            return True
+        try:
+            user, _, password = base64.b64decode(header[6:]).decode("utf-8").partition(":")
+        except ValueError:
+            return False
+        return user == self.user and password == self.password
+
+    def next_number(self) -> int:
+        with self._lock:
+            return next(self._doc_numbers)
+
+    def respond(self, key: str, operation: str, values: dict, business_error: bool, tables: str = "") -> bytes:
+        if key == "STATUS":
+            inner = self._status_body(values.get("BATCH_ID", ""), business_error)
+        elif business_error:
+            ident, number, template = BUSINESS_ERRORS[key]
+            message = template.format_map(_Missing(values))
+            rows = values.get("ROWS", 1)
+            if rows > 1 and key in ITEM_TABLES:
+                inner = _return_table([("E", ident, number, message, ITEM_TABLES[key], int(self.random() * rows) + 1)])
+            else:
+                inner = _return_table([("E", ident, number, message)])
+        else:
+            inner = self._success_body(key, values) + tables
+        return ENVELOPE.format(
+            f'<n0:{operation}Response xmlns:n0="urn:sap-com:document:sap:rfc:functions">{inner}</n0:{operation}Response>'
+        ).encode("utf-8")
+
+    def _success_body(self, key: str, values: dict) -> str:
+        n = self.next_number()
+        if key == "SO":
+            so, pr = f"{n:010d}", f"{10000000 + n:010d}"
+            return (f"<PR_ITEM>00010</PR_ITEM><PR_NUMBER>{pr}</PR_NUMBER>"
+                    + _return_table([("S", "V1", "311", f"Standard Order {so} has been saved")])
+                    + f"<SALESDOCUMENT>{so}</SALESDOCUMENT>")
+        if key == "STO":
+            po = f"{4500000000 + n}"
+            return (f"<PO_NUMBER>{po}</PO_NUMBER>"
+                    + _return_table([("S", "06", "017", f"Stock transport order {po} created")]))
+        if key == "DN":
+            dn = f"{80000000 + n:010d}"
+            return (f"<DELIVERY>{dn}</DELIVERY>"
+                    + _return_table([("S", "VL", "311", f"Outbound delivery {dn} has been saved")]))
+        if key == "MAT":
+            material = escape(values.get("MATERIAL", ""))
+            return _return_table([("S", "MM", "356", f"The material {material} has been changed")])
+        if key == "SRC":
+            return _return_table([("S", "06", "300", "Source list has been saved")])
+        if key == "INF":
+            info = f"{5300000000 + n}"
+            return (f"<INFO_RECORD>{info}</INFO_RECORD>"
+                    + _return_table([("S", "06", "311", f"Purchasing info record {info} created")]))
+        if key == "QTY":
+            return _return_table([("S", "06", "023", f"Kitting PO {escape(values.get('KITTING_PO', ''))} changed")])
+        raise KeyError(key)
+
+    def _status_body(self, batch_id: str, business_error: bool) -> str:
+        if business_error:
+            return f"<RETURN_DATA><LAST_ACTION/><LAST_IMPORT/><LAST_EXPORT/></RETURN_DATA>{_return_table([('E', 'ZAI', '001', 'Batch not found')])}"
+        digits = int(batch_id or 0)
+        # 狀態依時間推進，讓監看工具能觀察到變化
+        step = (digits + int(time.time() // 10)) % len(FLOW_ACTIONS)
+        rows = max(1, self.status_payload_bytes // 80)
+        items = [{"ITEM": f"{(i + 1) * 10:06d}", "MATERIAL": f"MAT-{digits:06d}-{i}", "QTY": i % 7 + 1}
+                 for i in range(rows)]
+        last_import = json.dumps({"BATCH_ID": batch_id, "ITEMS": items})
+        last_export = json.dumps({"RESULT": "S", "DOCUMENTS": [f"{digits:010d}"] * min(rows, 10)})
+        return (f"<RETURN_DATA><LAST_ACTION>{FLOW_ACTIONS[step]}</LAST_ACTION>"
+                f"<LAST_IMPORT>{escape(last_import)}</LAST_IMPORT>"
+                f"<LAST_EXPORT>{escape(last_export)}</LAST_EXPORT></RETURN_DATA>")
+
+    # ── 生命週期 ──
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Missing(dict):
+    def __missing__(self, key):
+        return "?"
+
+
+def _service_latency(pairs):
+    result = {}
+    for pair in pairs or ():
+        key, _, seconds = pair.partition("=")
+        result[key.upper()] = float(seconds)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機 SAP SOAP 模擬伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.05, help="平均延遲 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延遲抖動 (± 秒)")
+    parser.add_argument("--service-latency", action="append", metavar="KEY=SECONDS",
+                        help="個別服務延遲，例如 SO=1.5，可重複")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="SOAP Fault (HTTP 500) 比例")
+    parser.add_argument("--business-error-rate", type=float, default=0.0, help="RETURN TYPE=E 比例")
+    parser.add_argument("--user", default=None)
+    parser.add_argument("--password", default=None)
+    parser.add_argument("--status-payload-bytes", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--echo-tables", action="store_true", help="成功回應中帶回請求的表格參數")
+    parser.add_argument("--row-latency", type=float, default=0.0, help="表格參數每多一列增加的延遲 (秒)")
+    args = parser.parse_args()
+
+    stub = SAPStubServer(
+        host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+        service_latency=_service_latency(args.service_latency), fault_rate=args.fault_rate,
+        business_error_rate=args.business_error_rate, user=args.user, password=args.password,
+        status_payload_bytes=args.status_payload_bytes, seed=args.seed,
+        echo_tables=args.echo_tables, row_latency=args.row_latency,
+    )
+    print(f"SAP stub listening on {stub.base_url}", flush=True)
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -2,71 +2,465 @@
 # requires-python = ">=3.11"
 # dependencies = [
 #     "mcp[cli]",
-#     "requests",
+#     "httpx",
 #     "pydantic>=2.0",
 #     "xmltodict",
 # ]
 # ///
 
 import os
+import re
 import json
-import requests
-import xmltodict
+import logging
+import time
+import asyncio
+import weakref
+import threading
+import contextlib
+import contextvars
+import random
+import socket
+import bisect
+import hashlib
+import inspect
+import httpx
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from xml.etree import ElementTree
 from typing import List, Optional
 from mcp.server.fastmcp import FastMCP, Context
-from pydantic import Field
-import urllib3
+from pydantic import Field, create_model
 
-# 禁用 SSL 警告
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# xmltodict (完整回應解析) 與 sqlite3 (日誌 / 快取) 在第一次
+# 使用時才匯入：stdio 模式每個 MCP 工作階段都會啟動新程序，啟動時間直接影響第一次 tools/list
+# httpx 預設以 INFO 記錄每一個請求，避免洗版
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # ==============================================================================
 # 設定 (Configuration)
 # ==============================================================================
 class SAPConfig:
+    # SAP ICM 服務位址，可用 SAP_BASE_URL 指向其他主機 (例如本機模擬伺服器)
+    BASE_URL = os.environ.get("SAP_BASE_URL", "https://vhivcqasci.sap.inventec.com:44300").rstrip("/")
+
+    # 每個服務的 "url" 由 BASE_URL + "path" 組成 (見 set_base_url)
     SERVICES = {
         "SO": {
-            "url": "https://vhivcqasci.sap.inventec.com:44300/sap/bc/srt/rfc/sap/zws_bapi_salesorder_create/100/zws_bapi_salesorder_create_sev/zws_bapi_salesorder_create_binding",
+            "path": "/sap/bc/srt/rfc/sap/zws_bapi_salesorder_create/100/zws_bapi_salesorder_create_sev/zws_bapi_salesorder_create_binding",
             "action": '"urn:sap-com:document:sap:rfc:functions:ZWS_BAPI_SALESORDER_CREATE:ZBAPI_SALESORDER_CREATERequest"'
         },
         "STO": {
-            "url": "https://vhivcqasci.sap.inventec.com:44300/sap/bc/srt/rfc/sap/zsd_sto_create/100/zsd_sto_create_svr/zsd_sto_create_binding",
+            "path": "/sap/bc/srt/rfc/sap/zsd_sto_create/100/zsd_sto_create_svr/zsd_sto_create_binding",
             "action": '"urn:sap-com:document:sap:rfc:functions:ZSD_STO_CREATE:ZSD_STO_CREATERequest"'
         },
         "DN": {
-            "url": "https://vhivcqasci.sap.inventec.com:44300/sap/bc/srt/rfc/sap/zws_bapi_outb_delivery_create/100/zws_bapi_outb_delivery_create/bind_dn_create",
+            "path": "/sap/bc/srt/rfc/sap/zws_bapi_outb_delivery_create/100/zws_bapi_outb_delivery_create/bind_dn_create",
             "action": '"urn:sap-com:document:sap:rfc:functions:ZWS_BAPI_OUTB_DELIVERY_CREATE_STO:ZBAPI_OUTB_DELIVERY_CREATE_STORequest"'
         },
         "MAT": {
-            "url": "https://vhivcqasci.sap.inventec.com:44300/sap/bc/srt/rfc/sap/zws_bapi_material_savedata/100/zws_bapi_material_savedata/bind_material",
+            "path": "/sap/bc/srt/rfc/sap/zws_bapi_material_savedata/100/zws_bapi_material_savedata/bind_material",
             "action": '"urn:sap-com:document:sap:rfc:functions:ZWS_BAPI_MATERIAL_SAVEDATA:ZBAPI_MATERIAL_SAVEDATARequest"'
         },
         "SRC": {
-            "url": "https://vhivcqasci.sap.inventec.com:44300/sap/bc/srt/rfc/sap/zsd_source_list_maintain/100/zsd_source_list_maintain_svr/zsd_source_list_maintain_binding",
+            "path": "/sap/bc/srt/rfc/sap/zsd_source_list_maintain/100/zsd_source_list_maintain_svr/zsd_source_list_maintain_binding",
             "action": '"urn:sap-com:document:sap:rfc:functions:ZSD_SOURCE_LIST_MAINTAIN:ZSD_SOURCE_LIST_MAINTAINRequest"'
         },
         "INF": {
-            "url": "https://vhivcqasci.sap.inventec.com:44300/sap/bc/srt/rfc/sap/zws_info_record_maintain/100/zws_info_record_maintain_svr/zws_info_record_maintain_binding",
+            "path": "/sap/bc/srt/rfc/sap/zws_info_record_maintain/100/zws_info_record_maintain_svr/zws_info_record_maintain_binding",
             "action": '"urn:sap-com:document:sap:rfc:functions:ZWS_INFO_RECORD_MAINTAIN:ZSD_INFO_RECORD_MAINTAINRequest"'
         },
         "QTY": {
-            "url": "https://vhivcqasci.sap.inventec.com:44300/sap/bc/srt/rfc/sap/zsd_kitting_flow_change/100/zsd_kitting_flow_change_svr/zsd_kitting_flow_change_bind",
+            "path": "/sap/bc/srt/rfc/sap/zsd_kitting_flow_change/100/zsd_kitting_flow_change_svr/zsd_kitting_flow_change_bind",
             "action": '"urn:sap-com:document:sap:rfc:functions:ZSD_KITTING_FLOW_CHANGE:ZSD_KITTING_FLOW_CHANGERequest"'
         },
         "STATUS": {
-            "url": "https://vhivcqasci.sap.inventec.com:44300/sap/bc/srt/rfc/sap/zai_flow_status/100/zai_flow_status_svr/zai_flow_status_svr_bind?sap-client=100",
+            "path": "/sap/bc/srt/rfc/sap/zai_flow_status/100/zai_flow_status_svr/zai_flow_status_svr_bind?sap-client=100",
             "action": '"urn:sap-com:document:sap:rfc:functions:ZAI_FLOW_STATUS:ZAI_FLOW_STATUSRequest"'
         }
     }
 
+    @classmethod
+    def set_base_url(cls, base_url: str):
+        """變更所有服務的主機位址"""
+        cls.BASE_URL = base_url.rstrip("/")
+        for cfg in cls.SERVICES.values():
+            cfg["url"] = cls.BASE_URL + cfg["path"]
+
+    # 連線池設定 (Connection Pool)
+    # POOL_SIZE: 每組 (主機, 憑證) 最多保留的 keep-alive 連線數
+    # POOL_IDLE_TIMEOUT: 閒置超過此秒數的連線池會被關閉回收
+    # POOL_KEEPALIVE: 是否在 socket 上啟用 TCP keep-alive
+    POOL_SIZE = int(os.environ.get("SAP_POOL_SIZE", "10"))
+    POOL_IDLE_TIMEOUT = float(os.environ.get("SAP_POOL_IDLE_TIMEOUT", "300"))
+    POOL_KEEPALIVE = os.environ.get("SAP_POOL_KEEPALIVE", "1") not in ("0", "false", "False", "")
+
+    # 非同步呼叫時，每個服務同時進行中的請求上限
+    # 可用 SAP_MAX_CONCURRENCY_<KEY> (例如 SAP_MAX_CONCURRENCY_SO) 個別覆寫
+    MAX_CONCURRENCY = int(os.environ.get("SAP_MAX_CONCURRENCY", "8"))
+
+    @classmethod
+    def max_concurrency(cls, key: str) -> int:
+        return int(os.environ.get(f"SAP_MAX_CONCURRENCY_{key}", cls.MAX_CONCURRENCY))
+
+    # check_kitting_status 結果快取 (TTL 秒數為 0 時停用快取，只合併同時進行的請求)
+    STATUS_CACHE_TTL = float(os.environ.get("SAP_STATUS_CACHE_TTL", "5"))
+    STATUS_CACHE_SIZE = int(os.environ.get("SAP_STATUS_CACHE_SIZE", "1024"))
+
+    # watch_kitting_status 輪詢間隔 (秒)：由 MIN 開始每次乘以 BACKOFF，最多 MAX
+    WATCH_MIN_INTERVAL = float(os.environ.get("SAP_WATCH_MIN_INTERVAL", "1"))
+    WATCH_MAX_INTERVAL = float(os.environ.get("SAP_WATCH_MAX_INTERVAL", "15"))
+    WATCH_BACKOFF = float(os.environ.get("SAP_WATCH_BACKOFF", "1.5"))
+    WATCH_MAX_TIMEOUT = float(os.environ.get("SAP_WATCH_MAX_TIMEOUT", "300"))
+
+    # check_kitting_status_many 預設的並行查詢數
+    BULK_STATUS_CONCURRENCY = int(os.environ.get("SAP_BULK_STATUS_CONCURRENCY", "16"))
+
+    # 多明細 (create_sales_order / create_outbound_delivery / change_kitting_qty 的 ITEMS)：
+    # 每個 SOAP 請求最多 ITEM_CHUNK_SIZE 筆明細，超過時分成多個請求；
+    # 可用 SAP_ITEM_CHUNK_SIZE_<KEY> (例如 SAP_ITEM_CHUNK_SIZE_SO) 個別覆寫
+    ITEM_CHUNK_SIZE = int(os.environ.get("SAP_ITEM_CHUNK_SIZE", "50"))
+
+    @classmethod
+    def item_chunk_size(cls, key: str) -> int:
+        return int(os.environ.get(f"SAP_ITEM_CHUNK_SIZE_{key}", cls.ITEM_CHUNK_SIZE))
+
+    # 逾時 (秒)：CONNECT 為建立連線，READ 為等待回應；可用 SAP_CONNECT_TIMEOUT_<KEY> /
+    # SAP_READ_TIMEOUT_<KEY> 個別覆寫。TOOL_DEADLINE 為單一工具呼叫的總期限
+    CONNECT_TIMEOUT = float(os.environ.get("SAP_CONNECT_TIMEOUT", "10"))
+    READ_TIMEOUT = float(os.environ.get("SAP_READ_TIMEOUT", "120"))
+    TOOL_DEADLINE = float(os.environ.get("SAP_TOOL_DEADLINE", "300"))
+
+    @classmethod
+    def timeouts(cls, key: str):
+        """回傳服務的 (connect, read) 逾時秒數"""
+        return (
+            float(os.environ.get(f"SAP_CONNECT_TIMEOUT_{key}", cls.CONNECT_TIMEOUT)),
+            float(os.environ.get(f"SAP_READ_TIMEOUT_{key}", cls.READ_TIMEOUT)),
+        )
+
+    # 斷路器：連續 BREAKER_FAILURES 次失敗後停止送出，BREAKER_RESET_TIMEOUT 秒後放行探測請求
+    # (BREAKER_FAILURES 為 0 時停用)
+    BREAKER_FAILURES = int(os.environ.get("SAP_BREAKER_FAILURES", "5"))
+    BREAKER_RESET_TIMEOUT = float(os.environ.get("SAP_BREAKER_RESET_TIMEOUT", "30"))
+
+    # 冪等查詢 (STATUS) 失敗時的重試次數；延遲為 full jitter:
+    # random(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2^n))
+    STATUS_RETRIES = int(os.environ.get("SAP_STATUS_RETRIES", "2"))
+    RETRY_BASE_DELAY = float(os.environ.get("SAP_RETRY_BASE_DELAY", "0.5"))
+    RETRY_MAX_DELAY = float(os.environ.get("SAP_RETRY_MAX_DELAY", "5"))
+
+    # run_kitting_pipeline 整個流程 (含補救) 的總期限 (秒)
+    PIPELINE_DEADLINE = float(os.environ.get("SAP_PIPELINE_DEADLINE", "900"))
+
+    # 建立 / 維護工具的 UUID 冪等日誌 (SQLite)：同一 (服務, UUID) 只會送出一次
+    # JOURNAL_MAX_AGE 秒以前的紀錄與超過 JOURNAL_MAX_ENTRIES 筆的最舊紀錄會被清除；
+    # pending 超過 JOURNAL_PENDING_TIMEOUT 秒視為前一個執行者已中斷
+    JOURNAL_PATH = os.environ.get(
+        "SAP_JOURNAL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sap_journal.sqlite3")
+    )
+    JOURNAL_MAX_AGE = float(os.environ.get("SAP_JOURNAL_MAX_AGE", str(7 * 24 * 3600)))
+    JOURNAL_MAX_ENTRIES = int(os.environ.get("SAP_JOURNAL_MAX_ENTRIES", "10000"))
+    JOURNAL_PENDING_TIMEOUT = float(os.environ.get("SAP_JOURNAL_PENDING_TIMEOUT", "600"))
+
+    # maintain_* 工具的「已維護」快取：相同參數的成功維護在 MAINT_CACHE_TTL 秒內不再送出
+    # (TTL 為 0 時停用)。預設與冪等日誌存放在同一個 SQLite 檔案
+    MAINT_CACHE_PATH = os.environ.get("SAP_MAINT_CACHE_PATH", JOURNAL_PATH)
+    MAINT_CACHE_TTL = float(os.environ.get("SAP_MAINT_CACHE_TTL", str(24 * 3600)))
+    MAINT_CACHE_SIZE = int(os.environ.get("SAP_MAINT_CACHE_SIZE", "5000"))
+
+    # 主資料批次作業 (run_master_data_job)：BULK_CONCURRENCY 個工作者同時處理不同物料；
+    # 每個服務以 token bucket 限制每秒送出的維護請求數 (BULK_RATE，可用 SAP_BULK_RATE_<KEY>
+    # 個別覆寫，0 表示不限制)，最多累積 BULK_BURST 個。作業進度存放在 BULK_JOB_PATH
+    # (預設與冪等日誌同一個 SQLite 檔案)，超過 BULK_JOB_MAX_AGE 秒的作業會被清除
+    BULK_CONCURRENCY = int(os.environ.get("SAP_BULK_CONCURRENCY", "8"))
+    BULK_RATE = float(os.environ.get("SAP_BULK_RATE", "5"))
+    BULK_BURST = int(os.environ.get("SAP_BULK_BURST", "5"))
+    BULK_JOB_PATH = os.environ.get("SAP_BULK_JOB_PATH", JOURNAL_PATH)
+    BULK_JOB_MAX_AGE = float(os.environ.get("SAP_BULK_JOB_MAX_AGE", str(7 * 24 * 3600)))
+
+    @classmethod
+    def bulk_rate(cls, key: str) -> float:
+        return float(os.environ.get(f"SAP_BULK_RATE_{key}", cls.BULK_RATE))
+
+    # 工作階段登錄：最多保留 SESSION_MAX 個工作階段的憑證，閒置超過 SESSION_TTL 秒即移除
+    SESSION_MAX = int(os.environ.get("SAP_SESSION_MAX", "1000"))
+    SESSION_TTL = float(os.environ.get("SAP_SESSION_TTL", str(8 * 3600)))
+
+    # 建立 / 維護工具預設回傳精簡 JSON；設為 1 時一律回傳完整 Body (與舊版相同)
+    RAW_RESULTS = os.environ.get("SAP_RAW_RESULTS", "0") not in ("0", "false", "False", "")
+
+    # 背景作業 (start_background_job)：每個程序最多同時執行 JOB_MAX_RUNNING 個；
+    # 完成的結果保留 JOB_RESULT_TTL 秒、最多 JOB_MAX_RESULTS 個 (超過時移除最早完成的)。
+    # await_background_job 單次最長等待 JOB_MAX_WAIT 秒
+    JOB_MAX_RUNNING = int(os.environ.get("SAP_JOB_MAX_RUNNING", "32"))
+    JOB_MAX_RESULTS = int(os.environ.get("SAP_JOB_MAX_RESULTS", "200"))
+    JOB_RESULT_TTL = float(os.environ.get("SAP_JOB_RESULT_TTL", "3600"))
+    JOB_MAX_WAIT = float(os.environ.get("SAP_JOB_MAX_WAIT", "300"))
+
+    # 每個服務的階段耗時 / 位元組數 / 狀態碼統計 (get_service_metrics 與 metrics:// 資源)
+    METRICS_ENABLED = os.environ.get("SAP_METRICS", "1") not in ("0", "false", "False", "")
+
+    # 流量紀錄：設定路徑時把每次 SAP 請求 / 回應 / 耗時附加到 gzip 壓縮的 JSON Lines 檔
+    # (不含帳號、密碼與主機)。路徑可包含 {pid}，多個工作程序時各自寫入不同檔案
+    RECORD_PATH = os.environ.get("SAP_RECORD_PATH", "")
+    # 流量紀錄在背景執行緒中每 RECORD_FLUSH_INTERVAL 秒寫入一批 (程序異常結束時最多遺失這段時間的紀錄)
+    RECORD_FLUSH_INTERVAL = float(os.environ.get("SAP_RECORD_FLUSH_INTERVAL", "1"))
+
+    # 部署模式：stdio (預設) 或 streamable-http。HTTP 模式由 uvicorn 在同一個位址上
+    # 啟動 HTTP_WORKERS 個工作程序；多於一個時必須使用無狀態 (stateless) HTTP，
+    # 此時以 X-SAP-Session 標頭識別工作階段
+    TRANSPORT = os.environ.get("SAP_TRANSPORT", "stdio")
+    HTTP_HOST = os.environ.get("SAP_HTTP_HOST", "127.0.0.1")
+    HTTP_PORT = int(os.environ.get("SAP_HTTP_PORT", "8000"))
+    HTTP_WORKERS = int(os.environ.get("SAP_HTTP_WORKERS", "1"))
+    HTTP_STATELESS = os.environ.get("SAP_HTTP_STATELESS", "1" if HTTP_WORKERS > 1 else "0") not in ("0", "false", "False", "")
+
+    # 快取 / 日誌鍵值中的憑證指紋 (帳號 + 密碼的 keyed BLAKE2b，不保存密碼本身) 使用的金鑰：
+    # SAP_CREDENTIAL_KEY，未設定時為 CREDENTIAL_KEY_PATH 檔案 (不存在時建立，權限 0600)。
+    # 預設與冪等日誌放在同一個目錄，同一主機的工作程序與重新啟動後的程序得到相同的指紋
+    CREDENTIAL_KEY = os.environ.get("SAP_CREDENTIAL_KEY", "")
+    CREDENTIAL_KEY_PATH = os.environ.get(
+        "SAP_CREDENTIAL_KEY_PATH", os.path.join(os.path.dirname(os.path.abspath(JOURNAL_PATH)), "sap_credential.key")
+    )
+
+    # 工作階段憑證與狀態查詢快取的共用儲存：memory (程序內) 或 sqlite (同一主機的所有工作程序共用)
+    # 多個工作程序時預設為 sqlite。注意 STATE_PATH 以明文保存各工作階段 set_sap_credentials
+    # 設定的 SAP 密碼：預設放在原始碼目錄以外的 $XDG_STATE_HOME/sap_server (或 ~/.local/state/sap_server)，
+    # 目錄權限 0700、檔案權限 0600；請勿指向共用或會被備份 / 版本控制的位置
+    STATE_BACKEND = os.environ.get("SAP_STATE_BACKEND", "sqlite" if HTTP_WORKERS > 1 else "memory")
+    STATE_PATH = os.environ.get(
+        "SAP_STATE_PATH",
+        os.path.join(
+            os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state"),
+            "sap_server", "sap_state.sqlite3",
+        ),
+    )
+
+SAPConfig.set_base_url(SAPConfig.BASE_URL)
+
+# ==============================================================================
+# 共用狀態 (Shared State)
+# ==============================================================================
+def _open_sqlite(path: str) -> "sqlite3.Connection":
+    """開啟 WAL 模式的 SQLite 連線 (autocommit，可跨執行緒使用，呼叫端需自行加鎖)"""
+    import sqlite3
+
+    db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+def _base_host(url: str) -> str:
+    """URL 的 scheme://host[:port] (連線池與冪等日誌以此區分 SAP 系統)"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+_credential_key = None
+_credential_key_lock = threading.Lock()
+
+def _load_credential_key() -> bytes:
+    """SAPConfig.CREDENTIAL_KEY，或 CREDENTIAL_KEY_PATH 檔案中的金鑰 (第一次使用時建立)"""
+    if SAPConfig.CREDENTIAL_KEY:
+        return hashlib.sha256(SAPConfig.CREDENTIAL_KEY.encode("utf-8")).digest()
+    path = SAPConfig.CREDENTIAL_KEY_PATH
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    # 先寫入暫存檔再 link：多個工作程序同時建立時只有一個成功，其餘讀取勝出者的金鑰
+    key = os.urandom(32)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+        f.write(key)
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        with open(path, "rb") as f:
+            key = f.read()
+    finally:
+        os.unlink(tmp)
+    return key
+
+def credential_fingerprint(user: str, password: str) -> str:
+    """帳號 + 密碼的 keyed 雜湊：快取與日誌以此區分憑證，密碼錯誤的工作階段不會命中他人的結果"""
+    global _credential_key
+    if _credential_key is None:
+        with _credential_key_lock:
+            if _credential_key is None:
+                _credential_key = _load_credential_key()
+    return hashlib.blake2b(
+        f"{user or ''}\x00{password or ''}".encode("utf-8"), key=_credential_key[:64], digest_size=16
+    ).hexdigest()
+
+class MemoryStateBackend:
+    """程序內的狀態儲存 (單一程序部署與測試用)
+
+    以 (namespace, key) 為鍵存放可 JSON 序列化的值，每筆有各自的到期時間；
+    最多保留 max_entries 筆 (LRU)。值以 JSON 文字保存，取出的是副本，
+    行為與 SQLiteStateBackend 相同。
+    """
+    shared = False
+
+    def __init__(self, max_entries: int = 100000, clock=time.time):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (namespace, key) -> (expires, JSON 文字)
+        self._data = OrderedDict()
+        self.reads = 0
+        self.writes = 0
+
+    def get(self, namespace: str, key: str):
+        """回傳未到期的值，不存在時回傳 None"""
+        with self._lock:
+            self.reads += 1
+            entry = self._data.get((namespace, key))
+            if entry is None:
+                return None
+            if entry[0] < self._clock():
+                del self._data[(namespace, key)]
+                return None
+            self._data.move_to_end((namespace, key))
+        return json.loads(entry[1])
+
+    def set(self, namespace: str, key: str, value, ttl: float):
+        text = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self.writes += 1
+            self._data[(namespace, key)] = (self._clock() + ttl, text)
+            self._data.move_to_end((namespace, key))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def touch(self, namespace: str, key: str, ttl: float):
+        """延長到期時間"""
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is not None:
+                self._data[(namespace, key)] = (self._clock() + ttl, entry[1])
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._data), "reads": self.reads, "writes": self.writes}
+
+class SQLiteStateBackend:
+    """同一主機上多個工作程序共用的狀態儲存 (SQLite WAL)
+
+    介面與 MemoryStateBackend 相同。到期時間使用牆上時間 (各程序一致)；
+    到期的列在讀取時忽略，每 1000 次寫入清除一次。工作階段憑證 (含密碼) 以明文存放，
+    檔案只允許目前使用者讀寫。方法皆為同步的 SQLite 存取 (最長等待 30 秒 busy timeout)，
+    在事件迴圈中的呼叫端以 asyncio.to_thread 呼叫。
+    """
+    shared = True
+
+    def __init__(self, path: str, clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = None
+        self.reads = 0
+        self.writes = 0
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            if self._db is None:
+                # 存有工作階段密碼：只允許目前使用者讀寫
+                if not os.path.exists(self.path):
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), mode=0o700, exist_ok=True)
+                    os.close(os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o600))
+                db = _open_sqlite(self.path)
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS state ("
+                    " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL,"
+                    " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+                )
+                self._db = db
+            return self._db.execute(sql, params)
+
+    def get(self, namespace: str, key: str):
+        self.reads += 1
+        row = self._execute(
+            "SELECT value FROM state WHERE namespace = ? AND key = ? AND expires >= ?",
+            (namespace, key, self._clock()),
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, namespace: str, key: str, value, ttl: float):
+        self.writes += 1
+        now = self._clock()
+        self._execute(
+            "INSERT OR REPLACE INTO state (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value, ensure_ascii=False), now + ttl),
+        )
+        if self.writes % 1000 == 0:
+            self._execute("DELETE FROM state WHERE expires < ?", (now,))
+
+    def touch(self, namespace: str, key: str, ttl: float):
+        self._execute(
+            "UPDATE state SET expires = ? WHERE namespace = ? AND key = ?", (self._clock() + ttl, namespace, key)
+        )
+
+    def delete(self, namespace: str, key: str):
+        self._execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def stats(self) -> dict:
+        entries = self._execute("SELECT COUNT(*) FROM state WHERE expires >= ?", (self._clock(),)).fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "entries": entries, "reads": self.reads, "writes": self.writes}
+
+def make_state_backend(kind: str):
+    """依 SAP_STATE_BACKEND 建立狀態儲存"""
+    if kind == "memory":
+        return MemoryStateBackend()
+    if kind == "sqlite":
+        return SQLiteStateBackend(SAPConfig.STATE_PATH)
+    raise ValueError(f"未知的 SAP_STATE_BACKEND: {kind} (可用: memory, sqlite)")
+
+# 全域狀態儲存；只有跨程序共用的儲存才需要讓工作階段登錄與狀態快取寫入
+state_backend = make_state_backend(SAPConfig.STATE_BACKEND)
+
 # ==============================================================================
 # 工作階段管理 (Session Management)
 # ==============================================================================
-class SessionCredentialStore:
-    """儲存不同 MCP 工作階段 (Session) 的 SAP 憑證"""
-    def __init__(self):
-        # 使用字典儲存：session_id -> {user, password}
-        self._credentials = {}
+class _Session:
+    __slots__ = ("user", "password", "last_used", "touched", "clients")
+
+    def __init__(self, user: str, password: str, now: float):
+        self.user = user
+        self.password = password
+        self.last_used = now
+        # 上次延長共用儲存中到期時間的時間
+        self.touched = now
+        # 服務 key -> SAPClient
+        self.clients = {}
+
+class SessionRegistry:
+    """儲存不同 MCP 工作階段 (Session) 的 SAP 憑證與 SAPClient
+
+    最多保留 max_sessions 個工作階段 (LRU)，閒置超過 ttl 秒的工作階段
+    會被移除 (之後改用環境變數的預設憑證)。每個 (工作階段, 服務) 只建立
+    一個 SAPClient 並重複使用；未設定個別憑證的工作階段共用預設憑證的 client。
+
+    指定 backend (MemoryStateBackend / SQLiteStateBackend) 時，憑證以它為準：
+    每次查詢都讀取 backend，其他工作程序設定或清除的憑證立即生效，
+    本機只保留 SAPClient 與憑證的副本。此時事件迴圈中應使用 aclient()，
+    backend 的查詢在執行緒中進行。
+    """
+    def __init__(self, max_sessions: int, ttl: float, clock=time.monotonic, backend=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._clock = clock
+        self._backend = backend
+        self._lock = threading.Lock()
+        # 使用 OrderedDict 儲存：session_id -> _Session，依最近使用排序
+        self._sessions = OrderedDict()
+        self._default_clients = {}
+        self.evictions = 0
+        self.expirations = 0
 
         # 如果有環境變數，將其作為預設憑證
         default_user = os.environ.get("SAP_USER")
@@ -79,18 +473,73 @@ class SessionCredentialStore:
         else:
             self._default_credentials = None
 
+    def _lookup(self, session_id: str, now: float):
+        """回傳未過期的 _Session (並移到 LRU 尾端)；呼叫端需持有鎖"""
+        entry = self._sessions.get(session_id)
+        if self._backend is not None:
+            return self._lookup_shared(session_id, entry, now)
+        if entry is None:
+            return None
+        if now - entry.last_used > self.ttl:
+            del self._sessions[session_id]
+            self.expirations += 1
+            return None
+        entry.last_used = now
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def _lookup_shared(self, session_id: str, entry, now: float):
+        creds = self._backend.get("credentials", session_id)
+        if creds is None:
+            # 已在其他工作程序清除或到期
+            if entry is not None:
+                del self._sessions[session_id]
+                self.expirations += 1
+            return None
+        if entry is None or entry.user != creds["user"] or entry.password != creds["password"]:
+            entry = _Session(creds["user"], creds["password"], now)
+            self._sessions[session_id] = entry
+            self._evict()
+        elif now - entry.touched > self.ttl / 10:
+            # 閒置 TTL：使用中的工作階段定期延長到期時間 (不必每次呼叫都寫入)
+            self._backend.touch("credentials", session_id, self.ttl)
+            entry.touched = now
+        entry.last_used = now
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def _evict(self):
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def _expire(self, now: float):
+        # 最久未使用的在最前面，遇到未過期的即可停止
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if now - entry.last_used <= self.ttl:
+                break
+            del self._sessions[session_id]
+            self.expirations += 1
+
     def set_credentials(self, session_id: str, user: str, password: str):
         """為指定工作階段設定憑證"""
-        self._credentials[session_id] = {
-            "user": user,
-            "password": password
-        }
+        now = self._clock()
+        with self._lock:
+            self._expire(now)
+            self._sessions.pop(session_id, None)
+            self._sessions[session_id] = _Session(user, password, now)
+            self._evict()
+            if self._backend is not None:
+                self._backend.set("credentials", session_id, {"user": user, "password": password}, self.ttl)
 
     def get_credentials(self, session_id: str):
         """獲取指定工作階段的憑證"""
         # 優先使用該工作階段特定的憑證
-        if session_id in self._credentials:
-            return self._credentials[session_id]
+        with self._lock:
+            entry = self._lookup(session_id, self._clock())
+        if entry is not None:
+            return {"user": entry.user, "password": entry.password}
 
         # 如果沒有，嘗試使用預設憑證
         if self._default_credentials:
@@ -100,467 +549,3946 @@ class SessionCredentialStore:
 
     def has_credentials(self, session_id: str) -> bool:
         """檢查是否有憑證"""
-        return session_id in self._credentials or self._default_credentials is not None
+        with self._lock:
+            entry = self._lookup(session_id, self._clock())
+        return entry is not None or self._default_credentials is not None
 
     def clear_credentials(self, session_id: str):
         """清除指定工作階段的憑證"""
-        if session_id in self._credentials:
-            del self._credentials[session_id]
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self._backend is not None:
+                self._backend.delete("credentials", session_id)
 
-# 全域憑證儲存區
-credential_store = SessionCredentialStore()
+    def client(self, session_id: str, key: str) -> "SAPClient":
+        """取得此工作階段指定服務的 SAPClient (同一工作階段重複使用)"""
+        url = SAPConfig.SERVICES[key]["url"]
+        with self._lock:
+            entry = self._lookup(session_id, self._clock())
+            clients = entry.clients if entry is not None else self._default_clients
+            client = clients.get(key)
+            # SAPConfig.set_base_url() 之後重新建立
+            if client is not None and client.url == url:
+                return client
+            if entry is not None:
+                client = SAPClient(key, entry.user, entry.password)
+            elif self._default_credentials:
+                client = SAPClient(key, self._default_credentials["user"], self._default_credentials["password"])
+            else:
+                raise ValueError(f"未找到工作階段 {session_id} 的憑證，且未設定預設憑證。請先呼叫 set_sap_credentials 設定憑證。")
+            clients[key] = client
+            return client
+
+    async def aclient(self, session_id: str, key: str) -> "SAPClient":
+        """與 client() 相同；有 backend 時在執行緒中查詢 (SQLite 可能等待 busy timeout)"""
+        if self._backend is None:
+            return self.client(session_id, key)
+        return await asyncio.to_thread(self.client, session_id, key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(self._clock())
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl": self.ttl,
+                "clients": sum(len(e.clients) for e in self._sessions.values()) + len(self._default_clients),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+# 全域工作階段登錄
+session_registry = SessionRegistry(
+    max_sessions=SAPConfig.SESSION_MAX,
+    ttl=SAPConfig.SESSION_TTL,
+    backend=state_backend if state_backend.shared else None,
+)
 
 # ==============================================================================
-# 核心客戶端 (Core Client)
+# 連線池 (Connection Pool)
 # ==============================================================================
-mcp = FastMCP("SAP Automation Agent")
+class _PoolEntry:
+    __slots__ = ("aclient", "aloop", "a_opened", "a_requests", "last_used", "in_flight")
 
-class SAPClient:
-    def __init__(self, key: str, session_id: str):
-        cfg = SAPConfig.SERVICES[key]
-        self.url = cfg["url"]
-        self.action = cfg["action"]
+    def __init__(self):
+        # httpx.AsyncClient 與其所屬的事件迴圈 (非同步連線不可跨迴圈共用)
+        self.aclient = None
+        self.aloop = None
+        self.a_opened = 0
+        self.a_requests = 0
+        self.last_used = time.monotonic()
+        self.in_flight = 0
 
-        # 從憑證儲存區中獲取此工作階段的憑證
-        creds = credential_store.get_credentials(session_id)
-        self.user = creds["user"]
-        self.password = creds["password"]
+class SAPConnectionPool:
+    """依 (服務主機, 憑證) 共用的 keep-alive HTTPS 連線池
 
-    def post_soap(self, body_content: str) -> str:
-        # 標準 SOAP Envelope (不含 XML 宣告)
-        envelope = f'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:sap-com:document:sap:rfc:functions"><soapenv:Header/><soapenv:Body>{body_content}</soapenv:Body></soapenv:Envelope>'
+    同一組主機與憑證的所有工具呼叫共用一個 httpx.AsyncClient，
+    避免每次呼叫都重新建立 TCP 連線與 TLS 交握。
+    """
+    def __init__(self, pool_size: int, idle_timeout: float, keepalive: bool = True):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self._lock = threading.Lock()
+        # (origin, user, password) -> _PoolEntry
+        self._entries = {}
+        # 已被回收的連線池所累積的計數
+        self._evicted_opened = 0
+        self._evicted_requests = 0
+        self._evicted_sessions = 0
 
-        headers = {
-            'Content-Type': 'text/xml; charset=utf-8',
-            'Accept': 'text/xml',
-            'SOAPAction': self.action,
-        }
+    def _socket_options(self):
+        if not self.keepalive:
+            return None
+        # TCP_NODELAY 加上 SO_KEEPALIVE
+        return [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1), (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
 
-        try:
-            response = requests.post(
-                self.url,
-                data=envelope.encode('utf-8'),
-                auth=(self.user, self.password),
-                headers=headers,
-                verify=False
-            )
+    def _new_async_client(self, user: str, password: str) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=self.idle_timeout,
+        )
+        transport = httpx.AsyncHTTPTransport(
+            verify=False,
+            limits=limits,
+            socket_options=self._socket_options(),
+        )
+        return httpx.AsyncClient(auth=(user, password), transport=transport, timeout=None)
 
-            if response.status_code == 200:
-                try:
-                    parsed = xmltodict.parse(response.text)
-                    # 嘗試提取 Body 內容
-                    env = parsed.get('soap-env:Envelope') or parsed.get('soapenv:Envelope') or parsed.get('SOAP-ENV:Envelope')
-                    if env:
-                        body = env.get('soap-env:Body') or env.get('soapenv:Body') or env.get('SOAP-ENV:Body')
-                        return str(body) if body else response.text
-                    return response.text
-                except:
-                    return response.text
-            else:
-                return f"HTTP 錯誤 {response.status_code}: {response.text}"
+    @staticmethod
+    def _pool_counters(entry: _PoolEntry):
+        """回傳 (已開啟連線數, 已送出請求數)"""
+        return entry.a_opened, entry.a_requests
 
-        except Exception as e:
-            return f"連線錯誤: {str(e)}"
+    @staticmethod
+    def _close_async_client(entry: _PoolEntry):
+        if entry.aclient is None:
+            return
+        aclient, aloop = entry.aclient, entry.aloop
+        entry.aclient = entry.aloop = None
+        # 只能在建立它的事件迴圈中關閉；迴圈已結束時交由 GC 釋放 socket
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is aloop:
+            aloop.create_task(aclient.aclose())
+        elif aloop.is_running():
+            asyncio.run_coroutine_threadsafe(aclient.aclose(), aloop)
 
-    def post_soap_dict(self, body_content: str):
-        """與 post_soap 相同，但回傳 (dict_body, error_string)
-           成功時: (dict, None)
-           失敗時: (None, error_string)
-        """
-        envelope = f'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:sap-com:document:sap:rfc:functions"><soapenv:Header/><soapenv:Body>{body_content}</soapenv:Body></soapenv:Envelope>'
+    def _evict_idle(self, now: float):
+        for key, entry in list(self._entries.items()):
+            if entry.in_flight == 0 and now - entry.last_used > self.idle_timeout:
+                opened, requests_sent = self._pool_counters(entry)
+                self._evicted_opened += opened
+                self._evicted_requests += requests_sent
+                self._evicted_sessions += 1
+                self._close_async_client(entry)
+                del self._entries[key]
 
-        headers = {
-            'Content-Type': 'text/xml; charset=utf-8',
-            'Accept': 'text/xml',
-            'SOAPAction': self.action,
-        }
+    def _checkout(self, url: str, user: str, password: str) -> _PoolEntry:
+        key = (_base_host(url), user, password)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _PoolEntry()
+            entry.in_flight += 1
+            entry.last_used = now
+            return entry
+
+    def _checkin(self, entry: _PoolEntry):
+        with self._lock:
+            entry.in_flight -= 1
+            entry.last_used = time.monotonic()
 
+    @contextlib.asynccontextmanager
+    async def async_session(self, url: str, user: str, password: str):
+        """取得共用的 httpx.AsyncClient 與計算連線重用次數的 trace 回呼"""
+        entry = self._checkout(url, user, password)
         try:
-            response = requests.post(
-                self.url,
-                data=envelope.encode('utf-8'),
-                auth=(self.user, self.password),
-                headers=headers,
-                verify=False
-            )
+            loop = asyncio.get_running_loop()
+            with self._lock:
+                if entry.aclient is None or entry.aloop is not loop:
+                    self._close_async_client(entry)
+                    entry.aclient = self._new_async_client(user, password)
+                    entry.aloop = loop
+                entry.a_requests += 1
+            client = entry.aclient
 
-            if response.status_code == 200:
-                try:
-                    parsed = xmltodict.parse(response.text)
-                    env = parsed.get('soap-env:Envelope') or parsed.get('soapenv:Envelope') or parsed.get('SOAP-ENV:Envelope')
-                    if env:
-                        body = env.get('soap-env:Body') or env.get('soapenv:Body') or env.get('SOAP-ENV:Body')
-                        if body and isinstance(body, dict):
-                            return (body, None)
-                    return (None, response.text)
-                except:
-                    return (None, response.text)
-            else:
-                return (None, f"HTTP 錯誤 {response.status_code}: {response.text}")
+            async def trace(event_name, info):
+                if event_name == "connection.connect_tcp.complete":
+                    entry.a_opened += 1
 
-        except Exception as e:
-            return (None, f"連線錯誤: {str(e)}")
+            yield client, trace
+        finally:
+            self._checkin(entry)
+
+    def stats(self) -> dict:
+        """連線池統計：開啟的新連線數與重複使用的連線數"""
+        with self._lock:
+            opened = self._evicted_opened
+            requests_sent = self._evicted_requests
+            pools = []
+            for (origin, user, _), entry in self._entries.items():
+                p_opened, p_requests = self._pool_counters(entry)
+                opened += p_opened
+                requests_sent += p_requests
+                pools.append({
+                    "origin": origin,
+                    "user": user,
+                    "in_flight": entry.in_flight,
+                    "idle_seconds": round(time.monotonic() - entry.last_used, 1),
+                    "connections_opened": p_opened,
+                    "requests": p_requests,
+                })
+            return {
+                "pool_size": self.pool_size,
+                "idle_timeout": self.idle_timeout,
+                "keepalive": self.keepalive,
+                "active_pools": len(self._entries),
+                "evicted_pools": self._evicted_sessions,
+                "connections_opened": opened,
+                "connections_reused": max(requests_sent - opened, 0),
+                "requests": requests_sent,
+                "pools": pools,
+            }
+
+    def close(self):
+        with self._lock:
+            for entry in self._entries.values():
+                self._close_async_client(entry)
+            self._entries.clear()
+
+# 全域連線池 (跨工具呼叫共用)
+sap_pool = SAPConnectionPool(
+    pool_size=SAPConfig.POOL_SIZE,
+    idle_timeout=SAPConfig.POOL_IDLE_TIMEOUT,
+    keepalive=SAPConfig.POOL_KEEPALIVE,
+)
 
 # ==============================================================================
-# 工作階段管理工具 (Session Management Tools)
+# 效能指標 (Metrics)
 # ==============================================================================
+# 耗時直方圖上界 (秒) 與位元組直方圖上界，最後一格為 +Inf
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(2 ** n for n in range(7, 25))
 
-@mcp.tool()
-def set_sap_credentials(
-    username: str,
-    password: str,
-    ctx: Context = None
-) -> str:
-    """設定目前工作階段的 SAP 憑證
+class Histogram:
+    """固定上界的直方圖 (與 Prometheus histogram 相同的分桶方式)"""
+    __slots__ = ("bounds", "counts", "sum", "count")
 
-    參數:
-        username: SAP 使用者名稱
-        password: SAP 密碼
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
 
-    回傳:
-        設定結果訊息
-    """
-    if ctx and hasattr(ctx, 'request_context'):
-        # 使用 request_id 作為 session 識別
-        session_id = getattr(ctx.request_context, 'request_id', 'default')
-        # 更好的做法是使用 session 資訊，但這裡用 client_params 模擬
-        if hasattr(ctx, 'session') and hasattr(ctx.session, 'client_params'):
-            client_info = str(ctx.session.client_params)
-            session_id = hash(client_info) if client_info else 'default'
-        session_id = str(session_id)
-    else:
-        session_id = 'default'
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
 
-    credential_store.set_credentials(session_id, username, password)
-    return f"已為工作階段 {session_id} 設定 SAP 憑證（使用者：{username}）"
+    def quantile(self, q: float) -> float:
+        """由分桶估計分位數 (桶內線性內插；落在 +Inf 桶時回傳最後一個上界)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, n in zip(self.bounds, self.counts):
+            if n and seen + n >= rank:
+                return lower + (bound - lower) * (rank - seen) / n
+            seen += n
+            lower = bound
+        return self.bounds[-1]
 
-@mcp.tool()
-def check_session_credentials(ctx: Context = None) -> str:
-    """檢查目前工作階段是否已設定憑證
+class _ServiceStats:
+    __slots__ = ("phases", "request_bytes", "response_bytes", "statuses", "errors")
 
-    回傳:
-        憑證狀態資訊
-    """
-    if ctx and hasattr(ctx, 'request_context'):
-        session_id = getattr(ctx.request_context, 'request_id', 'default')
-        if hasattr(ctx, 'session') and hasattr(ctx.session, 'client_params'):
-            client_info = str(ctx.session.client_params)
-            session_id = hash(client_info) if client_info else 'default'
-        session_id = str(session_id)
-    else:
-        session_id = 'default'
+    def __init__(self):
+        self.phases = {}
+        self.request_bytes = Histogram(SIZE_BUCKETS)
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+        self.statuses = {}
+        self.errors = {}
 
-    if credential_store.has_credentials(session_id):
-        creds = credential_store.get_credentials(session_id)
-        return f"工作階段 {session_id} 已設定憑證（使用者：{creds['user']}）"
-    else:
-        return f"工作階段 {session_id} 未設定憑證"
+class _PhaseTimer:
+    __slots__ = ("metrics", "key", "phase", "start")
 
-def _get_session_id(ctx: Context = None) -> str:
-    """從 Context 中提取 session ID"""
-    if ctx and hasattr(ctx, 'request_context'):
-        session_id = getattr(ctx.request_context, 'request_id', 'default')
-        if hasattr(ctx, 'session') and hasattr(ctx.session, 'client_params'):
-            client_info = str(ctx.session.client_params)
-            session_id = hash(client_info) if client_info else 'default'
-        return str(session_id)
-    return 'default'
+    def __init__(self, metrics, key: str, phase: str):
+        self.metrics = metrics
+        self.key = key
+        self.phase = phase
 
-def recursive_find(key, data):
-    """在巢狀 dict 中遞迴搜尋指定 key 的值"""
-    if isinstance(data, dict):
-        if key in data:
-            return data[key]
-        for v in data.values():
-            result = recursive_find(key, v)
-            if result is not None:
-                return result
-    elif isinstance(data, list):
-        for item in data:
-            result = recursive_find(key, item)
-            if result is not None:
-                return result
-    return None
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
 
-# ==============================================================================
-# SAP 操作工具 (SAP Operation Tools)
-# ==============================================================================
+    def __exit__(self, *exc):
+        self.metrics.observe(self.key, self.phase, time.perf_counter() - self.start)
 
-@mcp.tool()
-def create_sales_order(
-    CUST_PO: str,
-    CUST_PO_DATE: str,
-    MATERIAL: str,
-    QTY: float,
-    UUID: str = "",
-    ORDER_TYPE: str = "ZIES",
-    SALES_ORG: str = "TW01",
-    SALES_CHANNEL: str = "03",
-    SALES_DIVISION: str = "01",
-    SOLD_TO_PARTY: str = "HRCTO-IMX",
-    SHIP_TO_PARTY: str = "HRCTO-MX",
-    PLANT: str = "TP01",
-    SHIPPING_POINT: str = "TW01",
-    ctx: Context = None
-) -> str:
-    """步驟 1: 建立銷售訂單 (Sales Order)"""
+class ServiceMetrics:
+    """每個服務 (SAPConfig.SERVICES 的 key) 的呼叫統計
 
-    # 獲取目前工作階段的 session ID
-    session_id = _get_session_id(ctx)
+    階段 (phase):
+        build   - 產生請求 Envelope
+        queue   - 等待服務並行上限與連線池
+        network - 送出請求到讀完回應
+        parse   - 解析回應 XML
+        format  - 將結果整理成工具輸出
 
-    # 強制使用預設值以防止「缺少必要的抬頭欄位」錯誤
-    order_type_val = ORDER_TYPE if ORDER_TYPE else "ZIES"
-    sales_org_val = SALES_ORG if SALES_ORG else "TW01"
-    sales_channel_val = SALES_CHANNEL if SALES_CHANNEL else "03"
-    sales_division_val = SALES_DIVISION if SALES_DIVISION else "01"
-    sold_to_val = SOLD_TO_PARTY if SOLD_TO_PARTY else "HRCTO-IMX"
-    ship_to_val = SHIP_TO_PARTY if SHIP_TO_PARTY else "HRCTO-MX"
-    plant_val = PLANT if PLANT else "TP01"
-    shipping_pt_val = SHIPPING_POINT if SHIPPING_POINT else "TW01"
-
-    cust_po_val = CUST_PO if CUST_PO else "TEST_PO"
-    cust_po_date_val = CUST_PO_DATE if CUST_PO_DATE else "2025-01-01"
+    另記錄請求 / 回應位元組數、HTTP 狀態碼與錯誤類型 (connection / timeout / http /
+    parse / circuit_open / deadline)，以及重試次數 (retry)。
+    每次記錄只有一次 bisect 與數個整數加法；enabled 為 False 時完全略過。
+    """
+    PHASES = ("build", "queue", "network", "parse", "format")
 
-    uuid_tag = f"<UUID>{UUID}</UUID>" if UUID else ""
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._services = {}
+        self._started = time.time()
 
-    # 嚴格遵循文件結構：UUID -> CUST -> ITEM TABLE -> HEADER FIELDS
-    xml_body = f'<urn:ZBAPI_SALESORDER_CREATE>{uuid_tag}<CUST_PO>{cust_po_val}</CUST_PO><CUST_PO_DATE>{cust_po_date_val}</CUST_PO_DATE><IT_SO_ITEM><item><MATERIAL_NO>000010</MATERIAL_NO><MATERIAL>{MATERIAL}</MATERIAL><UNIT>PCE</UNIT><QTY>{QTY}</QTY><PLANT>{plant_val}</PLANT><SHIPPING_POINT>{shipping_pt_val}</SHIPPING_POINT><DELIVERY_DATE>{cust_po_date_val}</DELIVERY_DATE></item></IT_SO_ITEM><ORDER_TYPE>{order_type_val}</ORDER_TYPE><SALES_CHANNEL>{sales_channel_val}</SALES_CHANNEL><SALES_DIVISION>{sales_division_val}</SALES_DIVISION><SALES_ORG>{sales_org_val}</SALES_ORG><SHIP_TO_PARTY>{ship_to_val}</SHIP_TO_PARTY><SOLD_TO_PARTY>{sold_to_val}</SOLD_TO_PARTY></urn:ZBAPI_SALESORDER_CREATE>'
+    def _service(self, key: str) -> _ServiceStats:
+        stats = self._services.get(key)
+        if stats is None:
+            stats = self._services[key] = _ServiceStats()
+        return stats
 
-    return SAPClient("SO", session_id).post_soap(xml_body)
+    def observe(self, key: str, phase: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            phases = self._service(key).phases
+            hist = phases.get(phase)
+            if hist is None:
+                hist = phases[phase] = Histogram(LATENCY_BUCKETS)
+            hist.observe(seconds)
 
-@mcp.tool()
-def create_sto_po(
-    PR_NUMBER: str,
-    PR_ITEM: str,
-    UUID: str = "",
-    PUR_GROUP: str = "999",
-    PUR_ORG: str = "TW10",
-    PUR_PLANT: str = "TP01",
-    VENDOR: str = "ICC-CP60",
-    DOC_TYPE: str = "NB",
-    ctx: Context = None
-) -> str:
-    """步驟 2: 建立 STO 採購訂單 (PO)"""
+    def timer(self, key: str, phase: str) -> _PhaseTimer:
+        """with service_metrics.timer("STATUS", "format"): ..."""
+        return _PhaseTimer(self, key, phase)
 
-    session_id = _get_session_id(ctx)
+    def exchange(self, key: str, request_bytes: int, response_bytes: int, status_code: int):
+        """記錄一次完成的 HTTP 往返；非 200 的狀態碼同時計為 http 錯誤"""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._service(key)
+            stats.request_bytes.observe(request_bytes)
+            stats.response_bytes.observe(response_bytes)
+            stats.statuses[status_code] = stats.statuses.get(status_code, 0) + 1
+            if status_code != 200:
+                stats.errors["http"] = stats.errors.get("http", 0) + 1
 
-    pur_group_val = PUR_GROUP if PUR_GROUP else "999"
-    pur_org_val = PUR_ORG if PUR_ORG else "TW10"
-    pur_plant_val = PUR_PLANT if PUR_PLANT else "TP01"
-    vendor_val = VENDOR if VENDOR else "ICC-CP60"
-    doc_type_val = DOC_TYPE if DOC_TYPE else "NB"
+    def error(self, key: str, error_type: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            errors = self._service(key).errors
+            errors[error_type] = errors.get(error_type, 0) + 1
 
-    uuid_tag = f"<UUID>{UUID}</UUID>" if UUID else ""
+    def reset(self):
+        with self._lock:
+            self._services.clear()
+            self._started = time.time()
 
-    xml_body = f'<urn:ZSD_STO_CREATE>{uuid_tag}<DOC_TYPE>{doc_type_val}</DOC_TYPE><LGORT/><PR_NUMBER>{PR_NUMBER}</PR_NUMBER><PUR_GROUP>{pur_group_val}</PUR_GROUP><PUR_ITEM><item><BNFPO>{PR_ITEM}</BNFPO></item></PUR_ITEM><PUR_ORG>{pur_org_val}</PUR_ORG><PUR_PLANT>{pur_plant_val}</PUR_PLANT><VENDOR>{vendor_val}</VENDOR></urn:ZSD_STO_CREATE>'
+    def stats(self) -> dict:
+        """JSON 用的摘要：各階段次數 / 平均 / 估計 p50、p95、p99 (毫秒)"""
+        def summary(hist: Histogram, scale: float, unit: str) -> dict:
+            return {
+                "count": hist.count,
+                f"avg_{unit}": round(hist.sum / hist.count * scale, 3) if hist.count else 0.0,
+                f"p50_{unit}": round(hist.quantile(0.50) * scale, 3),
+                f"p95_{unit}": round(hist.quantile(0.95) * scale, 3),
+                f"p99_{unit}": round(hist.quantile(0.99) * scale, 3),
+            }
 
-    return SAPClient("STO", session_id).post_soap(xml_body)
+        with self._lock:
+            services = {}
+            for key in sorted(self._services):
+                stats = self._services[key]
+                services[key] = {
+                    "phases": {
+                        phase: summary(stats.phases[phase], 1000, "ms")
+                        for phase in self.PHASES if phase in stats.phases
+                    },
+                    "request_bytes": summary(stats.request_bytes, 1, "bytes"),
+                    "response_bytes": summary(stats.response_bytes, 1, "bytes"),
+                    "http_status": {str(code): n for code, n in sorted(stats.statuses.items())},
+                    "errors": dict(sorted(stats.errors.items())),
+                }
+            return {
+                "enabled": self.enabled,
+                "since": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._started)),
+                "services": services,
+            }
 
-@mcp.tool()
-def create_outbound_delivery(
-    PO_NUMBER: str,
-    ITEM_NO: str,
-    QUANTITY: float,
-    UUID: str = "",
-    ctx: Context = None
-) -> str:
-    """步驟 3: 建立外向交貨單 (Outbound Delivery)"""
+    def prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
 
-    session_id = _get_session_id(ctx)
+        def histogram(name: str, help_text: str, series):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in series:
+                cumulative = 0
+                for bound, n in zip(hist.bounds, hist.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f"{name}_sum{{{labels}}} {hist.sum:.6g}")
+                lines.append(f"{name}_count{{{labels}}} {hist.count}")
 
-    ship_point_val = "CN60"
-    uuid_tag = f"<UUID>{UUID}</UUID>" if UUID else ""
+        def counter(name: str, help_text: str, series):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series:
+                lines.append(f"{name}{{{labels}}} {value}")
 
-    xml_body = f'<urn:ZBAPI_OUTB_DELIVERY_CREATE_STO>{uuid_tag}<PO_ITEM><item><REF_DOC>{PO_NUMBER}</REF_DOC><REF_ITEM>{ITEM_NO}</REF_ITEM><DLV_QTY>{QUANTITY}</DLV_QTY><SALES_UNIT>EA</SALES_UNIT></item></PO_ITEM><SHIP_POINT>{ship_point_val}</SHIP_POINT></urn:ZBAPI_OUTB_DELIVERY_CREATE_STO>'
+        with self._lock:
+            items = sorted(self._services.items())
+            histogram(
+                "sap_soap_phase_seconds", "Time spent per SOAP call phase.",
+                [(f'service="{key}",phase="{phase}"', stats.phases[phase])
+                 for key, stats in items for phase in self.PHASES if phase in stats.phases],
+            )
+            histogram(
+                "sap_soap_request_bytes", "SOAP request envelope size.",
+                [(f'service="{key}"', stats.request_bytes) for key, stats in items],
+            )
+            histogram(
+                "sap_soap_response_bytes", "SOAP response body size.",
+                [(f'service="{key}"', stats.response_bytes) for key, stats in items],
+            )
+            counter(
+                "sap_soap_responses_total", "HTTP responses by status code.",
+                [(f'service="{key}",code="{code}"', n)
+                 for key, stats in items for code, n in sorted(stats.statuses.items())],
+            )
+            counter(
+                "sap_soap_errors_total", "Failed SOAP calls by error type.",
+                [(f'service="{key}",type="{error_type}"', n)
+                 for key, stats in items for error_type, n in sorted(stats.errors.items())],
+            )
+        return "\n".join(lines) + "\n"
 
-    return SAPClient("DN", session_id).post_soap(xml_body)
+service_metrics = ServiceMetrics(enabled=SAPConfig.METRICS_ENABLED)
 
-@mcp.tool()
-def maintain_info_record(
-    MATERIAL: str,
-    UUID: str = "",
-    PRICE: str = "999",
-    VENDOR: str = "ICC-CP60",
-    PLANT: str = "TP01",
-    PUR_ORG: str = "TW10",
-    ctx: Context = None
-) -> str:
-    """補救操作: 維護資訊記錄 (Info Record)"""
+# ==============================================================================
+# 逾時與斷路器 (Timeouts & Circuit Breakers)
+# ==============================================================================
+class SAPUnavailable(Exception):
+    """請求未送出或未完成：斷路器開啟、超過期限或逾時"""
 
-    session_id = _get_session_id(ctx)
+# 目前工具呼叫的期限 (time.monotonic() 時間點)；未設定時每個請求各自從送出時起算 TOOL_DEADLINE
+_deadline = contextvars.ContextVar("sap_deadline", default=None)
+# 目前 Task 中最近一次 SAP 請求的失敗是否值得重試 (連線錯誤、逾時、HTTP 5xx)，供 SAPClient.aretry 判斷
+_retryable = contextvars.ContextVar("sap_retryable", default=False)
 
-    price_val = PRICE if PRICE else "999"
-    vendor_val = VENDOR if VENDOR else "ICC-CP60"
-    plant_val = PLANT if PLANT else "TP01"
-    pur_org_val = PUR_ORG if PUR_ORG else "TW10"
+@contextlib.contextmanager
+def sap_deadline(seconds: float):
+    """此區塊內的 SAP 請求共用同一個期限 (不會比外層期限更晚)"""
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
 
-    uuid_tag = f"<UUID>{UUID}</UUID>" if UUID else ""
+class CircuitBreaker:
+    """單一服務的斷路器
 
-    xml_body = f'<urn:ZSD_INFO_RECORD_MAINTAIN>{uuid_tag}<CURRENCY>USD</CURRENCY><MATERIAL>{MATERIAL}</MATERIAL><PLANT>{plant_val}</PLANT><PRICE>{price_val}</PRICE><PRICE_UNIT>1</PRICE_UNIT><PUR_ORG>{pur_org_val}</PUR_ORG><VENDOR>{vendor_val}</VENDOR></urn:ZSD_INFO_RECORD_MAINTAIN>'
+    closed: 正常送出；連續 failure_threshold 次失敗 (連線錯誤、逾時、HTTP 502/503/504)
+            後轉為 open。
+    open: 立即失敗不送出，reset_timeout 秒後轉為 half_open。
+    half_open: 只放行一個探測請求；成功則回到 closed，失敗則再次 open。
+    """
+    def __init__(self, key: str, failure_threshold: int, reset_timeout: float):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self.trips = 0
+        self.rejected = 0
+        self.last_trip = None
 
-    return SAPClient("INF", session_id).post_soap(xml_body)
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed" or self.failure_threshold <= 0:
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self.probe_started = None
+            if self.state == "half_open":
+                # 探測請求若未回報結果 (例如在送出前就失敗)，reset_timeout 後允許下一個探測
+                if self.probe_started is None or now - self.probe_started >= self.reset_timeout:
+                    self.probe_started = now
+                    return True
+            self.rejected += 1
+            return False
 
-@mcp.tool()
-def maintain_sales_view(
-    MATERIAL: str,
-    SALES_ORG: str,
-    DISTR_CHAN: str,
-    UUID: str = "",
-    PLANT: str = "TP01",
-    DELYG_PLNT: str = "TP01",
-    ctx: Context = None
-) -> str:
-    """補救操作: 維護銷售視圖 (Sales View)"""
+    def retry_after(self) -> float:
+        with self._lock:
+            if self.state != "open":
+                return 0.0
+            return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
 
-    session_id = _get_session_id(ctx)
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probe_started = None
 
-    # 邏輯參照 Word 文件
-    plant_val = PLANT
-    delyg_plnt_val = DELYG_PLNT
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold > 0):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+                self.trips += 1
+                self.last_trip = time.strftime("%Y-%m-%dT%H:%M:%S")
 
-    if SALES_ORG == "CN60" and DISTR_CHAN == "03":
-        plant_val = "CP60"
-        delyg_plnt_val = "CP60"
-    elif SALES_ORG == "TW01" and DISTR_CHAN == "03":
-        plant_val = "TP01"
-        delyg_plnt_val = "TP01"
+    def stats(self) -> dict:
+        with self._lock:
+            state = self.state
+            if state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                state = "half_open"
+            return {
+                "state": state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "last_trip": self.last_trip,
+                "retry_after": round(max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0), 1)
+                if state == "open" else 0.0,
+            }
 
-    plant_val = plant_val if plant_val else "TP01"
-    delyg_plnt_val = delyg_plnt_val if delyg_plnt_val else "TP01"
+circuit_breakers = {
+    key: CircuitBreaker(key, SAPConfig.BREAKER_FAILURES, SAPConfig.BREAKER_RESET_TIMEOUT)
+    for key in SAPConfig.SERVICES
+}
 
-    uuid_tag = f"<UUID>{UUID}</UUID>" if UUID else ""
+# ==============================================================================
+# 流量紀錄 (Traffic Recording)
+# ==============================================================================
+# 請求中可能出現的密碼類欄位，寫入紀錄前以 *** 取代
+_SECRET_ELEMENTS = re.compile(
+    r"(<(?:[\w.-]+:)?(PASSWORD|PASSWD|PWD|TOKEN|SECRET)\b[^>]*>)[^<]*(</(?:[\w.-]+:)?\2>)", re.I
+)
 
-    xml_body = f'<urn:ZBAPI_MATERIAL_SAVEDATA>{uuid_tag}<HEADDATA><MATERIAL>{MATERIAL}</MATERIAL><SALES_VIEW>X</SALES_VIEW><STORAGE_VIEW></STORAGE_VIEW><WAREHOUSE_VIEW></WAREHOUSE_VIEW></HEADDATA><PLANTDATA><PLANT>{plant_val}</PLANT></PLANTDATA><SALESDATA><SALES_ORG>{SALES_ORG}</SALES_ORG><DISTR_CHAN>{DISTR_CHAN}</DISTR_CHAN><DELYG_PLNT>{delyg_plnt_val}</DELYG_PLNT></SALESDATA></urn:ZBAPI_MATERIAL_SAVEDATA>'
+class TrafficRecorder:
+    """SAP 流量紀錄：每次請求一行 JSON，附加到 gzip 壓縮檔 (append-only)
 
-    return SAPClient("MAT", session_id).post_soap(xml_body)
+    每行包含 ts (送出時間)、service、status、queue / network (秒)、request (SOAP Envelope)
+    與 response。不記錄 HTTP 標頭、帳號、密碼與主機，請求中的密碼類欄位以 *** 取代。
+    record() 只把紀錄放進緩衝區，JSON 編碼、壓縮與寫檔都在背景寫入執行緒中進行，
+    每 flush_interval 秒 (或緩衝達 MAX_PENDING 筆時) 寫入一批並 flush；程序中途結束時
+    最多遺失最後 flush_interval 秒的紀錄，close() 會先寫完緩衝區。
+    每次開啟會附加新的 gzip member，gzip.open() 可連續讀出。
+    benchmarks/sap_replay.py 依此紀錄重播回應。
+    """
+    MAX_PENDING = 256
 
-@mcp.tool()
-def maintain_warehouse_view(
-    MATERIAL: str,
-    UUID: str = "",
-    WHSE_NO: str = "WH1",
-    ctx: Context = None
-) -> str:
-    """補救操作: 維護倉庫視圖 (Warehouse View)"""
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        self.path = path.format(pid=os.getpid())
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = []
+        self._writer = None
+        self._stopping = False
+        self._file = None
+        self.records = 0
+        self.raw_bytes = 0
 
-    session_id = _get_session_id(ctx)
+    def record(self, service: str, request: bytes, status_code: int, response: bytes, queued: float,
+               started: float, network: float):
+        entry = (time.time() - (time.perf_counter() - started), service, status_code, started - queued, network,
+                 request, response)
+        with self._wakeup:
+            self._pending.append(entry)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="sap-traffic-recorder", daemon=True)
+                self._writer.start()
+            elif len(self._pending) >= self.MAX_PENDING:
+                self._wakeup.notify()
 
-    whse_no_val = WHSE_NO if WHSE_NO else "WH1"
-    uuid_tag = f"<UUID>{UUID}</UUID>" if UUID else ""
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if not self._stopping and len(self._pending) < self.MAX_PENDING:
+                    self._wakeup.wait(self.flush_interval)
+                batch, self._pending = self._pending, []
+                stopping = self._stopping
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logging.warning("寫入流量紀錄失敗 (%d 筆): %s", len(batch), e)
+            if stopping:
+                return
 
-    xml_body = f'<urn:ZBAPI_MATERIAL_SAVEDATA>{uuid_tag}<HEADDATA><MATERIAL>{MATERIAL}</MATERIAL><SALES_VIEW></SALES_VIEW><STORAGE_VIEW></STORAGE_VIEW><WAREHOUSE_VIEW>X</WAREHOUSE_VIEW></HEADDATA><WAREHOUSENUMBERDATA><WHSE_NO>{whse_no_val}</WHSE_NO></WAREHOUSENUMBERDATA></urn:ZBAPI_MATERIAL_SAVEDATA>'
+    def _write(self, batch: list):
+        lines = []
+        for ts, service, status_code, queue, network, request, response in batch:
+            entry = {
+                "ts": round(ts, 6),
+                "service": service,
+                "status": status_code,
+                "queue": round(queue, 6),
+                "network": round(network, 6),
+                "request": _SECRET_ELEMENTS.sub(r"\1***\3", request.decode("utf-8", "replace")),
+                "response": response.decode("utf-8", "replace"),
+            }
+            lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        data = "".join(lines).encode("utf-8")
+        if self._file is None:
+            import gzip
 
-    return SAPClient("MAT", session_id).post_soap(xml_body)
+            self._file = gzip.open(self.path, "ab")
+        self._file.write(data)
+        self._file.flush()
+        with self._lock:
+            self.records += len(batch)
+            self.raw_bytes += len(data)
 
-@mcp.tool()
-def maintain_source_list(
-    MATERIAL: str,
-    VALID_FROM: str,
-    UUID: str = "",
-    PLANT: str = "TP01",
-    VENDOR: str = "ICC-CP60",
-    ctx: Context = None
-) -> str:
-    """補救操作: 維護貨源清單 (Source List)"""
+    def close(self):
+        """寫完緩衝區中的紀錄後停止寫入執行緒並關閉檔案 (之後的 record() 會重新開啟)"""
+        with self._wakeup:
+            writer = self._writer
+            self._stopping = True
+            self._wakeup.notify()
+        if writer is not None:
+            writer.join()
+        with self._lock:
+            self._writer = None
+            self._stopping = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
 
-    session_id = _get_session_id(ctx)
+    def stats(self) -> dict:
+        with self._lock:
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            return {"path": self.path, "records": self.records, "pending": len(self._pending),
+                    "raw_bytes": self.raw_bytes, "file_bytes": size}
 
-    plant_val = PLANT if PLANT else "TP01"
-    vendor_val = VENDOR if VENDOR else "ICC-CP60"
-    valid_from_val = VALID_FROM if VALID_FROM else "2025-01-01"
-    uuid_tag = f"<UUID>{UUID}</UUID>" if UUID else ""
+# 全域流量紀錄 (SAP_RECORD_PATH 未設定時為 None)
+traffic_recorder = (
+    TrafficRecorder(SAPConfig.RECORD_PATH, SAPConfig.RECORD_FLUSH_INTERVAL) if SAPConfig.RECORD_PATH else None
+)
+if traffic_recorder is not None:
+    import atexit
 
-    xml_body = f'<urn:ZSD_SOURCE_LIST_MAINTAIN>{uuid_tag}<MATERIAL>{MATERIAL}</MATERIAL><PLANT>{plant_val}</PLANT><VENDOR>{vendor_val}</VENDOR><VALID_FROM>{valid_from_val}</VALID_FROM><VALID_TO>9999-12-31</VALID_TO></urn:ZSD_SOURCE_LIST_MAINTAIN>'
+    atexit.register(traffic_recorder.close)
 
-    return SAPClient("SRC", session_id).post_soap(xml_body)
+# ==============================================================================
+# SOAP 回應解析 (Response Parsing)
+# ==============================================================================
+def _local_name(tag: str) -> str:
+    """去除命名空間 ({uri}name 或 prefix:name)，只保留元素名稱"""
+    if tag[:1] == "{":
+        return tag.rsplit("}", 1)[1]
+    return tag.rsplit(":", 1)[-1]
+
+def _element_to_obj(elem):
+    """將 Element 轉成與 xmltodict 相同形狀的值 (忽略屬性)
+
+    無子元素時回傳文字 (空元素為 None)；有子元素時回傳 dict，
+    重複出現的子元素會合併成 list。
+    """
+    if len(elem) == 0:
+        return elem.text
+    obj = {}
+    for child in elem:
+        name = _local_name(child.tag)
+        value = _element_to_obj(child)
+        if name in obj:
+            if not isinstance(obj[name], list):
+                obj[name] = [obj[name]]
+            obj[name].append(value)
+        else:
+            obj[name] = value
+    return obj
+
+class SOAPStreamExtractor:
+    """以串流方式 (iterparse) 從 SOAP 回應中只擷取指定元素
+
+    paths 中的每一項可以是單一元素名稱 (例如 "RETURN_DATA"，在任何
+    層級皆可匹配，等同 recursive_find)，或以 "/" 分隔的路徑後綴
+    (例如 "Body/Fault/faultstring")。命名空間前綴 (soap-env / soapenv /
+    SOAP-ENV) 一律忽略。不在目標範圍內的元素解析完即丟棄，因此
+    記憶體用量只與被擷取的元素大小有關。
+    """
+    HEAD_BYTES = 4096
+
+    def __init__(self, paths):
+        self._targets = {path: path.strip("/").split("/") for path in paths}
+        self._results = {}
+        self._parser = ElementTree.XMLPullParser(events=("start", "end"))
+        self._names = []
+        self._elems = []
+        # 正在擷取中的目標: path -> 目標元素在堆疊中的深度
+        self._capturing = {}
+        self._head = bytearray()
+        self.done = not self._targets
+
+    def _match(self, path_parts) -> bool:
+        n = len(path_parts)
+        return n <= len(self._names) and self._names[-n:] == path_parts
+
+    def feed(self, chunk: bytes) -> bool:
+        """餵入一段位元組；所有目標都擷取完成時回傳 True"""
+        if self.done:
+            return True
+        if len(self._head) < self.HEAD_BYTES:
+            self._head += chunk[:self.HEAD_BYTES - len(self._head)]
+        self._parser.feed(chunk)
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                self._names.append(_local_name(elem.tag))
+                self._elems.append(elem)
+                for path, parts in self._targets.items():
+                    if path not in self._results and path not in self._capturing and self._match(parts):
+                        self._capturing[path] = len(self._elems)
+                continue
+
+            depth = len(self._elems)
+            for path, target_depth in list(self._capturing.items()):
+                if target_depth == depth:
+                    self._results[path] = _element_to_obj(elem)
+                    del self._capturing[path]
+            self._names.pop()
+            self._elems.pop()
+            # 不在擷取範圍內的元素立即從父節點移除，避免整棵樹留在記憶體
+            if not self._capturing and self._elems:
+                parent = self._elems[-1]
+                if len(parent) and parent[-1] is elem:
+                    del parent[-1]
+            if len(self._results) == len(self._targets):
+                self.done = True
+                break
+        return self.done
+
+    def close(self):
+        """結束解析；若 XML 不完整會拋出 ElementTree.ParseError"""
+        if not self.done:
+            self._parser.close()
+
+    @property
+    def head(self) -> str:
+        """回應開頭 (最多 HEAD_BYTES 位元組) 的文字，供錯誤訊息使用"""
+        return self._head.decode("utf-8", errors="replace")
+
+    def results(self) -> dict:
+        """回傳 {path: 值}；找不到的目標值為 None"""
+        return {path: self._results.get(path) for path in self._targets}
+
+def extract_soap_fields(data, paths) -> dict:
+    """從完整的 SOAP 回應 (str / bytes) 中擷取指定元素"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    extractor = SOAPStreamExtractor(paths)
+    extractor.feed(data)
+    extractor.close()
+    return extractor.results()
+
+def _response_element(body) -> dict:
+    """SOAP Body dict 中的 <...Response> 元素 (第一個 dict 子元素)"""
+    if isinstance(body, dict):
+        for value in body.values():
+            if isinstance(value, dict):
+                return value
+    return {}
+
+def _return_messages(body) -> list:
+    """RETURN 表格正規化為 [{"type", "id", "number", "message"}]
+
+    BAPIRET2 的 ROW 大於 0 (訊息屬於表格參數的第 ROW 列明細) 時另外加上 "row"。
+    """
+    table = recursive_find("RETURN", body)
+    items = table.get("item") if isinstance(table, dict) and "item" in table else table
+    if isinstance(items, dict):
+        items = [items]
+    messages = []
+    for item in items or ():
+        if not isinstance(item, dict):
+            continue
+        message = {
+            "type": item.get("TYPE") or "",
+            "id": item.get("ID") or "",
+            "number": item.get("NUMBER") or "",
+            "message": item.get("MESSAGE") or "",
+        }
+        row = str(item.get("ROW") or "").strip()
+        if row.isdigit() and int(row) > 0:
+            message["row"] = int(row)
+        messages.append(message)
+    return messages
+
+def _response_fields(body) -> dict:
+    """<...Response> 下非空的單值匯出參數 (單據號碼等)，不含表格與結構"""
+    return {
+        key: value.strip()
+        for key, value in _response_element(body).items()
+        if not key.startswith("@") and isinstance(value, str) and value.strip()
+    }
+
+# ==============================================================================
+# 請求結構 (Request Schemas)
+# ==============================================================================
+SOAP_ENVELOPE_OPEN = b'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:sap-com:document:sap:rfc:functions"><soapenv:Header/><soapenv:Body>'
+SOAP_ENVELOPE_CLOSE = b'</soapenv:Body></soapenv:Envelope>'
+
+def _xml_escape(value) -> str:
+    """將值轉成已跳脫 (&, <, >) 的文字"""
+    text = value if value.__class__ is str else str(value)
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+def _text(value, default: str) -> str:
+    """已跳脫的值；None 或空字串時使用 default (常數，不需跳脫)"""
+    if value is None or value == "":
+        return default
+    return _xml_escape(value)
+
+def _element(name: str, value, empty: str = None) -> str:
+    """<NAME>value</NAME>；None 或空字串時輸出 empty (預設為 <NAME/>，optional 欄位傳入 "")"""
+    if value is None or value == "":
+        return f"<{name}/>" if empty is None else empty
+    return f"<{name}>{_xml_escape(value)}</{name}>"
+
+# 以下每個操作一個 render 函式，回傳 <urn:操作> 內的內容 (欄位順序即 SOAP 元素順序)；
+# 表格參數的值為 dict 的 list，結構參數的值為 dict
+
+def _render_so(v: dict) -> str:
+    # 嚴格遵循文件結構：UUID -> CUST -> ITEM TABLE -> HEADER FIELDS
+    items = "".join([
+        f"<item>{_element('MATERIAL_NO', r.get('MATERIAL_NO'))}{_element('MATERIAL', r.get('MATERIAL'))}"
+        f"<UNIT>{_text(r.get('UNIT'), 'PCE')}</UNIT>{_element('QTY', r.get('QTY'))}"
+        f"<PLANT>{_text(r.get('PLANT'), 'TP01')}</PLANT>"
+        f"<SHIPPING_POINT>{_text(r.get('SHIPPING_POINT'), 'TW01')}</SHIPPING_POINT>"
+        f"{_element('DELIVERY_DATE', r.get('DELIVERY_DATE'))}</item>"
+        for r in v.get("IT_SO_ITEM") or ()
+    ])
+    return (
+        f"{_element('UUID', v.get('UUID'), '')}"
+        f"<CUST_PO>{_text(v.get('CUST_PO'), 'TEST_PO')}</CUST_PO>"
+        f"<CUST_PO_DATE>{_text(v.get('CUST_PO_DATE'), '2025-01-01')}</CUST_PO_DATE>"
+        f"<IT_SO_ITEM>{items}</IT_SO_ITEM>"
+        f"<ORDER_TYPE>{_text(v.get('ORDER_TYPE'), 'ZIES')}</ORDER_TYPE>"
+        f"<SALES_CHANNEL>{_text(v.get('SALES_CHANNEL'), '03')}</SALES_CHANNEL>"
+        f"<SALES_DIVISION>{_text(v.get('SALES_DIVISION'), '01')}</SALES_DIVISION>"
+        f"<SALES_ORG>{_text(v.get('SALES_ORG'), 'TW01')}</SALES_ORG>"
+        f"<SHIP_TO_PARTY>{_text(v.get('SHIP_TO_PARTY'), 'HRCTO-MX')}</SHIP_TO_PARTY>"
+        f"<SOLD_TO_PARTY>{_text(v.get('SOLD_TO_PARTY'), 'HRCTO-IMX')}</SOLD_TO_PARTY>"
+    )
+
+def _render_sto(v: dict) -> str:
+    items = "".join([f"<item>{_element('BNFPO', r.get('BNFPO'))}</item>" for r in v.get("PUR_ITEM") or ()])
+    return (
+        f"{_element('UUID', v.get('UUID'), '')}"
+        f"<DOC_TYPE>{_text(v.get('DOC_TYPE'), 'NB')}</DOC_TYPE>"
+        f"{_element('LGORT', v.get('LGORT'))}{_element('PR_NUMBER', v.get('PR_NUMBER'))}"
+        f"<PUR_GROUP>{_text(v.get('PUR_GROUP'), '999')}</PUR_GROUP>"
+        f"<PUR_ITEM>{items}</PUR_ITEM>"
+        f"<PUR_ORG>{_text(v.get('PUR_ORG'), 'TW10')}</PUR_ORG>"
+        f"<PUR_PLANT>{_text(v.get('PUR_PLANT'), 'TP01')}</PUR_PLANT>"
+        f"<VENDOR>{_text(v.get('VENDOR'), 'ICC-CP60')}</VENDOR>"
+    )
+
+def _render_dn(v: dict) -> str:
+    items = "".join([
+        f"<item>{_element('REF_DOC', r.get('REF_DOC'))}{_element('REF_ITEM', r.get('REF_ITEM'))}"
+        f"{_element('DLV_QTY', r.get('DLV_QTY'))}<SALES_UNIT>{_text(r.get('SALES_UNIT'), 'EA')}</SALES_UNIT></item>"
+        for r in v.get("PO_ITEM") or ()
+    ])
+    return (
+        f"{_element('UUID', v.get('UUID'), '')}"
+        f"<PO_ITEM>{items}</PO_ITEM>"
+        f"<SHIP_POINT>{_text(v.get('SHIP_POINT'), 'CN60')}</SHIP_POINT>"
+    )
+
+def _render_mat(v: dict) -> str:
+    head = v.get("HEADDATA") or {}
+    plant = v.get("PLANTDATA")
+    sales = v.get("SALESDATA")
+    warehouse = v.get("WAREHOUSENUMBERDATA")
+    # PLANTDATA / SALESDATA / WAREHOUSENUMBERDATA 為 optional 結構：未提供時整個省略
+    return (
+        f"{_element('UUID', v.get('UUID'), '')}"
+        f"<HEADDATA>{_element('MATERIAL', head.get('MATERIAL'))}{_element('SALES_VIEW', head.get('SALES_VIEW'))}"
+        f"{_element('STORAGE_VIEW', head.get('STORAGE_VIEW'))}{_element('WAREHOUSE_VIEW', head.get('WAREHOUSE_VIEW'))}"
+        f"</HEADDATA>"
+        + (f"<PLANTDATA><PLANT>{_text(plant.get('PLANT'), 'TP01')}</PLANT></PLANTDATA>" if plant is not None else "")
+        + (
+            f"<SALESDATA>{_element('SALES_ORG', sales.get('SALES_ORG'))}"
+            f"{_element('DISTR_CHAN', sales.get('DISTR_CHAN'))}"
+            f"<DELYG_PLNT>{_text(sales.get('DELYG_PLNT'), 'TP01')}</DELYG_PLNT></SALESDATA>"
+            if sales is not None else ""
+        )
+        + (
+            f"<WAREHOUSENUMBERDATA><WHSE_NO>{_text(warehouse.get('WHSE_NO'), 'WH1')}</WHSE_NO></WAREHOUSENUMBERDATA>"
+            if warehouse is not None else ""
+        )
+    )
+
+def _render_src(v: dict) -> str:
+    return (
+        f"{_element('UUID', v.get('UUID'), '')}"
+        f"{_element('MATERIAL', v.get('MATERIAL'))}"
+        f"<PLANT>{_text(v.get('PLANT'), 'TP01')}</PLANT>"
+        f"<VENDOR>{_text(v.get('VENDOR'), 'ICC-CP60')}</VENDOR>"
+        f"<VALID_FROM>{_text(v.get('VALID_FROM'), '2025-01-01')}</VALID_FROM>"
+        f"<VALID_TO>{_text(v.get('VALID_TO'), '9999-12-31')}</VALID_TO>"
+    )
+
+def _render_inf(v: dict) -> str:
+    return (
+        f"{_element('UUID', v.get('UUID'), '')}"
+        f"<CURRENCY>{_text(v.get('CURRENCY'), 'USD')}</CURRENCY>"
+        f"{_element('MATERIAL', v.get('MATERIAL'))}"
+        f"<PLANT>{_text(v.get('PLANT'), 'TP01')}</PLANT>"
+        f"<PRICE>{_text(v.get('PRICE'), '999')}</PRICE>"
+        f"<PRICE_UNIT>{_text(v.get('PRICE_UNIT'), '1')}</PRICE_UNIT>"
+        f"<PUR_ORG>{_text(v.get('PUR_ORG'), 'TW10')}</PUR_ORG>"
+        f"<VENDOR>{_text(v.get('VENDOR'), 'ICC-CP60')}</VENDOR>"
+    )
+
+def _render_qty(v: dict) -> str:
+    items = "".join([
+        f"<item>{_element('EBELP', r.get('EBELP'))}{_element('MENGE', r.get('MENGE'))}</item>"
+        for r in v.get("PR_ITEM") or ()
+    ])
+    return f"{_element('UUID', v.get('UUID'), '')}{_element('KITTING_PO', v.get('KITTING_PO'))}<PR_ITEM>{items}</PR_ITEM>"
+
+def _render_status(v: dict) -> str:
+    # BATCH_ID is a single value (Structure/Element), not a Table
+    return _element("BATCH_ID", v.get("BATCH_ID"))
+
+class RequestSchema:
+    """一個 SAP RFC 操作的請求：render(values) 產生 <urn:操作> 內的內容 (所有值皆經過 _xml_escape)，
+    Envelope 與操作標籤在定義時就已編碼
+    """
+    __slots__ = ("operation", "render", "_open", "_close")
+
+    def __init__(self, operation: str, render):
+        self.operation = operation
+        self.render = render
+        self._open = SOAP_ENVELOPE_OPEN + f"<urn:{operation}>".encode("utf-8")
+        self._close = f"</urn:{operation}>".encode("utf-8") + SOAP_ENVELOPE_CLOSE
+
+    def serialize_into(self, values: dict, out: bytearray) -> bytearray:
+        """將完整 Envelope 附加到 out 的尾端並回傳 out
+
+        out 可重複使用 (例如每次呼叫前 out.clear())，或連續寫入多份請求。
+        """
+        out += self._open
+        out += self.render(values).encode("utf-8")
+        out += self._close
+        return out
+
+    def serialize(self, values: dict) -> bytes:
+        """產生完整 Envelope 位元組"""
+        return self._open + self.render(values).encode("utf-8") + self._close
+
+# SAPConfig.SERVICES 中每個操作的請求結構
+REQUEST_SCHEMAS = {
+    "SO": RequestSchema("ZBAPI_SALESORDER_CREATE", _render_so),
+    "STO": RequestSchema("ZSD_STO_CREATE", _render_sto),
+    "DN": RequestSchema("ZBAPI_OUTB_DELIVERY_CREATE_STO", _render_dn),
+    "MAT": RequestSchema("ZBAPI_MATERIAL_SAVEDATA", _render_mat),
+    "SRC": RequestSchema("ZSD_SOURCE_LIST_MAINTAIN", _render_src),
+    "INF": RequestSchema("ZSD_INFO_RECORD_MAINTAIN", _render_inf),
+    "QTY": RequestSchema("ZSD_KITTING_FLOW_CHANGE", _render_qty),
+    "STATUS": RequestSchema("ZAI_FLOW_STATUS", _render_status),
+}
+
+# ==============================================================================
+# 核心客戶端 (Core Client)
+# ==============================================================================
+# host 為本機位址時 FastMCP 會啟用 DNS rebinding 保護 (只接受 localhost 的 Host 標頭)
+mcp = FastMCP("SAP Automation Agent", host=SAPConfig.HTTP_HOST, port=SAPConfig.HTTP_PORT)
+
+# 可由 start_background_job 執行的工具: 名稱 -> (工具函式, 參數模型)
+_background_tools = {}
+
+def background_tool(fn):
+    """登錄可在背景執行的工具 (放在 @mcp.tool() 之下)
+
+    參數模型由函式簽章產生 (不含 ctx)，start_background_job 以它驗證參數，
+    不依賴 FastMCP 內部的 Tool 物件。
+    """
+    if not inspect.iscoroutinefunction(fn):
+        raise TypeError(f"背景工具必須是 async 函式: {fn.__name__}")
+    fields = {
+        name: (param.annotation, ... if param.default is inspect.Parameter.empty else param.default)
+        for name, param in inspect.signature(fn).parameters.items() if name != "ctx"
+    }
+    _background_tools[fn.__name__] = (fn, create_model(f"{fn.__name__}_arguments", **fields))
+    return fn
+
+class SAPClient:
+    """單一服務 (SAPConfig.SERVICES 的 key) 與一組憑證的 SOAP 呼叫端
+
+    由 session_registry.client() 依 (工作階段, 服務) 建立並重複使用，本身不保存
+    單次呼叫的狀態 (期限與是否可重試存放在 contextvars)。
+    """
+    __slots__ = ("key", "url", "action", "user", "password", "breaker", "_headers", "_credential")
+
+    def __init__(self, key: str, user: str, password: str):
+        cfg = SAPConfig.SERVICES[key]
+        self.key = key
+        self.url = cfg["url"]
+        self.action = cfg["action"]
+        self.user = user
+        self.password = password
+        self.breaker = circuit_breakers[key]
+        self._headers = {
+            'Content-Type': 'text/xml; charset=utf-8',
+            'Accept': 'text/xml',
+            'SOAPAction': self.action,
+        }
+        self._credential = None
+
+    @property
+    def credential(self) -> str:
+        """此組憑證的 credential_fingerprint (第一次使用時計算)"""
+        if self._credential is None:
+            self._credential = credential_fingerprint(self.user, self.password)
+        return self._credential
+
+    def build(self, values: dict) -> bytes:
+        """以 REQUEST_SCHEMAS[key] 產生完整 Envelope (計入 build 階段耗時)"""
+        with service_metrics.timer(self.key, "build"):
+            return REQUEST_SCHEMAS[self.key].serialize(values)
+
+    def _envelope(self, body_content) -> bytes:
+        """body_content 為 str 時視為 Body 內容並包上 Envelope；
+        為 bytes 時視為 RequestSchema.serialize() 產生的完整 Envelope
+        """
+        if isinstance(body_content, (bytes, bytearray)):
+            return body_content
+        with service_metrics.timer(self.key, "build"):
+            # 標準 SOAP Envelope (不含 XML 宣告)
+            envelope = f'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:urn="urn:sap-com:document:sap:rfc:functions"><soapenv:Header/><soapenv:Body>{body_content}</soapenv:Body></soapenv:Envelope>'
+            return envelope.encode('utf-8')
+
+    def _begin(self):
+        """檢查期限與斷路器，回傳 (connect 逾時, read 逾時, 剩餘期限)"""
+        _retryable.set(False)
+        remaining = (_deadline.get() or time.monotonic() + SAPConfig.TOOL_DEADLINE) - time.monotonic()
+        if remaining <= 0:
+            service_metrics.error(self.key, "deadline")
+            raise SAPUnavailable(f"已超過工具呼叫期限，未送出 {self.key} 請求")
+        if not self.breaker.allow():
+            service_metrics.error(self.key, "circuit_open")
+            raise SAPUnavailable(
+                f"服務 {self.key} 連續失敗，斷路器開啟中 (circuit open)，"
+                f"{self.breaker.retry_after():.0f} 秒後再試"
+            )
+        connect, read = SAPConfig.timeouts(self.key)
+        return min(connect, remaining), min(read, remaining), remaining
+
+    def _failed(self, error: Exception, started) -> Exception:
+        """記錄失敗 (指標 / 斷路器 / 是否可重試)，回傳要回報給呼叫端的例外
+
+        started 為 None 表示請求尚未送出 (例如等待並行上限時超過期限)，
+        這種情況不計入斷路器。
+        """
+        if isinstance(error, SAPUnavailable):
+            return error
+        if isinstance(error, ElementTree.ParseError):
+            service_metrics.error(self.key, "parse")
+            return error
+        if isinstance(error, (TimeoutError, httpx.TimeoutException)):
+            service_metrics.error(self.key, "timeout")
+            if started is None:
+                return SAPUnavailable(f"等待 {self.key} 並行上限或連線時超過工具呼叫期限")
+            self.breaker.record_failure()
+            _retryable.set(True)
+            waited = time.perf_counter() - started
+            return SAPUnavailable(f"{self.key} 在 {waited:.1f} 秒內沒有回應 ({type(error).__name__})")
+        service_metrics.error(self.key, "connection")
+        if started is not None:
+            self.breaker.record_failure()
+        _retryable.set(True)
+        return error
+
+    async def _asend(self, body_content: str):
+        """經由共用連線池送出 SOAP 請求，回傳 (status_code, text)；受每個服務的並行上限限制"""
+        data = self._envelope(body_content)
+        queued = time.perf_counter()
+        started = None
+        try:
+            connect, read, remaining = self._begin()
+            async with asyncio.timeout(remaining):
+                async with _service_semaphore(self.key):
+                    async with sap_pool.async_session(self.url, self.user, self.password) as (client, trace):
+                        started = time.perf_counter()
+                        response = await client.post(
+                            self.url,
+                            content=data,
+                            headers=self._headers,
+                            timeout=httpx.Timeout(read, connect=connect),
+                            extensions={"trace": trace},
+                        )
+        except Exception as e:
+            raise self._failed(e, started) from e
+        self._record_exchange(data, len(response.content), response.status_code, queued, started,
+                              response=response.content)
+        return response.status_code, response.text
+
+    def _record_exchange(self, data: bytes, response_bytes: int, status_code: int, queued: float, started: float,
+                         parse_seconds: float = 0.0, response=None):
+        """記錄 queue / network 耗時與位元組數與斷路器結果；串流解析時 network 不含 parse_seconds
+
+        response: 回應本文 (bytes 或串流讀取的區塊 list)，開啟流量紀錄時寫入 traffic_recorder
+        """
+        network = time.perf_counter() - started - parse_seconds
+        service_metrics.observe(self.key, "queue", started - queued)
+        service_metrics.observe(self.key, "network", network)
+        if traffic_recorder is not None and response is not None:
+            if isinstance(response, list):
+                response = b"".join(response)
+            traffic_recorder.record(self.key, data, status_code, response, queued, started, network)
+        service_metrics.exchange(self.key, len(data), response_bytes, status_code)
+        # 502/503/504 代表 ICM 或後端無法服務；500 (SOAP Fault) 表示後端仍在運作
+        if status_code in (502, 503, 504):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        _retryable.set(status_code >= 500)
+
+    async def aretry(self, call, retries: int):
+        """重複執行 call() 直到成功、失敗不可重試、用盡 retries 次或超過期限
+
+        只可用於冪等的呼叫 (例如 STATUS 查詢)。每次重試前等待
+        random(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2^n)) 秒 (full jitter)。
+        """
+        attempt = 0
+        with sap_deadline(SAPConfig.TOOL_DEADLINE):
+            while True:
+                result = await call()
+                if not _retryable.get() or attempt >= retries:
+                    return result
+                delay = random.uniform(0, min(SAPConfig.RETRY_MAX_DELAY, SAPConfig.RETRY_BASE_DELAY * 2 ** attempt))
+                if time.monotonic() + delay >= _deadline.get():
+                    return result
+                attempt += 1
+                service_metrics.error(self.key, "retry")
+                await asyncio.sleep(delay)
+
+    def _parse_envelope(self, text: str):
+        """xmltodict 解析回應並取出 Body (計入 parse 階段)；不是 SOAP Envelope 時回傳 None"""
+        import xmltodict
+
+        start = time.perf_counter()
+        try:
+            parsed = xmltodict.parse(text)
+        except Exception:
+            service_metrics.error(self.key, "parse")
+            raise
+        finally:
+            service_metrics.observe(self.key, "parse", time.perf_counter() - start)
+        env = parsed.get('soap-env:Envelope') or parsed.get('soapenv:Envelope') or parsed.get('SOAP-ENV:Envelope')
+        if env:
+            return env.get('soap-env:Body') or env.get('soapenv:Body') or env.get('SOAP-ENV:Body')
+        return None
+
+    def _extracted(self, extractor: SOAPStreamExtractor):
+        """HTTP 200 回應的擷取結果：XML 不完整為「解析錯誤」，目標元素都不存在或為空為「無資料」"""
+        try:
+            extractor.close()
+        except ElementTree.ParseError:
+            service_metrics.error(self.key, "parse")
+            return (None, f"解析錯誤: {extractor.head}")
+        found = extractor.results()
+        if all(value is None for value in found.values()):
+            return (None, f"無資料: {extractor.head}")
+        return (found, None)
+
+    async def apost_soap_extract(self, body_content: str, paths):
+        """送出請求並以串流方式只擷取 paths 指定的元素
+
+        回傳 (dict, error_string)：成功時 dict 為 {path: 值}；HTTP 200 但無法解析或
+        找不到任何目標時 error 以「解析錯誤:」/「無資料:」開頭，後接回應開頭。
+        回應本文不會被整份緩衝或轉成 dict 樹。
+        """
+        data = self._envelope(body_content)
+        queued = time.perf_counter()
+        started = None
+        try:
+            connect, read, remaining = self._begin()
+            async with asyncio.timeout(remaining):
+                async with _service_semaphore(self.key):
+                    async with sap_pool.async_session(self.url, self.user, self.password) as (client, trace):
+                        started = time.perf_counter()
+                        async with client.stream(
+                            "POST",
+                            self.url,
+                            content=data,
+                            headers=self._headers,
+                            timeout=httpx.Timeout(read, connect=connect),
+                            extensions={"trace": trace},
+                        ) as response:
+                            if response.status_code != 200:
+                                await response.aread()
+                                self._record_exchange(data, len(response.content), response.status_code, queued, started,
+                                                      response=response.content)
+                                return (None, f"HTTP 錯誤 {response.status_code}: {response.text}")
+                            extractor = SOAPStreamExtractor(paths)
+                            received = 0
+                            parse_seconds = 0.0
+                            # 只有開啟流量紀錄時才保留完整回應
+                            chunks = [] if traffic_recorder is not None else None
+                            async for chunk in response.aiter_bytes():
+                                received += len(chunk)
+                                if chunks is not None:
+                                    chunks.append(chunk)
+                                if not extractor.done:
+                                    t = time.perf_counter()
+                                    extractor.feed(chunk)
+                                    parse_seconds += time.perf_counter() - t
+                            t = time.perf_counter()
+                            result = self._extracted(extractor)
+                            parse_seconds += time.perf_counter() - t
+                            self._record_exchange(data, received, 200, queued, started, parse_seconds,
+                                                  response=chunks)
+                            service_metrics.observe(self.key, "parse", parse_seconds)
+                            return result
+        except Exception as e:
+            return (None, f"連線錯誤: {str(self._failed(e, started))}")
+
+    async def apost_soap_dict(self, body_content: str):
+        """送出請求並回傳 (dict_body, error_string) (不阻塞 FastMCP 事件迴圈)
+           成功時: (dict, None)
+           失敗時: (None, error_string)
+        """
+        try:
+            status_code, text = await self._asend(body_content)
+        except Exception as e:
+            return (None, f"連線錯誤: {str(e)}")
+        if status_code != 200:
+            return (None, f"HTTP 錯誤 {status_code}: {text}")
+        try:
+            body = self._parse_envelope(text)
+        except Exception:
+            return (None, text)
+        if body and isinstance(body, dict):
+            return (body, None)
+        return (None, text)
+
+    async def apost_soap_once(self, uuid: str, body_content):
+        """與 apost_soap_dict 相同 (回傳 (body, error))，但 UUID 非空時經由 idempotency_journal：
+        同一 (服務, UUID) 成功處理過的請求直接回傳保存的結果，不再送到 SAP
+        """
+        uuid = (uuid or "").strip()
+        if not uuid:
+            return await self.apost_soap_dict(body_content)
+        data = self._envelope(body_content)
+        try:
+            body, error = await idempotency_journal.run(
+                self.key, uuid, data, lambda: self.apost_soap_dict(data),
+                user=self.user, credential=self.credential, host=_base_host(self.url),
+            )
+        except IdempotencyConflict as e:
+            return (None, f"UUID 衝突: {e}")
+        except SAPUnavailable as e:
+            return (None, f"連線錯誤: {e}")
+        return (body, error)
+
+# 每個服務的並行上限 (依事件迴圈分開保存，避免跨迴圈共用 Semaphore)
+_service_semaphores = weakref.WeakKeyDictionary()
+
+def _service_semaphore(key: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    per_loop = _service_semaphores.get(loop)
+    if per_loop is None:
+        per_loop = _service_semaphores[loop] = {}
+    sem = per_loop.get(key)
+    if sem is None:
+        sem = per_loop[key] = asyncio.Semaphore(SAPConfig.max_concurrency(key))
+    return sem
+
+# ==============================================================================
+# 快取 (Caching)
+# ==============================================================================
+def _log_shared_write_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        logging.warning("寫入共用狀態儲存失敗: %s", future.exception())
+
+class TTLCache:
+    """有容量上限的 TTL + LRU 快取，並合併同一鍵值同時進行中的請求
+
+    同一個 key 同時有多個呼叫時只會有一個上游請求在進行，其餘呼叫
+    等待同一個結果 (coalesced)。只有 cache_if(value) 為真的結果會被
+    快取；ttl 為 0 時不快取，但仍會合併進行中的請求。
+
+    指定 backend 時快取值同時寫入共用儲存 (namespace 下以 JSON 化的 key 為鍵)，
+    本機未命中時先查共用儲存，其他工作程序取得的結果也可直接使用。
+    值須可 JSON 序列化 (由共用儲存取回的 tuple 會成為 list)。共用儲存的讀寫在
+    執行緒中進行，不阻塞事件迴圈。
+    """
+    def __init__(self, maxsize: int, ttl: float, cache_if=None, backend=None, namespace: str = ""):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache_if = cache_if or (lambda value: True)
+        self._backend = backend
+        self._namespace = namespace
+        # key -> (stored_at, value)，依最近使用排序
+        self._data = OrderedDict()
+        self._in_flight = {}
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _lookup(self, key, max_age):
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        stored_at, value = entry
+        age = time.monotonic() - stored_at
+        if age > self.ttl:
+            del self._data[key]
+            self.expirations += 1
+            return False, None
+        if max_age is not None and age > max_age:
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def _store(self, key, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        value = task.result()
+        if self.ttl <= 0 or not self._cache_if(value):
+            return
+        self._put(key, time.monotonic(), value)
+        if self._backend is not None:
+            # done callback 中不能 await：交給預設執行緒池寫入，失敗只影響其他工作程序的命中率
+            write = asyncio.get_running_loop().run_in_executor(
+                None, self._backend.set, self._namespace, json.dumps(key), [time.time(), value], self.ttl
+            )
+            write.add_done_callback(_log_shared_write_error)
+
+    def _put(self, key, stored_at: float, value):
+        self._data[key] = (stored_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def _lookup_shared(self, key, max_age):
+        if self._backend is None or self.ttl <= 0:
+            return False, None
+        entry = await asyncio.to_thread(self._backend.get, self._namespace, json.dumps(key))
+        if entry is None:
+            return False, None
+        stored_at, value = entry
+        age = max(time.time() - stored_at, 0.0)
+        if age > self.ttl or (max_age is not None and age > max_age):
+            return False, None
+        # 保留原本的存放時間，本機副本與共用儲存同時到期
+        self._put(key, time.monotonic() - age, value)
+        return True, value
+
+    async def get_or_fetch(self, key, fetch, max_age: float = None):
+        """取得快取值；不存在或過期時呼叫 fetch() (async) 取得並快取
+
+        max_age: 只接受存放不超過此秒數的快取值 (None 表示依 ttl)
+        """
+        hit, value = self._lookup(key, max_age)
+        if hit:
+            self.hits += 1
+            return value
+
+        task = self._in_flight.get(key)
+        if task is None:
+            hit, value = await self._lookup_shared(key, max_age)
+            if hit:
+                self.shared_hits += 1
+                return value
+            # 讀取共用儲存期間，其他呼叫可能已開始同一個查詢
+            task = self._in_flight.get(key)
+
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(fetch())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._store(key, t))
+        # shield: 單一呼叫端被取消時，上游請求仍為其他等待者繼續進行
+        return await asyncio.shield(task)
+
+    def invalidate(self, key=None):
+        """清除指定 key (或全部) 的快取值 (共用儲存中只清除指定的 key)"""
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+            if self._backend is not None:
+                self._backend.delete(self._namespace, json.dumps(key))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.shared_hits + self.misses + self.coalesced
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "shared": self._backend is not None,
+            "in_flight": len(self._in_flight),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round((self.hits + self.shared_hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+# check_kitting_status 結果快取：key 為 (憑證指紋, 補零後的 BATCH_ID)
+# (credential_fingerprint 涵蓋帳號與密碼，密碼錯誤的工作階段不會命中他人的查詢結果)，
+# 只快取成功的 (found, error) 結果
+status_cache = TTLCache(
+    maxsize=SAPConfig.STATUS_CACHE_SIZE,
+    ttl=SAPConfig.STATUS_CACHE_TTL,
+    cache_if=lambda result: result[1] is None,
+    backend=state_backend if state_backend.shared else None,
+    namespace="status",
+)
+
+class IdempotencyConflict(Exception):
+    """同一 (服務, UUID) 已用於內容不同的請求"""
+
+class IdempotencyJournal:
+    """以 (SAP 主機, 服務, UUID) 為鍵、存放 SAP 回應的本機持久化日誌 (SQLite WAL)
+
+    同一 (主機, 服務, UUID) 的請求只會送出一次：已完成的回應直接由日誌回傳；
+    同一程序內同時進行的重複呼叫等待同一個 Task，其他程序 (共用同一個
+    資料庫檔案) 的重複呼叫則輪詢 pending 列直到完成或超過工具呼叫期限。只有 store_if(回應)
+    為真的結果會被保存 (JSON)，其餘 (連線 / HTTP / 業務錯誤) 刪除 pending 列，
+    讓之後的重試可以再次送出。同一 UUID 搭配不同請求內容或不同憑證視為衝突
+    (使用者與憑證指紋併入 digest，其他帳號或密碼錯誤的工作階段無法取得已保存的回應)。
+    SQLite 存取 (含 30 秒 busy timeout 的 BEGIN IMMEDIATE) 於執行緒中進行，不阻塞事件迴圈。
+    """
+    def __init__(self, path: str, max_age: float, max_entries: int, pending_timeout: float, store_if=None):
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.pending_timeout = pending_timeout
+        self._store_if = store_if or (lambda value: True)
+        self._lock = threading.Lock()
+        self._db = None
+        self._in_flight = {}
+        self._stores_since_compact = 0
+        self.replayed = 0
+        self.coalesced = 0
+        self.waited = 0
+        self.stored = 0
+        self.discarded = 0
+        self.conflicts = 0
+        self.compacted = 0
+
+    def _conn(self) -> "sqlite3.Connection":
+        # 第一次使用時才開啟，匯入本模組不會建立檔案
+        if self._db is None:
+            db = _open_sqlite(self.path)
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                columns = [row[1] for row in db.execute("PRAGMA table_info(journal)")]
+                if columns and "host" not in columns:
+                    # 舊版日誌沒有主機欄位：保留紀錄並歸屬目前的 SAP 主機。舊的 digest 不含憑證指紋，
+                    # 以同一 UUID 重送時視為衝突而不會再次送出
+                    db.execute("ALTER TABLE journal RENAME TO journal_old")
+                    db.execute("DROP INDEX IF EXISTS journal_created")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS journal ("
+                    " host TEXT NOT NULL, service TEXT NOT NULL, uuid TEXT NOT NULL, digest TEXT NOT NULL,"
+                    " user TEXT, state TEXT NOT NULL, response TEXT, created REAL NOT NULL,"
+                    " PRIMARY KEY (host, service, uuid))"
+                )
+                if columns and "host" not in columns:
+                    db.execute(
+                        "INSERT OR IGNORE INTO journal SELECT ?, service, uuid, digest, user, state, response, created"
+                        " FROM journal_old",
+                        (_base_host(SAPConfig.BASE_URL),),
+                    )
+                    db.execute("DROP TABLE journal_old")
+                db.execute("CREATE INDEX IF NOT EXISTS journal_created ON journal (created)")
+            finally:
+                db.execute("COMMIT")
+            self._db = db
+            self._compact_locked()
+        return self._db
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._conn().execute(sql, params)
+
+    def _claim(self, host: str, service: str, uuid: str, digest: str, user: str):
+        """回傳 ("done", response) / ("pending", None) / ("claimed", None) / ("conflict", None)"""
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT digest, state, response, created FROM journal WHERE host = ? AND service = ? AND uuid = ?",
+                    (host, service, uuid),
+                ).fetchone()
+                if row is not None:
+                    row_digest, state, response, created = row
+                    if row_digest != digest:
+                        return ("conflict", None)
+                    if state == "done":
+                        return ("done", response)
+                    if now - created < self.pending_timeout:
+                        return ("pending", None)
+                # 沒有紀錄，或 pending 已逾時 (前一個執行者中途結束)：由本呼叫接手
+                db.execute(
+                    "INSERT OR REPLACE INTO journal (host, service, uuid, digest, user, state, response, created)"
+                    " VALUES (?, ?, ?, ?, ?, 'pending', NULL, ?)",
+                    (host, service, uuid, digest, user, now),
+                )
+                return ("claimed", None)
+            finally:
+                db.execute("COMMIT")
+
+    async def _run(self, host: str, service: str, uuid: str, digest: str, user: str, call):
+        waited = False
+        deadline = _deadline.get() or time.monotonic() + SAPConfig.TOOL_DEADLINE
+        while True:
+            state, response = await asyncio.to_thread(self._claim, host, service, uuid, digest, user)
+            if state == "done":
+                if waited:
+                    self.waited += 1
+                else:
+                    self.replayed += 1
+                return json.loads(response)
+            if state == "conflict":
+                self.conflicts += 1
+                raise IdempotencyConflict(f"UUID {uuid} 已用於內容或使用者不同的 {service} 請求，請使用新的 UUID")
+            if state == "claimed":
+                break
+            # 其他程序正在處理同一 UUID：最多等到工具呼叫期限，不等滿 pending_timeout
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SAPUnavailable(f"UUID {uuid} 的 {service} 請求仍由其他程序處理中，已超過工具呼叫期限")
+            waited = True
+            await asyncio.sleep(min(0.25, remaining))
+
+        release = (
+            "DELETE FROM journal WHERE host = ? AND service = ? AND uuid = ? AND state = 'pending'", (host, service, uuid)
+        )
+        try:
+            result = await call()
+        except BaseException:
+            # 取消時也要釋放 pending 列；同步執行避免 to_thread 本身被取消
+            self._execute(*release)
+            raise
+        if self._store_if(result):
+            await asyncio.to_thread(
+                self._execute,
+                "UPDATE journal SET state = 'done', response = ?, created = ? WHERE host = ? AND service = ? AND uuid = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), host, service, uuid),
+            )
+            self.stored += 1
+            self._stores_since_compact += 1
+            if self._stores_since_compact >= 100:
+                await asyncio.to_thread(self.compact)
+        else:
+            await asyncio.to_thread(self._execute, *release)
+            self.discarded += 1
+        return result
+
+    async def run(self, service: str, uuid: str, request: bytes, call, user: str = None,
+                  credential: str = None, host: str = ""):
+        """以日誌保護 call()：同一 (host, service, uuid) 只會實際執行一次成功的 call()
+
+        call() 的結果須可 JSON 序列化 (由日誌取回時為 json.loads 的結果)。
+        同一 UUID 搭配不同的 request、user 或 credential (credential_fingerprint) 時拋出
+        IdempotencyConflict；其他程序處理中的請求超過工具呼叫期限仍未完成時拋出 SAPUnavailable。
+        """
+        digest = hashlib.sha256(f"{user or ''}\x00{credential or ''}\x00".encode("utf-8") + request).hexdigest()
+        key = (host, service, uuid)
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            task, task_digest = in_flight
+            if task_digest == digest:
+                self.coalesced += 1
+                return await asyncio.shield(task)
+            # 內容或使用者不同：pending 列的 digest 不符，_run 會回傳衝突
+            return await self._run(host, service, uuid, digest, user, call)
+        task = asyncio.ensure_future(self._run(host, service, uuid, digest, user, call))
+        self._in_flight[key] = (task, digest)
+        task.add_done_callback(lambda t: self._forget_in_flight(key, t))
+        # shield：呼叫端被取消時 SAP 請求仍繼續完成並寫入日誌，之後的重試可直接取得結果
+        return await asyncio.shield(task)
+
+    def _forget_in_flight(self, key, task):
+        if self._in_flight.get(key, (None,))[0] is task:
+            del self._in_flight[key]
+
+    def _compact_locked(self) -> int:
+        db = self._db
+        cutoff = time.time()
+        removed = db.execute(
+            "DELETE FROM journal WHERE (state = 'done' AND created < ?) OR (state = 'pending' AND created < ?)",
+            (cutoff - self.max_age, cutoff - self.pending_timeout),
+        ).rowcount
+        overflow = db.execute("SELECT COUNT(*) FROM journal WHERE state = 'done'").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            removed += db.execute(
+                "DELETE FROM journal WHERE rowid IN"
+                " (SELECT rowid FROM journal WHERE state = 'done' ORDER BY created LIMIT ?)",
+                (overflow,),
+            ).rowcount
+        if removed:
+            db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        self._stores_since_compact = 0
+        self.compacted += removed
+        return removed
+
+    def compact(self) -> int:
+        """刪除超過 max_age 的紀錄，並只保留最新的 max_entries 筆；回傳刪除筆數"""
+        with self._lock:
+            self._conn()
+            return self._compact_locked()
+
+    def forget(self, service: str, uuid: str, host: str = None) -> bool:
+        """刪除指定 (服務, UUID) 的紀錄 (host 為 None 時不分 SAP 主機)，讓下一次呼叫重新送出"""
+        if host is None:
+            return self._execute("DELETE FROM journal WHERE service = ? AND uuid = ?", (service, uuid)).rowcount > 0
+        return self._execute(
+            "DELETE FROM journal WHERE host = ? AND service = ? AND uuid = ?", (host, service, uuid)
+        ).rowcount > 0
+
+    def stats(self) -> dict:
+        rows = dict(self._execute("SELECT state, COUNT(*) FROM journal GROUP BY state").fetchall())
+        return {
+            "path": self.path,
+            "max_age": self.max_age,
+            "max_entries": self.max_entries,
+            "entries": rows.get("done", 0),
+            "pending": rows.get("pending", 0),
+            "in_flight": len(self._in_flight),
+            "replayed": self.replayed,
+            "coalesced": self.coalesced,
+            "waited": self.waited,
+            "stored": self.stored,
+            "discarded": self.discarded,
+            "conflicts": self.conflicts,
+            "compacted": self.compacted,
+        }
+
+def _result_storable(result) -> bool:
+    """只保存 SAP 已實際處理的 (body, error) 結果：連線 / HTTP 錯誤與 RETURN TYPE E/A
+    的業務錯誤不保存，修正主資料後仍可用同一 UUID 重試
+    """
+    body, error = result
+    if error is not None:
+        return False
+    return not any(m["type"] in ("E", "A") for m in _return_messages(body))
+
+# 建立 / 維護工具的 UUID 日誌：key 為 (服務, UUID)
+idempotency_journal = IdempotencyJournal(
+    path=SAPConfig.JOURNAL_PATH,
+    max_age=SAPConfig.JOURNAL_MAX_AGE,
+    max_entries=SAPConfig.JOURNAL_MAX_ENTRIES,
+    pending_timeout=SAPConfig.JOURNAL_PENDING_TIMEOUT,
+    store_if=_result_storable,
+)
+
+class MaintenanceCache:
+    """主資料維護結果的持久化快取 (SQLite，可與冪等日誌共用同一個檔案)
+
+    maintain_* 工具以「工具名稱 + SAP 主機 + 憑證指紋 + 完整維護參數 (不含 UUID)」為鍵，
+    成功的回應在 ttl 秒內直接回傳，不再執行 BAPI；同時進行的相同維護只送出一次。
+    憑證指紋 (credential_fingerprint) 涵蓋帳號與密碼，其他帳號或密碼錯誤的工作階段
+    不會取得已保存的成功結果。
+    最多保留 max_entries 筆 (超過時刪除最舊的)。ttl 為 0 時停用。
+    SQLite 讀寫於執行緒中進行，不阻塞事件迴圈。
+    """
+    def __init__(self, path: str, ttl: float, max_entries: int, store_if=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._store_if = store_if or (lambda value: True)
+        self._lock = threading.Lock()
+        self._db = None
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stored = 0
+        self.invalidated = 0
+        self.evictions = 0
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            if self._db is None:
+                db = _open_sqlite(self.path)
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS maintained ("
+                    " key TEXT PRIMARY KEY, tool TEXT NOT NULL, material TEXT,"
+                    " response TEXT NOT NULL, created REAL NOT NULL)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS maintained_material ON maintained (material)")
+                db.execute("CREATE INDEX IF NOT EXISTS maintained_created ON maintained (created)")
+                self._db = db
+            return self._db.execute(sql, params)
+
+    @staticmethod
+    def _key(tool: str, values: dict, credential: str = None) -> str:
+        params = {k: v for k, v in values.items() if k != "UUID"}
+        return f"{tool}|{SAPConfig.BASE_URL}|{credential or ''}|{json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)}"
+
+    def _lookup(self, key: str):
+        return self._execute("SELECT response, created FROM maintained WHERE key = ?", (key,)).fetchone()
+
+    def _store(self, key: str, tool: str, material: str, response: str):
+        self._execute(
+            "INSERT OR REPLACE INTO maintained (key, tool, material, response, created) VALUES (?, ?, ?, ?, ?)",
+            (key, tool, material.strip().upper(), response, time.time()),
+        )
+
+    async def run(self, tool: str, material: str, values: dict, call, credential: str = None):
+        """同一組憑證 (credential_fingerprint) 以相同 values 成功維護過時，
+        在 ttl 內直接回傳保存的結果 (JSON 還原)，否則執行 call()
+        """
+        if self.ttl <= 0:
+            return await call()
+        key = self._key(tool, values, credential)
+        row = await asyncio.to_thread(self._lookup, key)
+        if row is not None and time.time() - row[1] <= self.ttl:
+            self.hits += 1
+            return json.loads(row[0])
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+        self.misses += 1
+        task = asyncio.ensure_future(call())
+        self._in_flight[key] = task
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            if self._in_flight.get(key) is task:
+                del self._in_flight[key]
+        if self._store_if(result):
+            await asyncio.to_thread(self._store, key, tool, material, json.dumps(result, ensure_ascii=False))
+            self.stored += 1
+            if self.stored % 100 == 0:
+                await asyncio.to_thread(self.compact)
+        return result
+
+    def invalidate(self, tool: str = None, material: str = None) -> int:
+        """刪除指定工具及 / 或物料的紀錄 (皆未指定時全部刪除)，回傳刪除筆數"""
+        clauses, params = [], []
+        if tool:
+            clauses.append("tool = ?")
+            params.append(tool)
+        if material:
+            clauses.append("material = ?")
+            params.append(material.strip().upper())
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        removed = self._execute(f"DELETE FROM maintained{where}", params).rowcount
+        self.invalidated += removed
+        return removed
+
+    def compact(self) -> int:
+        """刪除過期紀錄，並只保留最新的 max_entries 筆"""
+        removed = self._execute("DELETE FROM maintained WHERE created < ?", (time.time() - self.ttl,)).rowcount
+        overflow = self._execute("SELECT COUNT(*) FROM maintained").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            removed += self._execute(
+                "DELETE FROM maintained WHERE key IN (SELECT key FROM maintained ORDER BY created LIMIT ?)",
+                (overflow,),
+            ).rowcount
+        self.evictions += removed
+        return removed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        by_tool = dict(self._execute("SELECT tool, COUNT(*) FROM maintained GROUP BY tool").fetchall()) if self.ttl > 0 else {}
+        return {
+            "path": self.path,
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+            "entries": sum(by_tool.values()),
+            "entries_by_tool": by_tool,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "stored": self.stored,
+            "invalidated": self.invalidated,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+# maintain_* 工具的「已維護」快取 (與 idempotency_journal 相同的成功判斷)
+maintenance_cache = MaintenanceCache(
+    path=SAPConfig.MAINT_CACHE_PATH,
+    ttl=SAPConfig.MAINT_CACHE_TTL,
+    max_entries=SAPConfig.MAINT_CACHE_SIZE,
+    store_if=_result_storable,
+)
+
+# ==============================================================================
+# 工作階段管理工具 (Session Management Tools)
+# ==============================================================================
+
+@mcp.tool()
+async def set_sap_credentials(
+    username: str,
+    password: str,
+    ctx: Context = None
+) -> str:
+    """設定目前工作階段的 SAP 憑證
+
+    參數:
+        username: SAP 使用者名稱
+        password: SAP 密碼
+
+    回傳:
+        設定結果訊息
+    """
+    session_id = _get_session_id(ctx)
+    if session_id == 'default' and _http_request(ctx) is not None:
+        # 未指定工作階段的 HTTP 請求共用 'default'，只能使用環境變數的預設憑證
+        return (
+            "[ERROR] 無法設定憑證\n"
+            "無狀態 HTTP 模式請以 X-SAP-Session 標頭指定工作階段後再呼叫 set_sap_credentials"
+        )
+
+    # 共用儲存為 SQLite 時寫入可能等待 busy timeout，不在事件迴圈中執行
+    await asyncio.to_thread(session_registry.set_credentials, session_id, username, password)
+    return f"已為工作階段 {session_id} 設定 SAP 憑證（使用者：{username}）"
+
+@mcp.tool()
+async def check_session_credentials(ctx: Context = None) -> str:
+    """檢查目前工作階段是否已設定憑證
+
+    回傳:
+        憑證狀態資訊
+    """
+    session_id = _get_session_id(ctx)
+
+    try:
+        creds = await asyncio.to_thread(session_registry.get_credentials, session_id)
+    except ValueError:
+        return f"工作階段 {session_id} 未設定憑證"
+    return f"工作階段 {session_id} 已設定憑證（使用者：{creds['user']}）"
+
+# MCP 工作階段物件 -> session ID (工作階段結束後自動移除)
+_session_ids = weakref.WeakKeyDictionary()
+
+# HTTP 模式下由客戶端指定工作階段的標頭 (無狀態 HTTP 每個請求都是新的 MCP 工作階段)
+SESSION_HEADER = "x-sap-session"
+
+def _http_request(ctx: Context = None):
+    """目前 MCP 請求的 HTTP request (stdio 模式或不在請求中時為 None)"""
+    try:
+        return ctx.request_context.request
+    except (AttributeError, ValueError):
+        return None
+
+def _get_session_id(ctx: Context = None) -> str:
+    """從 Context 中提取 session ID (每個 MCP 工作階段只計算一次)
+
+    HTTP 模式優先使用 X-SAP-Session 標頭，其次為 Mcp-Session-Id 標頭，
+    兩者在所有工作程序中都相同。無狀態 HTTP 且未帶上述標頭的請求沒有
+    client_params，一律為 'default' (只使用環境變數的預設憑證)。
+    """
+    if ctx is None:
+        return 'default'
+    if isinstance(ctx, _JobContext):
+        return ctx.session_id
+    try:
+        request = ctx.request_context.request
+        if request is not None:
+            headers = getattr(request, "headers", None) or {}
+            token = headers.get(SESSION_HEADER) or headers.get("mcp-session-id")
+            if token:
+                return "h" + hashlib.blake2b(token.encode("utf-8"), digest_size=12).hexdigest()
+        session = ctx.session
+        session_id = _session_ids.get(session)
+        if session_id is not None:
+            return session_id
+        # 以 client_params 識別工作階段；尚未初始化或無狀態 HTTP 時為 None，
+        # 不可雜湊 str(None) (所有匿名客戶端會得到同一個 ID)
+        client_params = getattr(session, 'client_params', None)
+        if client_params is None:
+            return 'default'
+        # 不用 hash()：字串雜湊在每個程序不同，共用儲存需要穩定的 ID
+        session_id = hashlib.blake2b(str(client_params).encode("utf-8"), digest_size=12).hexdigest()
+        _session_ids[session] = session_id
+    except ValueError:
+        # 不在 MCP 請求中 (例如 mcp.call_tool 直接呼叫)，Context 沒有 request_context
+        return 'default'
+    return session_id
+
+@mcp.tool()
+def get_session_registry_stats() -> str:
+    """查詢工作階段登錄統計 (保留的工作階段 / 快取的 client / 移除次數)
+
+    回傳:
+        JSON 格式的工作階段統計資訊
+    """
+    return json.dumps(session_registry.stats(), ensure_ascii=False, indent=2)
+
+@mcp.tool()
+async def get_state_backend_stats() -> str:
+    """查詢共用狀態儲存 (工作階段憑證與狀態查詢快取) 的統計
+
+    回傳:
+        JSON 格式的儲存類型、筆數與讀寫次數
+    """
+    stats = await asyncio.to_thread(state_backend.stats)
+    stats["shared"] = state_backend.shared
+    stats["pid"] = os.getpid()
+    return json.dumps(stats, ensure_ascii=False, indent=2)
+
+@mcp.tool()
+def get_traffic_recorder_stats() -> str:
+    """查詢 SAP 流量紀錄 (SAP_RECORD_PATH) 的狀態
+
+    回傳:
+        JSON 格式的紀錄檔路徑、已寫入與尚在緩衝區的筆數、未壓縮與壓縮後位元組數；未開啟時 enabled 為 false
+    """
+    if traffic_recorder is None:
+        return json.dumps({"enabled": False}, ensure_ascii=False, indent=2)
+    return json.dumps(dict(traffic_recorder.stats(), enabled=True), ensure_ascii=False, indent=2)
+
+@mcp.tool()
+def get_connection_pool_stats() -> str:
+    """查詢 SAP 連線池統計 (新開連線數 / 重複使用連線數)
+
+    回傳:
+        JSON 格式的連線池統計資訊
+    """
+    return json.dumps(sap_pool.stats(), ensure_ascii=False, indent=2)
+
+@mcp.tool()
+def get_service_metrics(FORMAT: str = "json", RESET: bool = False) -> str:
+    """查詢每個 SAP 服務的效能統計
+
+    依服務 (SO / STO / DN / MAT / SRC / INF / QTY / STATUS) 分開統計
+    build / queue / network / parse / format 各階段耗時、請求與回應位元組數、
+    HTTP 狀態碼與錯誤數。
+
+    參數:
+        FORMAT: "json" (摘要，含估計的 p50 / p95 / p99) 或 "prometheus" (完整直方圖)
+        RESET: 回傳後清除目前的統計
+
+    回傳:
+        JSON 或 Prometheus text format 的統計資訊
+    """
+    if FORMAT.strip().lower() == "prometheus":
+        result = service_metrics.prometheus()
+    else:
+        result = json.dumps(service_metrics.stats(), ensure_ascii=False, indent=2)
+    if RESET:
+        service_metrics.reset()
+    return result
+
+@mcp.tool()
+def get_circuit_breaker_stats() -> str:
+    """查詢每個 SAP 服務的斷路器狀態 (closed / open / half_open) 與跳脫次數
+
+    回傳:
+        JSON 格式的斷路器狀態
+    """
+    return json.dumps(
+        {
+            "failure_threshold": SAPConfig.BREAKER_FAILURES,
+            "reset_timeout": SAPConfig.BREAKER_RESET_TIMEOUT,
+            "services": {key: breaker.stats() for key, breaker in circuit_breakers.items()},
+        },
+        ensure_ascii=False,
+        indent=2,
+    )
+
+@mcp.resource("metrics://sap/services", name="sap_service_metrics", mime_type="application/json")
+def service_metrics_resource() -> str:
+    """每個 SAP 服務的階段耗時 / 位元組數 / 狀態碼摘要 (JSON)"""
+    return json.dumps(service_metrics.stats(), ensure_ascii=False, indent=2)
+
+@mcp.resource("metrics://sap/prometheus", name="sap_service_metrics_prometheus", mime_type="text/plain; version=0.0.4")
+def service_metrics_prometheus() -> str:
+    """每個 SAP 服務的效能統計 (Prometheus text format)"""
+    return service_metrics.prometheus()
+
+async def _report_progress(ctx: Context, progress: float, total: float = None, message: str = None):
+    """透過 ctx.report_progress 回報進度；沒有請求內容 (例如直接呼叫) 時略過"""
+    if ctx is None:
+        return
+    try:
+        await ctx.report_progress(progress, total, message)
+    except ValueError:
+        # Context is not available outside of a request
+        pass
+
+def recursive_find(key, data):
+    """在巢狀 dict 中遞迴搜尋指定 key 的值"""
+    if isinstance(data, dict):
+        if key in data:
+            return data[key]
+        for v in data.values():
+            result = recursive_find(key, v)
+            if result is not None:
+                return result
+    elif isinstance(data, list):
+        for item in data:
+            result = recursive_find(key, item)
+            if result is not None:
+                return result
+    return None
+
+def _fault_detail(error: str) -> str:
+    """HTTP 錯誤字串中的 SOAP faultstring (找不到時回傳原字串)"""
+    try:
+        fault = extract_soap_fields(error.split(":", 1)[1].strip(), ["faultstring"])["faultstring"]
+        if fault:
+            return fault
+    except:
+        pass
+    return error
+
+def _format_result(key: str, uuid: str, result, raw: bool) -> str:
+    """建立 / 維護工具的輸出 (計入 key 的 format 階段耗時)
+
+    raw 時 (工具參數 RAW，預設值為 SAP_RAW_RESULTS) 與舊版相同，回傳完整 Body 的 str(dict) 或錯誤字串；
+    否則回傳精簡 JSON:
+        status: OK / ERROR (RETURN 含 TYPE E/A) / HTTP_ERROR / CONNECTION_ERROR / CONFLICT / PARSE_ERROR
+        documents: <...Response> 下的單值匯出參數 (SALESDOCUMENT、PO_NUMBER 等)
+        messages: 正規化的 RETURN 表格 [{type, id, number, message}]
+    """
+    with service_metrics.timer(key, "format"):
+        body, error = result
+        if raw:
+            return error if error is not None else str(body)
+
+        out = {"service": key}
+        if uuid and uuid.strip():
+            out["uuid"] = uuid.strip()
+        if error is None:
+            messages = _return_messages(body)
+            out["status"] = "ERROR" if any(m["type"] in ("E", "A") for m in messages) else "OK"
+            out["documents"] = _response_fields(body)
+            out["messages"] = messages
+        elif error.startswith("HTTP 錯誤"):
+            out["status"] = "HTTP_ERROR"
+            out["error"] = _fault_detail(error)
+        elif error.startswith("連線錯誤"):
+            out["status"] = "CONNECTION_ERROR"
+            out["error"] = error.split(":", 1)[1].strip()
+        elif error.startswith("UUID 衝突"):
+            out["status"] = "CONFLICT"
+            out["error"] = error.split(":", 1)[1].strip()
+        else:
+            # 200 但不是可解析的 SOAP Envelope
+            out["status"] = "PARSE_ERROR"
+            out["error"] = error[:2000]
+        return json.dumps(out, ensure_ascii=False, separators=(",", ":"))
+
+def _normalize_items(items, required: tuple) -> list:
+    """ITEMS 參數 -> 欄位名稱大寫、略過空白值的 dict list；格式錯誤或缺少必要欄位時拋出 ValueError"""
+    if not isinstance(items, list) or not items:
+        raise ValueError("ITEMS 必須是至少一筆明細的陣列")
+    lines = []
+    for index, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            raise ValueError(f"第 {index} 筆明細不是物件")
+        line = {str(k).strip().upper(): v for k, v in item.items() if v is not None and str(v).strip() != ""}
+        missing = [field for field in required if field not in line]
+        if missing:
+            raise ValueError(f"第 {index} 筆明細缺少 {', '.join(missing)}")
+        lines.append(line)
+    return lines
+
+def _item_number(index: int, width: int) -> str:
+    """第 index 筆 (0 起算) 明細的項目編號 10, 20, 30 ...，補零到 width 位"""
+    return f"{(index + 1) * 10:0{width}d}"
+
+def _invalid_items(key: str, uuid: str, error: str) -> str:
+    out = {"service": key}
+    if uuid and uuid.strip():
+        out["uuid"] = uuid.strip()
+    out["status"] = "INVALID"
+    out["error"] = error
+    return json.dumps(out, ensure_ascii=False, separators=(",", ":"))
+
+def _single_item_error(key: str, uuid: str, item_field: str, item, qty_field: str, qty):
+    """未使用 ITEMS 時檢查單一明細欄位：item 不可空白且 qty 必須大於 0；
+    不合法時回傳與 ITEMS 格式錯誤相同的 INVALID JSON (不送出請求)，否則回傳 None
+    """
+    problems = []
+    if not str(item or "").strip():
+        problems.append(f"{item_field} 不可空白")
+    try:
+        positive = float(qty) > 0
+    except (TypeError, ValueError):
+        positive = False
+    if not positive:
+        problems.append(f"{qty_field} 必須大於 0 (目前為 {qty})")
+    if not problems:
+        return None
+    return _invalid_items(key, uuid, f"未指定 ITEMS 時{'，'.join(problems)}")
+
+async def _send_item_chunks(client: "SAPClient", uuid: str, lines: list, build, sequential: bool) -> list:
+    """將明細依 SAPConfig.item_chunk_size 分段，每段一個 SOAP 請求
+
+    build(分段 UUID, 分段的明細) 回傳 client.build() 的參數。UUID 非空且多於一段時
+    第 n 段使用 "{UUID}-{n}"。sequential 時依序送出 (同一張單據的各段會互相鎖定)，
+    否則同時送出 (仍受每個服務的並行上限限制)。回傳 [(分段 UUID, 分段的明細, (body, error))]
+    """
+    size = max(1, SAPConfig.item_chunk_size(client.key))
+    chunks = [lines[start:start + size] for start in range(0, len(lines), size)]
+    uuid = (uuid or "").strip()
+
+    async def send(n: int, chunk: list):
+        chunk_uuid = f"{uuid}-{n}" if uuid and len(chunks) > 1 else uuid
+        result = await client.apost_soap_once(chunk_uuid, client.build(build(chunk_uuid, chunk)))
+        return chunk_uuid, chunk, result
+
+    if sequential:
+        return [await send(n, chunk) for n, chunk in enumerate(chunks, 1)]
+    return list(await asyncio.gather(*(send(n, chunk) for n, chunk in enumerate(chunks, 1))))
+
+def _format_item_results(key: str, uuid: str, sent: list, raw: bool, describe, document: str = None) -> str:
+    """多明細工具的輸出
+
+    raw 時回傳各分段的完整回應 (以空行分隔)；否則回傳精簡 JSON:
+        status: 各分段相同時為該狀態，否則為 PARTIAL
+        chunks: 每個分段的 _format_result 結果 (uuid / status / documents / messages)
+        lines: 依輸入順序，每筆明細一列 — line (1 起算)、chunk、status (該分段的狀態)、
+               describe(明細, 分段內的列號) 的欄位 (項目編號等)、該分段建立的單據
+               (documents 中的 document 欄位)，以及 RETURN 中 ROW 指向此明細的訊息
+    """
+    if raw:
+        return "\n\n".join(_format_result(key, chunk_uuid, result, True) for chunk_uuid, _, result in sent)
+    chunks, lines = [], []
+    for n, (chunk_uuid, chunk, result) in enumerate(sent, 1):
+        outcome = json.loads(_format_result(key, chunk_uuid, result, False))
+        outcome.pop("service")
+        chunks.append(dict(chunk=n, **outcome))
+        for row, item in enumerate(chunk, 1):
+            line = {"line": len(lines) + 1, "chunk": n, "status": outcome["status"], **describe(item, row)}
+            if document and document in outcome.get("documents", {}):
+                line["document"] = outcome["documents"][document]
+            messages = [m for m in outcome.get("messages", ()) if m.get("row") == row]
+            if messages:
+                line["messages"] = messages
+            lines.append(line)
+    statuses = {chunk["status"] for chunk in chunks}
+    out = {"service": key}
+    if uuid and uuid.strip():
+        out["uuid"] = uuid.strip()
+    out["status"] = statuses.pop() if len(statuses) == 1 else "PARTIAL"
+    out["chunks"] = chunks
+    out["lines"] = lines
+    return json.dumps(out, ensure_ascii=False, separators=(",", ":"))
+
+# ==============================================================================
+# SAP 操作工具 (SAP Operation Tools)
+# ==============================================================================
+
+@mcp.tool()
+@background_tool
+async def create_sales_order(
+    CUST_PO: str,
+    CUST_PO_DATE: str,
+    MATERIAL: str = "",
+    QTY: float = 0,
+    UUID: str = "",
+    ORDER_TYPE: str = "ZIES",
+    SALES_ORG: str = "TW01",
+    SALES_CHANNEL: str = "03",
+    SALES_DIVISION: str = "01",
+    SOLD_TO_PARTY: str = "HRCTO-IMX",
+    SHIP_TO_PARTY: str = "HRCTO-MX",
+    PLANT: str = "TP01",
+    SHIPPING_POINT: str = "TW01",
+    ITEMS: Optional[List[dict]] = None,
+    RAW: bool = SAPConfig.RAW_RESULTS,
+    ctx: Context = None
+) -> str:
+    """步驟 1: 建立銷售訂單 (Sales Order)
+
+    單一明細時使用 MATERIAL / QTY (未指定 ITEMS 時兩者必填，QTY 須大於 0)。多明細時改用 ITEMS，例如
+    [{"MATERIAL": "MAT-1", "QTY": 5}, {"MATERIAL": "MAT-2", "QTY": 1, "PLANT": "CP60"}]，
+    每筆可另外指定 PLANT / SHIPPING_POINT / DELIVERY_DATE / UNIT / ITEM_NO
+    (未指定時項目編號依序為 000010、000020 ...)。超過 SAP_ITEM_CHUNK_SIZE_SO 筆時
+    分成多張銷售訂單同時建立 (UUID 非空時第 n 張使用 "{UUID}-{n}")。
+
+    回傳精簡 JSON (status / documents / messages)；使用 ITEMS 時改為 chunks (每張訂單的結果)
+    與 lines (依輸入順序每筆明細的 chunk、項目編號、狀態與該列的 SAP 訊息)。
+    RAW=True 時回傳完整的 SAP 回應。
+    """
+
+    # 獲取目前工作階段的 session ID
+    session_id = _get_session_id(ctx)
+
+    # 空白的抬頭欄位一律由 REQUEST_SCHEMAS 套用預設值，以防止「缺少必要的抬頭欄位」錯誤
+    cust_po_date_val = CUST_PO_DATE if CUST_PO_DATE else "2025-01-01"
+
+    client = await session_registry.aclient(session_id, "SO")
+    header = {
+        "CUST_PO": CUST_PO,
+        "CUST_PO_DATE": cust_po_date_val,
+        "ORDER_TYPE": ORDER_TYPE,
+        "SALES_CHANNEL": SALES_CHANNEL,
+        "SALES_DIVISION": SALES_DIVISION,
+        "SALES_ORG": SALES_ORG,
+        "SHIP_TO_PARTY": SHIP_TO_PARTY,
+        "SOLD_TO_PARTY": SOLD_TO_PARTY,
+    }
+
+    def so_item(item: dict, index: int) -> dict:
+        return {
+            "MATERIAL_NO": str(item["ITEM_NO"]).zfill(6) if "ITEM_NO" in item else _item_number(index, 6),
+            "MATERIAL": item.get("MATERIAL", MATERIAL),
+            "UNIT": item.get("UNIT"),
+            "QTY": item.get("QTY", QTY),
+            "PLANT": item.get("PLANT", PLANT),
+            "SHIPPING_POINT": item.get("SHIPPING_POINT", SHIPPING_POINT),
+            "DELIVERY_DATE": item.get("DELIVERY_DATE", cust_po_date_val),
+        }
+
+    if ITEMS is None:
+        error = _single_item_error("SO", UUID, "MATERIAL", MATERIAL, "QTY", QTY)
+        if error:
+            return error
+        payload = client.build(dict(header, UUID=UUID, IT_SO_ITEM=[so_item({}, 0)]))
+        result = await client.apost_soap_once(UUID, payload)
+        return _format_result("SO", UUID, result, RAW)
+
+    try:
+        lines = _normalize_items(ITEMS, ("MATERIAL", "QTY"))
+    except ValueError as e:
+        return _invalid_items("SO", UUID, str(e))
+    # 每一段是一張新的銷售訂單，項目編號在每張訂單內由 000010 起算
+    sent = await _send_item_chunks(
+        client, UUID, lines,
+        lambda chunk_uuid, chunk: dict(
+            header, UUID=chunk_uuid, IT_SO_ITEM=[so_item(item, i) for i, item in enumerate(chunk)]
+        ),
+        sequential=False,
+    )
+    return _format_item_results(
+        "SO", UUID, sent, RAW,
+        lambda item, row: {"item_no": so_item(item, row - 1)["MATERIAL_NO"], "material": item["MATERIAL"]},
+        document="SALESDOCUMENT",
+    )
+
+@mcp.tool()
+@background_tool
+async def create_sto_po(
+    PR_NUMBER: str,
+    PR_ITEM: str,
+    UUID: str = "",
+    PUR_GROUP: str = "999",
+    PUR_ORG: str = "TW10",
+    PUR_PLANT: str = "TP01",
+    VENDOR: str = "ICC-CP60",
+    DOC_TYPE: str = "NB",
+    RAW: bool = SAPConfig.RAW_RESULTS,
+    ctx: Context = None
+) -> str:
+    """步驟 2: 建立 STO 採購訂單 (PO)
+
+    回傳精簡 JSON (status / documents / messages)；RAW=True 時回傳完整的 SAP 回應。
+    """
+
+    session_id = _get_session_id(ctx)
+
+    client = await session_registry.aclient(session_id, "STO")
+    payload = client.build({
+        "UUID": UUID,
+        "DOC_TYPE": DOC_TYPE,
+        "PR_NUMBER": PR_NUMBER,
+        "PUR_GROUP": PUR_GROUP,
+        "PUR_ITEM": [{"BNFPO": PR_ITEM}],
+        "PUR_ORG": PUR_ORG,
+        "PUR_PLANT": PUR_PLANT,
+        "VENDOR": VENDOR,
+    })
+
+    result = await client.apost_soap_once(UUID, payload)
+    return _format_result("STO", UUID, result, RAW)
+
+@mcp.tool()
+@background_tool
+async def create_outbound_delivery(
+    PO_NUMBER: str,
+    ITEM_NO: str = "",
+    QUANTITY: float = 0,
+    UUID: str = "",
+    ITEMS: Optional[List[dict]] = None,
+    RAW: bool = SAPConfig.RAW_RESULTS,
+    ctx: Context = None
+) -> str:
+    """步驟 3: 建立外向交貨單 (Outbound Delivery)
+
+    單一明細時使用 ITEM_NO / QUANTITY (未指定 ITEMS 時兩者必填，QUANTITY 須大於 0)。多明細時改用 ITEMS，例如
+    [{"QUANTITY": 5}, {"ITEM_NO": "00030", "QUANTITY": 2}]，每筆可另外指定 PO_NUMBER
+    (預設為參數 PO_NUMBER) 與 SALES_UNIT；未指定 ITEM_NO 時依輸入順序對應 PO 項目
+    00010、00020 ...。超過 SAP_ITEM_CHUNK_SIZE_DN 筆時分成多張交貨單依序建立
+    (UUID 非空時第 n 張使用 "{UUID}-{n}")。
+
+    回傳精簡 JSON (status / documents / messages)；使用 ITEMS 時改為 chunks (每張交貨單的結果)
+    與 lines (依輸入順序每筆明細的 chunk、PO 項目、狀態與該列的 SAP 訊息)。
+    RAW=True 時回傳完整的 SAP 回應。
+    """
+
+    session_id = _get_session_id(ctx)
+
+    # SHIP_POINT 固定為 CN60 (REQUEST_SCHEMAS 預設值)
+    client = await session_registry.aclient(session_id, "DN")
+    if ITEMS is None:
+        error = _single_item_error("DN", UUID, "ITEM_NO", ITEM_NO, "QUANTITY", QUANTITY)
+        if error:
+            return error
+        payload = client.build({
+            "UUID": UUID,
+            "PO_ITEM": [{"REF_DOC": PO_NUMBER, "REF_ITEM": ITEM_NO, "DLV_QTY": QUANTITY}],
+        })
+        result = await client.apost_soap_once(UUID, payload)
+        return _format_result("DN", UUID, result, RAW)
+
+    try:
+        lines = _normalize_items(ITEMS, ("QUANTITY",))
+    except ValueError as e:
+        return _invalid_items("DN", UUID, str(e))
+    # PO 項目編號依整份清單的順序 (參照既有 PO 的項目)
+    for index, item in enumerate(lines):
+        item.setdefault("ITEM_NO", _item_number(index, 5))
+        item.setdefault("PO_NUMBER", PO_NUMBER)
+    # 同一張 PO 的交貨單依序建立，避免參考單據鎖定衝突
+    sent = await _send_item_chunks(
+        client, UUID, lines,
+        lambda chunk_uuid, chunk: {
+            "UUID": chunk_uuid,
+            "PO_ITEM": [{"REF_DOC": item["PO_NUMBER"], "REF_ITEM": item["ITEM_NO"], "DLV_QTY": item["QUANTITY"],
+                         "SALES_UNIT": item.get("SALES_UNIT")} for item in chunk],
+        },
+        sequential=True,
+    )
+    return _format_item_results(
+        "DN", UUID, sent, RAW,
+        lambda item, row: {"po_number": item["PO_NUMBER"], "item_no": item["ITEM_NO"]},
+        document="DELIVERY",
+    )
+
+@mcp.tool()
+@background_tool
+async def maintain_info_record(
+    MATERIAL: str,
+    UUID: str = "",
+    PRICE: str = "999",
+    VENDOR: str = "ICC-CP60",
+    PLANT: str = "TP01",
+    PUR_ORG: str = "TW10",
+    RAW: bool = SAPConfig.RAW_RESULTS,
+    ctx: Context = None
+) -> str:
+    """補救操作: 維護資訊記錄 (Info Record)
+
+    相同參數的成功維護在 SAP_MAINT_CACHE_TTL 秒內直接回傳上次結果，不再送到 SAP
+    (可用 invalidate_maintenance_cache 清除)。
+    回傳精簡 JSON (status / documents / messages)；RAW=True 時回傳完整的 SAP 回應。
+    """
+
+    session_id = _get_session_id(ctx)
+
+    client = await session_registry.aclient(session_id, "INF")
+    values = {
+        "UUID": UUID,
+        "MATERIAL": MATERIAL,
+        "PLANT": PLANT,
+        "PRICE": PRICE,
+        "PUR_ORG": PUR_ORG,
+        "VENDOR": VENDOR,
+    }
+    payload = client.build(values)
+
+    result = await maintenance_cache.run(
+        "maintain_info_record", MATERIAL, values, lambda: client.apost_soap_once(UUID, payload), credential=client.credential
+    )
+    return _format_result("INF", UUID, result, RAW)
+
+@mcp.tool()
+@background_tool
+async def maintain_sales_view(
+    MATERIAL: str,
+    SALES_ORG: str,
+    DISTR_CHAN: str,
+    UUID: str = "",
+    PLANT: str = "TP01",
+    DELYG_PLNT: str = "TP01",
+    RAW: bool = SAPConfig.RAW_RESULTS,
+    ctx: Context = None
+) -> str:
+    """補救操作: 維護銷售視圖 (Sales View)
+
+    相同參數的成功維護在 SAP_MAINT_CACHE_TTL 秒內直接回傳上次結果，不再送到 SAP
+    (可用 invalidate_maintenance_cache 清除)。
+    回傳精簡 JSON (status / documents / messages)；RAW=True 時回傳完整的 SAP 回應。
+    """
+
+    session_id = _get_session_id(ctx)
+
+    # 邏輯參照 Word 文件
+    plant_val = PLANT
+    delyg_plnt_val = DELYG_PLNT
+
+    if SALES_ORG == "CN60" and DISTR_CHAN == "03":
+        plant_val = "CP60"
+        delyg_plnt_val = "CP60"
+    elif SALES_ORG == "TW01" and DISTR_CHAN == "03":
+        plant_val = "TP01"
+        delyg_plnt_val = "TP01"
+
+    client = await session_registry.aclient(session_id, "MAT")
+    values = {
+        "UUID": UUID,
+        "HEADDATA": {"MATERIAL": MATERIAL, "SALES_VIEW": "X"},
+        "PLANTDATA": {"PLANT": plant_val},
+        "SALESDATA": {"SALES_ORG": SALES_ORG, "DISTR_CHAN": DISTR_CHAN, "DELYG_PLNT": delyg_plnt_val},
+    }
+    payload = client.build(values)
+
+    result = await maintenance_cache.run(
+        "maintain_sales_view", MATERIAL, values, lambda: client.apost_soap_once(UUID, payload), credential=client.credential
+    )
+    return _format_result("MAT", UUID, result, RAW)
+
+@mcp.tool()
+@background_tool
+async def maintain_warehouse_view(
+    MATERIAL: str,
+    UUID: str = "",
+    WHSE_NO: str = "WH1",
+    RAW: bool = SAPConfig.RAW_RESULTS,
+    ctx: Context = None
+) -> str:
+    """補救操作: 維護倉庫視圖 (Warehouse View)
+
+    相同參數的成功維護在 SAP_MAINT_CACHE_TTL 秒內直接回傳上次結果，不再送到 SAP
+    (可用 invalidate_maintenance_cache 清除)。
+    回傳精簡 JSON (status / documents / messages)；RAW=True 時回傳完整的 SAP 回應。
+    """
+
+    session_id = _get_session_id(ctx)
+
+    client = await session_registry.aclient(session_id, "MAT")
+    values = {
+        "UUID": UUID,
+        "HEADDATA": {"MATERIAL": MATERIAL, "WAREHOUSE_VIEW": "X"},
+        "WAREHOUSENUMBERDATA": {"WHSE_NO": WHSE_NO},
+    }
+    payload = client.build(values)
+
+    result = await maintenance_cache.run(
+        "maintain_warehouse_view", MATERIAL, values, lambda: client.apost_soap_once(UUID, payload), credential=client.credential
+    )
+    return _format_result("MAT", UUID, result, RAW)
+
+@mcp.tool()
+@background_tool
+async def maintain_source_list(
+    MATERIAL: str,
+    VALID_FROM: str,
+    UUID: str = "",
+    PLANT: str = "TP01",
+    VENDOR: str = "ICC-CP60",
+    RAW: bool = SAPConfig.RAW_RESULTS,
+    ctx: Context = None
+) -> str:
+    """補救操作: 維護貨源清單 (Source List)
+
+    相同參數的成功維護在 SAP_MAINT_CACHE_TTL 秒內直接回傳上次結果，不再送到 SAP
+    (可用 invalidate_maintenance_cache 清除)。
+    回傳精簡 JSON (status / documents / messages)；RAW=True 時回傳完整的 SAP 回應。
+    """
+
+    session_id = _get_session_id(ctx)
+
+    client = await session_registry.aclient(session_id, "SRC")
+    values = {
+        "UUID": UUID,
+        "MATERIAL": MATERIAL,
+        "PLANT": PLANT,
+        "VENDOR": VENDOR,
+        "VALID_FROM": VALID_FROM,
+    }
+    payload = client.build(values)
+
+    result = await maintenance_cache.run(
+        "maintain_source_list", MATERIAL, values, lambda: client.apost_soap_once(UUID, payload), credential=client.credential
+    )
+    return _format_result("SRC", UUID, result, RAW)
+
+@mcp.tool()
+@background_tool
+async def change_kitting_qty(
+    KITTING_PO: str,
+    PO_ITEM: str = "",
+    QUANTITY: float = 0,
+    UUID: str = "",
+    ITEMS: Optional[List[dict]] = None,
+    RAW: bool = SAPConfig.RAW_RESULTS,
+    ctx: Context = None
+) -> str:
+    """補救操作: 更改 Kitting PO 數量
+
+    單一項目時使用 PO_ITEM / QUANTITY (未指定 ITEMS 時兩者必填，QUANTITY 須大於 0)。多個項目時改用 ITEMS，例如
+    [{"QUANTITY": 5}, {"PO_ITEM": "00030", "QUANTITY": 2}]；未指定 PO_ITEM 時依輸入順序
+    為 00010、00020 ...。超過 SAP_ITEM_CHUNK_SIZE_QTY 筆時分成多個請求依序送出
+    (UUID 非空時第 n 個使用 "{UUID}-{n}")。
+
+    回傳精簡 JSON (status / documents / messages)；使用 ITEMS 時改為 chunks (每個請求的結果)
+    與 lines (依輸入順序每個項目的 chunk、PO 項目、狀態與該列的 SAP 訊息)。
+    RAW=True 時回傳完整的 SAP 回應。
+    """
+
+    session_id = _get_session_id(ctx)
+
+    client = await session_registry.aclient(session_id, "QTY")
+    if ITEMS is None:
+        error = _single_item_error("QTY", UUID, "PO_ITEM", PO_ITEM, "QUANTITY", QUANTITY)
+        if error:
+            return error
+        payload = client.build({
+            "UUID": UUID,
+            "KITTING_PO": KITTING_PO,
+            "PR_ITEM": [{"EBELP": PO_ITEM, "MENGE": QUANTITY}],
+        })
+        result = await client.apost_soap_once(UUID, payload)
+        return _format_result("QTY", UUID, result, RAW)
+
+    try:
+        lines = _normalize_items(ITEMS, ("QUANTITY",))
+    except ValueError as e:
+        return _invalid_items("QTY", UUID, str(e))
+    for index, item in enumerate(lines):
+        item.setdefault("PO_ITEM", _item_number(index, 5))
+    # 同一張 Kitting PO 的各段依序送出 (同時修改會被 SAP 鎖定)
+    sent = await _send_item_chunks(
+        client, UUID, lines,
+        lambda chunk_uuid, chunk: {
+            "UUID": chunk_uuid,
+            "KITTING_PO": KITTING_PO,
+            "PR_ITEM": [{"EBELP": item["PO_ITEM"], "MENGE": item["QUANTITY"]} for item in chunk],
+        },
+        sequential=True,
+    )
+    return _format_item_results("QTY", UUID, sent, RAW, lambda item, row: {"item_no": item["PO_ITEM"]})
+
+async def _fetch_status(session_id: str, batch_id_val: str, max_age: float = None):
+    """查詢 ZAI_FLOW_STATUS，回傳 (found, error)
+
+    只串流擷取 RETURN_DATA，不將整份回應轉成 dict 樹；相同 BATCH_ID
+    的查詢經由 status_cache 快取並合併。max_age 可要求更新鮮的結果。
+    查詢是冪等的，連線錯誤 / 逾時 / HTTP 5xx 會以隨機退避重試 SAP_STATUS_RETRIES 次。
+    """
+    client = await session_registry.aclient(session_id, "STATUS")
+    return await status_cache.get_or_fetch(
+        (client.credential, batch_id_val),
+        lambda: client.aretry(
+            lambda: client.apost_soap_extract(client.build({"BATCH_ID": batch_id_val}), ["RETURN_DATA"]),
+            SAPConfig.STATUS_RETRIES,
+        ),
+        max_age=max_age,
+    )
+
+def _format_status(batch_id_val: str, found, error) -> str:
+    """將 _fetch_status 的結果格式化為 check_kitting_status 的輸出"""
+    # ── Format error responses ──
+    if error:
+        if error.startswith("連線錯誤:") or error.startswith("Connection Error:"):
+            return (
+                f"[ERROR] 連線失敗\n"
+                f"TYPE:          連線錯誤 (Connection Error)\n"
+                f"BATCH_ID:      {batch_id_val}\n"
+                f"DETAIL:        {error.split(':', 1)[1].strip()}"
+            )
+        if error.startswith("無資料:"):
+            return (
+                f"[NO_DATA] 查無狀態資料\n"
+                f"BATCH_ID:      {batch_id_val}\n"
+                f"DETAIL:        SAP 回應 (HTTP 200) 中沒有 RETURN_DATA 或內容為空"
+            )
+        if error.startswith("解析錯誤:"):
+            return (
+                f"[ERROR] 回應解析失敗\n"
+                f"TYPE:          解析錯誤 (Parse Error)\n"
+                f"BATCH_ID:      {batch_id_val}\n"
+                f"DETAIL:        {error.split(':', 1)[1].strip()[:2000]}"
+            )
+        # HTTP or other error
+        fault_msg = _fault_detail(error)
+        return (
+            f"[ERROR] HTTP 錯誤\n"
+            f"TYPE:          HTTP Error\n"
+            f"BATCH_ID:      {batch_id_val}\n"
+            f"DETAIL:        {fault_msg}"
+        )
+
+    # ── Format success responses ──
+    if found:
+        resp = found["RETURN_DATA"]
+        if resp and isinstance(resp, dict):
+            last_action = resp.get('LAST_ACTION') or '-'
+            last_import_raw = resp.get('LAST_IMPORT') or '-'
+            last_export_raw = resp.get('LAST_EXPORT') or '-'
+
+            # Pretty-print JSON fields
+            def _pretty_json(raw):
+                obj = _status_json(raw)
+                if obj is raw and isinstance(raw, str):
+                    return raw
+                return json.dumps(obj, indent=2, ensure_ascii=False)
+
+            last_import_fmt = _pretty_json(last_import_raw)
+            last_export_fmt = _pretty_json(last_export_raw)
+
+            return (
+                f"LAST_ACTION: {last_action},\n"
+                f"LAST_IMPORT:\n{last_import_fmt},\n"
+                f"LAST_EXPORT:\n{last_export_fmt}"
+            )
+
+    return str(found)
+
+# check_kitting_status 可選取的欄位 (JSON Pointer 的第一層)
+_STATUS_FIELDS = ("LAST_ACTION", "LAST_IMPORT", "LAST_EXPORT")
+
+# 最近解析過的 LAST_IMPORT / LAST_EXPORT (分頁時同一份資料會連續查詢多次)
+_parsed_status_json = OrderedDict()
+_PARSED_STATUS_JSON_SIZE = 16
+
+def _status_json(raw):
+    """解析 LAST_IMPORT / LAST_EXPORT 字串；不是 JSON 時回傳原字串"""
+    if not isinstance(raw, str) or not raw:
+        return raw
+    try:
+        obj = _parsed_status_json[raw]
+        _parsed_status_json.move_to_end(raw)
+        return obj
+    except KeyError:
+        pass
+    try:
+        obj = json.loads(raw)
+    except ValueError:
+        obj = raw
+    _parsed_status_json[raw] = obj
+    if len(_parsed_status_json) > _PARSED_STATUS_JSON_SIZE:
+        _parsed_status_json.popitem(last=False)
+    return obj
+
+def _parse_pointer(pointer: str) -> list:
+    """JSON Pointer (RFC 6901) 轉成 token 清單；開頭的 "/" 可省略"""
+    pointer = pointer.strip()
+    if not pointer.startswith("/"):
+        pointer = "/" + pointer
+    return [t.replace("~1", "/").replace("~0", "~") for t in pointer[1:].split("/")]
+
+_MISSING = object()
+
+def _resolve_pointer(resp: dict, tokens: list):
+    """依 token 取出 RETURN_DATA 中的值；只解析被選取的第一層欄位"""
+    if not tokens or tokens[0] not in _STATUS_FIELDS:
+        return _MISSING
+    value = resp.get(tokens[0]) or ""
+    if tokens[0] != "LAST_ACTION":
+        value = _status_json(value)
+    for token in tokens[1:]:
+        if isinstance(value, dict):
+            value = value.get(token, _MISSING)
+        elif isinstance(value, list) and token.isdigit() and int(token) < len(value):
+            value = value[int(token)]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+def _json_size(value) -> int:
+    return len(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def _summarize(value) -> dict:
+    """值的型別、大小 (UTF-8 位元組) 與成員數，物件再列出每個鍵的摘要"""
+    if isinstance(value, dict):
+        members = {k: _summarize_leaf(v) for k, v in value.items()}
+        # 由成員大小推算整體大小，避免再序列化一次整份文件
+        size = 2 + max(len(members) - 1, 0) + sum(_json_size(k) + 1 + m["bytes"] for k, m in members.items())
+        return {"type": "object", "keys": len(value), "bytes": size, "members": members}
+    return _summarize_leaf(value)
+
+def _summarize_leaf(value) -> dict:
+    if isinstance(value, dict):
+        return {"type": "object", "keys": len(value), "bytes": _json_size(value)}
+    if isinstance(value, list):
+        return {"type": "array", "count": len(value), "bytes": _json_size(value)}
+    kind = "string" if isinstance(value, str) else "null" if value is None else \
+        "boolean" if isinstance(value, bool) else "number"
+    return {"type": kind, "bytes": _json_size(value)}
+
+def _status_cursor(offset: int, resp: dict) -> str:
+    """分頁游標：位移 + 資料摘要 (資料變更後舊游標即失效)"""
+    digest = hashlib.blake2b(
+        "\x00".join(str(resp.get(f) or "") for f in _STATUS_FIELDS).encode("utf-8"), digest_size=4
+    ).hexdigest()
+    return f"{offset}.{digest}"
+
+def _project_status(batch_id_val: str, found, error, fields: str, cursor: str, limit: int, summary: bool) -> str:
+    """check_kitting_status 的選取 / 分頁 / 摘要輸出 (精簡 JSON，不做整份縮排)"""
+    resp = found.get("RETURN_DATA") if isinstance(found, dict) else None
+    if error or not isinstance(resp, dict):
+        return _format_status(batch_id_val, found, error)
+
+    pointers = [p.strip() for p in fields.split(",") if p.strip()] or ["/" + f for f in _STATUS_FIELDS]
+    offset = 0
+    if cursor.strip():
+        position = cursor.strip().partition(".")[0]
+        if not position.isdigit() or cursor.strip() != _status_cursor(int(position), resp):
+            return (
+                f"[ERROR] CURSOR 已失效\n"
+                f"BATCH_ID:      {batch_id_val}\n"
+                f"DETAIL:        狀態資料已變更或游標格式錯誤，請不帶 CURSOR 重新查詢"
+            )
+        offset = int(position)
+
+    out = {"BATCH_ID": batch_id_val}
+    selected = {}
+    missing = []
+    for pointer in pointers:
+        value = _resolve_pointer(resp, _parse_pointer(pointer))
+        if value is _MISSING:
+            missing.append(pointer)
+        else:
+            selected[pointer] = value
+
+    if summary:
+        out["summary"] = {pointer: _summarize(value) for pointer, value in selected.items()}
+    elif limit > 0:
+        # 只有陣列會分頁；所有被選取的陣列使用同一個位移
+        totals = {}
+        more = False
+        for pointer, value in selected.items():
+            if isinstance(value, list):
+                totals[pointer] = len(value)
+                selected[pointer] = value[offset:offset + limit]
+                more = more or offset + limit < len(value)
+        out["fields"] = selected
+        out["page"] = {"offset": offset, "limit": limit, "total": totals}
+        if more:
+            out["next_cursor"] = _status_cursor(offset + limit, resp)
+    else:
+        out["fields"] = selected
+    if missing:
+        out["missing"] = missing
+    return json.dumps(out, ensure_ascii=False, separators=(",", ":"))
+
+@mcp.tool()
+@background_tool
+async def check_kitting_status(
+    BATCH_ID: str,
+    FIELDS: str = "",
+    CURSOR: str = "",
+    LIMIT: int = 0,
+    SUMMARY: bool = False,
+    ctx: Context = None
+) -> str:
+    """查詢 Kitting 流程狀態 — 預設回傳 全部資料
+
+    LAST_IMPORT / LAST_EXPORT 很大時可只取需要的部分 (結果為精簡 JSON):
+        FIELDS: 以逗號分隔的 JSON Pointer，第一層為 LAST_ACTION / LAST_IMPORT / LAST_EXPORT，
+                例如 "/LAST_EXPORT/RESULT,/LAST_IMPORT/ITEMS"
+        LIMIT: 大於 0 時，選取結果中的陣列每頁只回傳 LIMIT 筆，還有下一頁時回傳 next_cursor
+        CURSOR: 上一頁的 next_cursor (狀態資料變更後失效)
+        SUMMARY: 只回傳各欄位的型別、位元組數、鍵數 / 成員數，不回傳內容
+
+    相同 BATCH_ID 的查詢結果會快取 SAP_STATUS_CACHE_TTL 秒 (預設 5 秒)。
+    """
+
+    session_id = _get_session_id(ctx)
+
+    # Ensure BATCH_ID is 16 chars, zero-padded to match SAP format
+    batch_id_val = BATCH_ID.strip().zfill(16)
+
+    found, error = await _fetch_status(session_id, batch_id_val)
+    with service_metrics.timer("STATUS", "format"):
+        if FIELDS.strip() or CURSOR.strip() or LIMIT > 0 or SUMMARY:
+            return _project_status(batch_id_val, found, error, FIELDS, CURSOR, LIMIT, SUMMARY)
+        return _format_status(batch_id_val, found, error)
+
+# watch_kitting_status 監看的欄位
+_WATCH_FIELDS = ("LAST_ACTION", "LAST_IMPORT", "LAST_EXPORT")
+
+def _status_snapshot(found):
+    resp = found.get("RETURN_DATA") if found else None
+    if not isinstance(resp, dict):
+        return None
+    return tuple(resp.get(f) for f in _WATCH_FIELDS)
+
+@mcp.tool()
+@background_tool
+async def watch_kitting_status(
+    BATCH_ID: str,
+    TIMEOUT_SECONDS: float = 60,
+    ctx: Context = None
+) -> str:
+    """監看 Kitting 流程狀態，直到 LAST_ACTION / LAST_IMPORT / LAST_EXPORT 變更或逾時
+
+    由伺服器端輪詢 ZAI_FLOW_STATUS (間隔自動由短漸長)，取代反覆呼叫
+    check_kitting_status 比對 LAST_ACTION。輪詢過程會透過進度通知回報。
+
+    參數:
+        BATCH_ID: 批次編號
+        TIMEOUT_SECONDS: 最長等待秒數 (上限 SAP_WATCH_MAX_TIMEOUT)
+
+    回傳:
+        [CHANGED] 或 [TIMEOUT] 標頭，加上與 check_kitting_status 相同格式的最新狀態
+    """
+    session_id = _get_session_id(ctx)
+    batch_id_val = BATCH_ID.strip().zfill(16)
+
+    timeout = min(max(TIMEOUT_SECONDS or 0, 0), SAPConfig.WATCH_MAX_TIMEOUT)
+    start = time.monotonic()
+    deadline = start + timeout
+    interval = SAPConfig.WATCH_MIN_INTERVAL
+
+    # 第一次查詢作為比較基準 (可使用快取)
+    found, error = await _fetch_status(session_id, batch_id_val)
+    baseline = _status_snapshot(found)
+    polls = 1
+
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            header = f"[TIMEOUT] {timeout:g} 秒內狀態未變更 (輪詢 {polls} 次)"
+            return f"{header}\n{_format_status(batch_id_val, found, error)}"
+
+        await asyncio.sleep(min(interval, deadline - now))
+        # 允許共用其他監看者在本輪間隔內取得的結果，同一 BATCH_ID 只會有一個上游請求
+        found, error = await _fetch_status(session_id, batch_id_val, max_age=interval / 2)
+        polls += 1
+        current = _status_snapshot(found)
+
+        if current is not None and baseline is None:
+            baseline = current
+        elif current is not None and current != baseline:
+            changed = [f for f, old, new in zip(_WATCH_FIELDS, baseline, current) if old != new]
+            header = f"[CHANGED] {', '.join(changed)} (輪詢 {polls} 次，{time.monotonic() - start:.1f} 秒)"
+            return f"{header}\n{_format_status(batch_id_val, found, error)}"
+
+        last_action = current[0] if current else "-"
+        await _report_progress(
+            ctx,
+            time.monotonic() - start,
+            timeout,
+            f"BATCH_ID {batch_id_val}: 第 {polls} 次輪詢，LAST_ACTION={last_action}"
+            + (f"，錯誤: {error[:200]}" if error else ""),
+        )
+        interval = min(interval * SAPConfig.WATCH_BACKOFF, SAPConfig.WATCH_MAX_INTERVAL)
+
+def _status_error_type(error: str) -> str:
+    """將 _fetch_status 的錯誤字串歸類為簡短的錯誤類型"""
+    if error.startswith("連線錯誤:") or error.startswith("Connection Error:"):
+        return "CONNECTION"
+    if error.startswith("HTTP 錯誤"):
+        return "HTTP"
+    if error.startswith("無資料:"):
+        return "NO_DATA"
+    return "PARSE"
 
 @mcp.tool()
-def change_kitting_qty(
-    KITTING_PO: str,
-    PO_ITEM: str,
-    QUANTITY: float,
-    UUID: str = "",
+@background_tool
+async def check_kitting_status_many(
+    BATCH_IDS: List[str],
+    MAX_CONCURRENCY: int = 0,
     ctx: Context = None
 ) -> str:
-    """補救操作: 更改 Kitting PO 數量"""
+    """批次查詢多個 Kitting 流程狀態 — 回傳精簡表格 (LAST_ACTION 與錯誤類型)
 
+    以有上限的並行數同時查詢 ZAI_FLOW_STATUS，每完成一筆即透過進度
+    通知回報。需要完整 LAST_IMPORT / LAST_EXPORT 時請改用 check_kitting_status。
+
+    參數:
+        BATCH_IDS: 批次編號清單
+        MAX_CONCURRENCY: 同時進行的查詢數 (0 表示使用 SAP_BULK_STATUS_CONCURRENCY；
+                         實際仍受 SAP_MAX_CONCURRENCY_STATUS 限制)
+
+    回傳:
+        每個 BATCH_ID 一列的表格 (BATCH_ID / LAST_ACTION / ERROR) 與統計摘要
+    """
     session_id = _get_session_id(ctx)
+    batch_ids = list(dict.fromkeys(b.strip().zfill(16) for b in BATCH_IDS if b and b.strip()))
+    total = len(batch_ids)
+    limit = asyncio.Semaphore(MAX_CONCURRENCY if MAX_CONCURRENCY and MAX_CONCURRENCY > 0 else SAPConfig.BULK_STATUS_CONCURRENCY)
+    start = time.monotonic()
 
-    uuid_tag = f"<UUID>{UUID}</UUID>" if UUID else ""
+    async def lookup(batch_id_val):
+        async with limit:
+            found, error = await _fetch_status(session_id, batch_id_val)
+        if error:
+            return batch_id_val, "-", _status_error_type(error)
+        snapshot = _status_snapshot(found)
+        if snapshot is None:
+            return batch_id_val, "-", "NO_DATA"
+        return batch_id_val, snapshot[0] or "-", "-"
 
-    xml_body = f'<urn:ZSD_KITTING_FLOW_CHANGE>{uuid_tag}<KITTING_PO>{KITTING_PO}</KITTING_PO><PR_ITEM><item><EBELP>{PO_ITEM}</EBELP><MENGE>{QUANTITY}</MENGE></item></PR_ITEM></urn:ZSD_KITTING_FLOW_CHANGE>'
+    rows = {}
+    done = 0
+    for next_done in asyncio.as_completed([lookup(b) for b in batch_ids]):
+        batch_id_val, last_action, error_type = await next_done
+        rows[batch_id_val] = (last_action, error_type)
+        done += 1
+        await _report_progress(ctx, done, total, f"{batch_id_val}  {last_action}  {error_type}")
 
-    return SAPClient("QTY", session_id).post_soap(xml_body)
+    elapsed = time.monotonic() - start
+    failed = sum(1 for _, error_type in rows.values() if error_type != "-")
+    lines = [f"{'BATCH_ID':<16}  {'LAST_ACTION':<20}  ERROR"]
+    for batch_id_val in batch_ids:
+        last_action, error_type = rows[batch_id_val]
+        lines.append(f"{batch_id_val:<16}  {last_action:<20}  {error_type}")
+    lines.append(f"共 {total} 筆，成功 {total - failed}，失敗 {failed}，耗時 {elapsed:.2f} 秒")
+    return "\n".join(lines)
 
 @mcp.tool()
-def check_kitting_status(
-    BATCH_ID: str,
+def get_status_cache_stats() -> str:
+    """查詢 check_kitting_status 快取統計 (命中 / 未命中 / 合併請求數)
+
+    回傳:
+        JSON 格式的快取統計資訊
+    """
+    return json.dumps(status_cache.stats(), ensure_ascii=False, indent=2)
+
+@mcp.tool()
+def get_maintenance_cache_stats() -> str:
+    """查詢主資料「已維護」快取統計 (命中率 / 各工具筆數)
+
+    回傳:
+        JSON 格式的快取統計資訊
+    """
+    return json.dumps(maintenance_cache.stats(), ensure_ascii=False, indent=2)
+
+@mcp.tool()
+def invalidate_maintenance_cache(MATERIAL: str = "", TOOL: str = "") -> str:
+    """清除主資料「已維護」快取，讓下一次 maintain_* 呼叫重新送到 SAP
+
+    參數:
+        MATERIAL: 只清除此物料的紀錄 (空白表示全部物料)
+        TOOL: 只清除此工具的紀錄，例如 maintain_sales_view (空白表示全部工具)
+    """
+    removed = maintenance_cache.invalidate(TOOL.strip() or None, MATERIAL.strip() or None)
+    return f"已清除 {removed} 筆主資料維護快取"
+
+@mcp.tool()
+def get_idempotency_journal_stats() -> str:
+    """查詢 UUID 冪等日誌統計 (保存筆數 / 直接回傳次數 / 等待合併次數)
+
+    回傳:
+        JSON 格式的日誌統計資訊
+    """
+    return json.dumps(idempotency_journal.stats(), ensure_ascii=False, indent=2)
+
+@mcp.tool()
+def forget_idempotency_key(SERVICE: str, UUID: str) -> str:
+    """刪除 UUID 冪等日誌中的一筆紀錄，讓同一 UUID 的下一次呼叫重新送到 SAP
+
+    參數:
+        SERVICE: 服務代碼 (SO / STO / DN / MAT / SRC / INF / QTY)
+        UUID: 建立 / 維護工具呼叫時使用的 UUID
+    """
+    service = SERVICE.strip().upper()
+    # 只刪除目前 SAP 主機的紀錄
+    host = _base_host(SAPConfig.SERVICES[service]["url"]) if service in SAPConfig.SERVICES else None
+    if idempotency_journal.forget(service, UUID.strip(), host):
+        return f"已刪除 {service} / {UUID.strip()} 的日誌紀錄"
+    return f"找不到 {service} / {UUID.strip()} 的日誌紀錄"
+
+# ==============================================================================
+# 流程工具 (Pipeline Tools)
+# ==============================================================================
+# 從各步驟回應中擷取的單據號碼 (依序嘗試的欄位名稱)
+_PIPELINE_OUTPUTS = {
+    "SO": {"SALESDOCUMENT": ("SALESDOCUMENT", "SALES_DOCUMENT", "VBELN"),
+           "PR_NUMBER": ("PR_NUMBER", "EX_PR_NUMBER", "BANFN"),
+           "PR_ITEM": ("PR_ITEM", "EX_PR_ITEM", "BNFPO")},
+    "STO": {"PO_NUMBER": ("PO_NUMBER", "EX_PO_NUMBER", "PURCHASEORDER", "EBELN"),
+            "PO_ITEM": ("PO_ITEM", "EBELP")},
+    "DN": {"DELIVERY": ("DELIVERY", "EX_DELIVERY", "VBELN")},
+}
+
+# 已知的 SAP 錯誤訊息 -> 補救工具 (依序比對 RETURN 中 TYPE E/A 的 MESSAGE)
+_REMEDIATIONS = (
+    (re.compile(r"info\s*record|資訊記錄|採購資訊", re.I), "maintain_info_record"),
+    (re.compile(r"source\s*list|貨源清單", re.I), "maintain_source_list"),
+    (re.compile(r"sales\s*(org|area|view)|distr\.?\s*chan|銷售視圖|銷售組織", re.I), "maintain_sales_view"),
+    (re.compile(r"warehouse|storage\s*type|倉庫", re.I), "maintain_warehouse_view"),
+)
+
+def _find_first(body, names):
+    for name in names:
+        value = recursive_find(name, body)
+        if isinstance(value, str) and value.strip():
+            return value.strip()
+    return None
+
+@mcp.tool()
+@background_tool
+async def run_kitting_pipeline(
+    CUST_PO: str,
+    CUST_PO_DATE: str,
+    MATERIAL: str,
+    QTY: float,
+    UUID: str = "",
+    ORDER_TYPE: str = "ZIES",
+    SALES_ORG: str = "TW01",
+    SALES_CHANNEL: str = "03",
+    SALES_DIVISION: str = "01",
+    SOLD_TO_PARTY: str = "HRCTO-IMX",
+    SHIP_TO_PARTY: str = "HRCTO-MX",
+    PLANT: str = "TP01",
+    SHIPPING_POINT: str = "TW01",
+    VENDOR: str = "ICC-CP60",
+    PUR_ORG: str = "TW10",
+    WHSE_NO: str = "WH1",
+    MAX_REMEDIATIONS: int = 3,
     ctx: Context = None
 ) -> str:
-    """查詢 Kitting 流程狀態 — 回傳 全部資料"""
-    
-    session_id = _get_session_id(ctx)
+    """一次執行完整 Kitting 流程: 銷售訂單 -> STO 採購訂單 -> 外向交貨單
 
-    # Ensure BATCH_ID is 16 chars, zero-padded to match SAP format
-    batch_id_val = BATCH_ID.strip().zfill(16)
+    由伺服器依序呼叫 create_sales_order / create_sto_po / create_outbound_delivery，
+    並將前一步回應中的 PR_NUMBER / PR_ITEM / PO_NUMBER 帶入下一步。某一步
+    回傳已知的主資料錯誤時，自動呼叫對應的補救工具 (maintain_info_record /
+    maintain_source_list / maintain_sales_view / maintain_warehouse_view) 後重試該步驟。
 
-    # BATCH_ID is a single value (Structure/Element), not a Table
-    xml_body = f'<urn:ZAI_FLOW_STATUS><BATCH_ID>{batch_id_val}</BATCH_ID></urn:ZAI_FLOW_STATUS>'
-    
-    client = SAPClient("STATUS", session_id)
-    body_dict, error = client.post_soap_dict(xml_body)
+    參數 (其餘同 create_sales_order):
+        UUID: 非空時各步驟使用 "{UUID}-SO" / "{UUID}-STO" / "{UUID}-DN"，
+              以同一 UUID 重新執行時已完成的步驟直接由冪等日誌取得結果
+        VENDOR / PUR_ORG: 補救資訊記錄與貨源清單時使用
+        WHSE_NO: 補救倉庫視圖時使用
+        MAX_REMEDIATIONS: 整個流程最多執行幾次補救；剩餘次數不足時只執行前幾個補救，
+                          之後以 reason 回報次數已用盡
 
-    # ── Format error responses ──
-    if error:
-        if error.startswith("連線錯誤:") or error.startswith("Connection Error:"):
-            return (
-                f"[ERROR] 連線失敗\n"
-                f"TYPE:          連線錯誤 (Connection Error)\n"
-                f"BATCH_ID:      {batch_id_val}\n"
-                f"DETAIL:        {error.split(':', 1)[1].strip()}"
+    回傳:
+        JSON 格式的執行紀錄: status (OK / FAILED)、failed_step 與 reason (失敗時)、
+        documents (各單據號碼)、steps (每次呼叫的工具、耗時、結果與 SAP 訊息)
+    """
+    cust_po_date_val = CUST_PO_DATE if CUST_PO_DATE else "2025-01-01"
+    base_uuid = UUID.strip()
+    documents = {}
+    steps = []
+    remediations_left = max(MAX_REMEDIATIONS, 0)
+    start = time.perf_counter()
+
+    remediation_args = {
+        "maintain_info_record": lambda: dict(MATERIAL=MATERIAL, VENDOR=VENDOR, PLANT=PLANT, PUR_ORG=PUR_ORG),
+        "maintain_source_list": lambda: dict(MATERIAL=MATERIAL, VALID_FROM=time.strftime("%Y-%m-%d"), PLANT=PLANT, VENDOR=VENDOR),
+        "maintain_sales_view": lambda: dict(MATERIAL=MATERIAL, SALES_ORG=SALES_ORG, DISTR_CHAN=SALES_CHANNEL, PLANT=PLANT),
+        "maintain_warehouse_view": lambda: dict(MATERIAL=MATERIAL, WHSE_NO=WHSE_NO),
+    }
+    remediation_tools = {
+        "maintain_info_record": maintain_info_record,
+        "maintain_source_list": maintain_source_list,
+        "maintain_sales_view": maintain_sales_view,
+        "maintain_warehouse_view": maintain_warehouse_view,
+    }
+
+    def step_args(step):
+        uuid = f"{base_uuid}-{step}" if base_uuid else ""
+        if step == "SO":
+            return create_sales_order, dict(
+                CUST_PO=CUST_PO, CUST_PO_DATE=cust_po_date_val, MATERIAL=MATERIAL, QTY=QTY, UUID=uuid,
+                ORDER_TYPE=ORDER_TYPE, SALES_ORG=SALES_ORG, SALES_CHANNEL=SALES_CHANNEL,
+                SALES_DIVISION=SALES_DIVISION, SOLD_TO_PARTY=SOLD_TO_PARTY, SHIP_TO_PARTY=SHIP_TO_PARTY,
+                PLANT=PLANT, SHIPPING_POINT=SHIPPING_POINT,
             )
-        # HTTP or other error
-        fault_msg = error
-        try:
-            fault_parsed = xmltodict.parse(error.split(":", 1)[1].strip())
-            fault = recursive_find('faultstring', fault_parsed)
-            if fault:
-                fault_msg = fault
-        except:
-            pass
-        return (
-            f"[ERROR] HTTP 錯誤\n"
-            f"TYPE:          HTTP Error\n"
-            f"BATCH_ID:      {batch_id_val}\n"
-            f"DETAIL:        {fault_msg}"
+        if step == "STO":
+            return create_sto_po, dict(
+                PR_NUMBER=documents["PR_NUMBER"], PR_ITEM=documents.get("PR_ITEM") or "00010", UUID=uuid,
+                PUR_ORG=PUR_ORG, PUR_PLANT=PLANT, VENDOR=VENDOR,
+            )
+        return create_outbound_delivery, dict(
+            PO_NUMBER=documents["PO_NUMBER"], ITEM_NO=documents.get("PO_ITEM") or "00010", QUANTITY=QTY, UUID=uuid,
         )
 
-    # ── Format success responses ──
-    if body_dict and isinstance(body_dict, dict):
-        resp = recursive_find('RETURN_DATA', body_dict)
-        if resp and isinstance(resp, dict):
-            last_action = resp.get('LAST_ACTION') or '-'
-            last_import_raw = resp.get('LAST_IMPORT') or '-'
-            last_export_raw = resp.get('LAST_EXPORT') or '-'
+    async def call(tool, args, step, remediation_for=None):
+        t = time.perf_counter()
+        text = await tool(**args, RAW=False, ctx=ctx)
+        try:
+            outcome = json.loads(text)
+        except json.JSONDecodeError:
+            outcome = None
+        if not isinstance(outcome, dict) or "status" not in outcome:
+            # 非預期的輸出格式視為此步驟失敗，不讓整個流程拋出例外
+            outcome = {"status": "INVALID", "error": str(text)[:500]}
+        messages = outcome.get("messages", [])
+        errors = [m["message"] for m in messages if m["type"] in ("E", "A")]
+        status = {"OK": "OK", "ERROR": "BUSINESS_ERROR"}.get(outcome["status"], "ERROR")
+        entry = {
+            "step": step,
+            "tool": tool.__name__,
+            "elapsed_ms": round((time.perf_counter() - t) * 1000, 1),
+            "status": status,
+            "messages": [f"{m['type']}: {m['message']}" for m in messages],
+        }
+        if remediation_for:
+            entry["remediation_for"] = remediation_for
+        if "error" in outcome:
+            entry["detail"] = outcome["error"]
+        steps.append(entry)
+        return status, outcome.get("documents", {}), errors
 
-            # Pretty-print JSON fields
-            def _pretty_json(raw):
-                try:
-                    obj = json.loads(raw) if isinstance(raw, str) else raw
-                    return json.dumps(obj, indent=2, ensure_ascii=False)
-                except:
-                    return raw
+    def result(status, failed_step=None, reason=None):
+        trace = {"status": status}
+        if failed_step:
+            trace["failed_step"] = failed_step
+        if reason:
+            trace["reason"] = reason
+        trace["documents"] = documents
+        trace["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        trace["steps"] = steps
+        return json.dumps(trace, ensure_ascii=False, indent=2)
 
-            last_import_fmt = _pretty_json(last_import_raw)
-            last_export_fmt = _pretty_json(last_export_raw)
+    with sap_deadline(SAPConfig.PIPELINE_DEADLINE):
+        for index, step in enumerate(("SO", "STO", "DN")):
+            await _report_progress(ctx, index, 3, f"{step} 開始")
+            applied = set()
+            while True:
+                tool, args = step_args(step)
+                status, fields, errors = await call(tool, args, step)
+                if status == "OK":
+                    break
+                if status == "ERROR":
+                    return result("FAILED", step)
 
-            return (
-                f"LAST_ACTION: {last_action},\n"
-                f"LAST_IMPORT:\n{last_import_fmt},\n"
-                f"LAST_EXPORT:\n{last_export_fmt}"
+                # 依錯誤訊息找出尚未對此步驟執行過的補救工具
+                fixes = []
+                for message in errors:
+                    for pattern, name in _REMEDIATIONS:
+                        if name not in applied and name not in fixes and pattern.search(message):
+                            fixes.append(name)
+                if not fixes:
+                    return result("FAILED", step)
+                # 剩餘次數不足時先執行前 remediations_left 個補救
+                skipped = fixes[remediations_left:]
+                for name in fixes[:remediations_left]:
+                    applied.add(name)
+                    remediations_left -= 1
+                    # SAP 回報此主資料缺漏，快取中的「已維護」紀錄已不可信
+                    maintenance_cache.invalidate(name, MATERIAL)
+                    await _report_progress(ctx, index, 3, f"{step} 補救: {name}")
+                    fix_status, _, _ = await call(remediation_tools[name], remediation_args[name](), step, step)
+                    if fix_status != "OK":
+                        return result("FAILED", step)
+                if skipped:
+                    return result(
+                        "FAILED", step,
+                        f"補救次數已用盡 (MAX_REMEDIATIONS={MAX_REMEDIATIONS})，未執行: {', '.join(skipped)}",
+                    )
+
+            for name, candidates in _PIPELINE_OUTPUTS[step].items():
+                value = _find_first(fields, candidates)
+                if value is not None:
+                    documents[name] = value
+            required = {"SO": "PR_NUMBER", "STO": "PO_NUMBER"}.get(step)
+            if required and required not in documents:
+                steps[-1]["status"] = "ERROR"
+                steps[-1]["detail"] = f"回應中找不到 {required}"
+                return result("FAILED", step)
+
+    await _report_progress(ctx, 3, 3, "完成")
+    return result("OK")
+
+# ==============================================================================
+# 主資料批次作業 (Bulk Master Data Jobs)
+# ==============================================================================
+class TokenBucket:
+    """每秒補充 rate 個 token、最多累積 burst 個的速率限制
+
+    token 不足時預借 (tokens 為負)，呼叫端依預借順序等待，不會被之後的呼叫插隊。
+    不綁定事件迴圈，可跨執行緒 / 事件迴圈共用；rate 為 0 時不限制。
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self.acquired = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def reserve(self) -> float:
+        """取得一個 token，回傳需要等待的秒數"""
+        with self._lock:
+            self.acquired += 1
+            if self.rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - 1
+            self._updated = now
+            if self._tokens >= 0:
+                return 0.0
+            wait = -self._tokens / self.rate
+            self.throttled += 1
+            self.waited += wait
+            return wait
+
+    async def acquire(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "waited_seconds": round(self.waited, 3),
+            }
+
+# 批次作業送出維護請求的速率限制 (每個服務一個，同一程序內的所有作業共用)
+bulk_rate_limits = {key: TokenBucket(SAPConfig.bulk_rate(key), SAPConfig.BULK_BURST) for key in SAPConfig.SERVICES}
+
+class BulkJobStore:
+    """主資料批次作業的進度 (SQLite，可與冪等日誌共用同一個檔案)
+
+    每個作業一列 (參數、狀態與最後一次的摘要)，每個 (物料列, 維護項目) 一列結果。
+    中斷後以同一 JOB_ID 重新執行時，已成功的項目直接略過；失敗的項目重新送出。
+    方法皆為同步的 SQLite 存取，run_master_data_job 以 asyncio.to_thread 呼叫。
+    """
+    def __init__(self, path: str, max_age: float):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            if self._db is None:
+                db = _open_sqlite(self.path)
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS bulk_jobs ("
+                    " job_id TEXT PRIMARY KEY, digest TEXT NOT NULL, spec TEXT NOT NULL, total INTEGER NOT NULL,"
+                    " state TEXT NOT NULL, summary TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+                )
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS bulk_items ("
+                    " job_id TEXT NOT NULL, seq INTEGER NOT NULL, task TEXT NOT NULL, material TEXT NOT NULL,"
+                    " status TEXT NOT NULL, result TEXT, elapsed REAL, updated REAL NOT NULL,"
+                    " PRIMARY KEY (job_id, seq, task))"
+                )
+                self._db = db
+            return self._db.execute(sql, params)
+
+    def open(self, job_id: str, digest: str, spec: dict, total: int):
+        """建立或接續作業，回傳 (spec, 已成功的 {(seq, task)})
+
+        同一 JOB_ID 已用於不同參數時拋出 IdempotencyConflict。接續時沿用第一次執行時
+        保存的 spec (例如當時決定的 VALID_FROM)。
+        """
+        self.compact()
+        now = time.time()
+        row = self._execute("SELECT digest, spec FROM bulk_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            self._execute(
+                "INSERT INTO bulk_jobs (job_id, digest, spec, total, state, summary, created, updated)"
+                " VALUES (?, ?, ?, ?, 'running', NULL, ?, ?)",
+                (job_id, digest, json.dumps(spec, ensure_ascii=False), total, now, now),
             )
+            return spec, set()
+        if row[0] != digest:
+            raise IdempotencyConflict(f"JOB_ID {job_id} 已用於參數不同的批次作業，請使用新的 JOB_ID")
+        self._execute("UPDATE bulk_jobs SET state = 'running', updated = ? WHERE job_id = ?", (now, job_id))
+        done = self._execute("SELECT seq, task FROM bulk_items WHERE job_id = ? AND status = 'OK'", (job_id,))
+        return json.loads(row[1]), {(seq, task) for seq, task in done.fetchall()}
+
+    def record(self, job_id: str, seq: int, task: str, material: str, status: str, result: str, elapsed: float):
+        self._execute(
+            "INSERT OR REPLACE INTO bulk_items (job_id, seq, task, material, status, result, elapsed, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, seq, task, material, status, result, elapsed, time.time()),
+        )
+
+    def finish(self, job_id: str, state: str, summary: dict = None):
+        self._execute(
+            "UPDATE bulk_jobs SET state = ?, summary = COALESCE(?, summary), updated = ? WHERE job_id = ?",
+            (state, json.dumps(summary, ensure_ascii=False) if summary else None, time.time(), job_id),
+        )
+
+    def progress(self, job_id: str):
+        """回傳作業狀態與各維護項目的結果統計；作業不存在時回傳 None"""
+        row = self._execute(
+            "SELECT total, state, summary, created, updated FROM bulk_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        total, state, summary, created, updated = row
+        tasks = {}
+        for task, status, count in self._execute(
+            "SELECT task, status, COUNT(*) FROM bulk_items WHERE job_id = ? GROUP BY task, status", (job_id,)
+        ).fetchall():
+            tasks.setdefault(task, {})[status] = count
+        failures = []
+        for seq, material, task, status, result in self._execute(
+            "SELECT seq, material, task, status, result FROM bulk_items"
+            " WHERE job_id = ? AND status != 'OK' ORDER BY seq LIMIT 50", (job_id,)
+        ).fetchall():
+            outcome = json.loads(result) if result else {}
+            failure = {"seq": seq, "material": material, "task": task, "status": status,
+                       "messages": outcome.get("messages", [])[:3]}
+            if "error" in outcome:
+                failure["error"] = outcome["error"]
+            failures.append(failure)
+        return {
+            "job_id": job_id,
+            "state": state,
+            "total": total,
+            "ok": sum(counts.get("OK", 0) for counts in tasks.values()),
+            "tasks": tasks,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(created)),
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(updated)),
+            "last_run": json.loads(summary) if summary else None,
+            "failures": failures,
+        }
+
+    def recent(self, limit: int = 20) -> list:
+        return [
+            {"job_id": job_id, "state": state, "total": total,
+             "updated": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(updated))}
+            for job_id, state, total, updated in self._execute(
+                "SELECT job_id, state, total, updated FROM bulk_jobs ORDER BY updated DESC LIMIT ?", (limit,)
+            ).fetchall()
+        ]
+
+    def compact(self) -> int:
+        """刪除超過 max_age 未更新的作業與其結果"""
+        cutoff = time.time() - self.max_age
+        self._execute(
+            "DELETE FROM bulk_items WHERE job_id IN (SELECT job_id FROM bulk_jobs WHERE updated < ?)", (cutoff,)
+        )
+        return self._execute("DELETE FROM bulk_jobs WHERE updated < ?", (cutoff,)).rowcount
+
+bulk_job_store = BulkJobStore(SAPConfig.BULK_JOB_PATH, SAPConfig.BULK_JOB_MAX_AGE)
+
+# 批次作業的維護項目 -> (服務, 維護工具, 可由物料列或作業參數指定的欄位, 其中的必要欄位)
+# 預設順序中資訊記錄在貨源清單之前 (貨源清單需要有效的資訊記錄)
+_BULK_TASKS = {
+    "info_record": ("INF", "maintain_info_record", ("PRICE", "VENDOR", "PLANT", "PUR_ORG"), ()),
+    "source_list": ("SRC", "maintain_source_list", ("VALID_FROM", "PLANT", "VENDOR"), ("VALID_FROM",)),
+    "sales_view": ("MAT", "maintain_sales_view", ("SALES_ORG", "DISTR_CHAN", "PLANT", "DELYG_PLNT"),
+                   ("SALES_ORG", "DISTR_CHAN")),
+    "warehouse_view": ("MAT", "maintain_warehouse_view", ("WHSE_NO",), ()),
+}
+
+def _parse_material_rows(text: str) -> list:
+    """MATERIALS 參數 -> [{"MATERIAL": ..., 其他欄位: ...}]
+
+    接受 JSON 陣列 (物料號碼字串或物件)、第一列為標題 (含 MATERIAL 欄) 的 CSV，
+    或以換行 / 逗號 / 空白分隔的物料號碼。欄位名稱不分大小寫，空白值視為未指定。
+    """
+    text = (text or "").strip()
+    if text.startswith("["):
+        rows = [{"MATERIAL": row} if isinstance(row, str) else row for row in json.loads(text)]
+    else:
+        lines = [line for line in text.splitlines() if line.strip()]
+        if lines and "MATERIAL" in (column.strip().upper() for column in lines[0].split(",")):
+            import csv
+
+            rows = list(csv.DictReader(lines))
+        else:
+            rows = [{"MATERIAL": material} for material in re.split(r"[\s,;]+", text) if material]
+    parsed = []
+    for index, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            raise ValueError(f"第 {index} 筆不是物料號碼或物件")
+        values = {str(k).strip().upper(): str(v).strip() for k, v in row.items() if k and v is not None and str(v).strip()}
+        if "MATERIAL" not in values:
+            raise ValueError(f"第 {index} 筆缺少 MATERIAL")
+        parsed.append(values)
+    return parsed
+
+@mcp.tool()
+@background_tool
+async def run_master_data_job(
+    MATERIALS: str,
+    TASKS: str = "info_record,source_list,sales_view,warehouse_view",
+    JOB_ID: str = "",
+    SALES_ORG: str = "TW01",
+    DISTR_CHAN: str = "03",
+    VALID_FROM: str = "",
+    PLANT: str = "TP01",
+    VENDOR: str = "ICC-CP60",
+    PUR_ORG: str = "TW10",
+    WHSE_NO: str = "WH1",
+    CONCURRENCY: int = 0,
+    ctx: Context = None
+) -> str:
+    """批次維護主資料: 對多個物料執行 maintain_info_record / maintain_source_list /
+    maintain_sales_view / maintain_warehouse_view (新產品線上線時使用)
+
+    由伺服器以 CONCURRENCY 個工作者同時處理不同物料，同一物料的維護依 TASKS 順序執行；
+    每個服務的送出速率受 SAP_BULK_RATE token bucket 限制，避免佔滿 SAP 對話工作程序。
+    每完成一項即寫入進度並透過進度通知回報。中斷 (或失敗) 後以同一 JOB_ID 與相同參數
+    重新呼叫即可接續：已成功的項目不再送出，失敗的項目重新執行。
+
+    參數:
+        MATERIALS: 物料清單 — JSON 陣列 (["MAT-1", {"MATERIAL": "MAT-2", "SALES_ORG": "CN60"}])、
+                   CSV (第一列為標題，例如 MATERIAL,SALES_ORG,DISTR_CHAN,VALID_FROM)，
+                   或以換行 / 逗號分隔的物料號碼。物料列中的欄位優先於下列作業參數
+        TASKS: 要執行的維護項目 (逗號分隔): info_record, source_list, sales_view, warehouse_view
+        JOB_ID: 作業代號；未指定時由參數產生 (相同參數重新呼叫即接續同一作業)
+        SALES_ORG / DISTR_CHAN / PLANT: 銷售視圖 (與資訊記錄 / 貨源清單的工廠)
+        VALID_FROM: 貨源清單生效日 (YYYY-MM-DD)，未指定時為作業建立當天
+        VENDOR / PUR_ORG: 資訊記錄與貨源清單
+        WHSE_NO: 倉庫視圖
+        CONCURRENCY: 同時處理的物料數 (0 表示使用 SAP_BULK_CONCURRENCY)
+
+    回傳:
+        JSON 格式的作業摘要: job_id、各維護項目的成功 / 失敗 / 略過 (已完成) 數與平均耗時、
+        整體吞吐量 (calls_per_second)、速率限制等待時間與失敗明細 (最多 50 筆)
+    """
+    try:
+        rows = _parse_material_rows(MATERIALS)
+    except (ValueError, json.JSONDecodeError) as e:
+        return json.dumps({"status": "INVALID", "error": f"MATERIALS 格式錯誤: {e}"}, ensure_ascii=False)
+    tasks = list(dict.fromkeys(t.strip().lower().removeprefix("maintain_") for t in TASKS.split(",") if t.strip()))
+    unknown = [t for t in tasks if t not in _BULK_TASKS]
+    if unknown or not tasks or not rows:
+        return json.dumps({
+            "status": "INVALID",
+            "error": f"未知的維護項目: {', '.join(unknown)} (可用: {', '.join(_BULK_TASKS)})" if unknown
+            else "沒有要執行的物料或維護項目",
+        }, ensure_ascii=False)
+
+    defaults = {"SALES_ORG": SALES_ORG, "DISTR_CHAN": DISTR_CHAN, "VALID_FROM": VALID_FROM.strip(),
+                "PLANT": PLANT, "VENDOR": VENDOR, "PUR_ORG": PUR_ORG, "WHSE_NO": WHSE_NO}
+    spec = {"rows": rows, "tasks": tasks, "defaults": defaults}
+    digest = hashlib.blake2b(
+        json.dumps([SAPConfig.BASE_URL, spec], sort_keys=True, ensure_ascii=False).encode("utf-8"), digest_size=16
+    ).hexdigest()
+    job_id = JOB_ID.strip() or f"bulk-{digest[:12]}"
+    # 第一次執行時決定貨源清單生效日，接續時沿用
+    spec["defaults"]["VALID_FROM"] = defaults["VALID_FROM"] or time.strftime("%Y-%m-%d")
+    total = len(rows) * len(tasks)
+    try:
+        spec, completed = await asyncio.to_thread(bulk_job_store.open, job_id, digest, spec, total)
+    except IdempotencyConflict as e:
+        return json.dumps({"status": "CONFLICT", "job_id": job_id, "error": str(e)}, ensure_ascii=False)
+    defaults = spec["defaults"]
+    tools = {
+        "maintain_info_record": maintain_info_record,
+        "maintain_source_list": maintain_source_list,
+        "maintain_sales_view": maintain_sales_view,
+        "maintain_warehouse_view": maintain_warehouse_view,
+    }
+
+    queue = asyncio.Queue()
+    for seq, row in enumerate(rows):
+        queue.put_nowait((seq, row))
+    counts = {task: {"ok": 0, "failed": 0, "invalid": 0, "skipped": 0, "elapsed": 0.0} for task in tasks}
+    throttled = 0.0
+    done = 0
+    start = time.perf_counter()
+
+    async def run_item(seq: int, row: dict, task: str) -> str:
+        nonlocal throttled
+        key, tool_name, fields, required = _BULK_TASKS[task]
+        args = {f: row.get(f, defaults.get(f)) for f in fields if row.get(f, defaults.get(f))}
+        missing = [f for f in required if f not in args]
+        if missing:
+            result = json.dumps({"service": key, "status": "INVALID", "documents": {}, "messages": [],
+                                 "error": f"缺少 {', '.join(missing)}"}, ensure_ascii=False, separators=(",", ":"))
+            await asyncio.to_thread(bulk_job_store.record, job_id, seq, task, row["MATERIAL"], "INVALID", result, 0.0)
+            counts[task]["failed"] += 1
+            counts[task]["invalid"] += 1
+            return "INVALID"
+        # SAP 無法連線 (斷路器開啟) 時等待恢復，不把剩下的項目都記為失敗
+        retry_after = circuit_breakers[key].retry_after()
+        if retry_after > 0:
+            await asyncio.sleep(retry_after)
+        throttled += await bulk_rate_limits[key].acquire()
+        uuid = hashlib.blake2b(f"{job_id}/{seq}/{task}".encode("utf-8"), digest_size=16).hexdigest()
+        t = time.perf_counter()
+        with sap_deadline(SAPConfig.TOOL_DEADLINE):
+            result = await tools[tool_name](MATERIAL=row["MATERIAL"], UUID=uuid, **args, RAW=False, ctx=ctx)
+        elapsed = time.perf_counter() - t
+        status = json.loads(result)["status"]
+        await asyncio.to_thread(bulk_job_store.record, job_id, seq, task, row["MATERIAL"], status, result, elapsed)
+        counts[task]["ok" if status == "OK" else "failed"] += 1
+        counts[task]["elapsed"] += elapsed
+        return status
+
+    async def worker():
+        nonlocal done
+        while True:
+            try:
+                seq, row = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            for task in tasks:
+                if (seq, task) in completed:
+                    counts[task]["skipped"] += 1
+                    status = "SKIPPED"
+                else:
+                    status = await run_item(seq, row, task)
+                done += 1
+                await _report_progress(ctx, done, total, f"{row['MATERIAL']}  {task}  {status}")
+
+    def summary() -> dict:
+        elapsed = time.perf_counter() - start
+        # 缺少必要欄位的項目未送到 SAP，不計入呼叫數
+        calls = sum(c["ok"] + c["failed"] - c["invalid"] for c in counts.values())
+        return {
+            "materials": len(rows),
+            "calls": calls,
+            "elapsed_s": round(elapsed, 2),
+            "calls_per_second": round(calls / elapsed, 2) if elapsed > 0 else 0.0,
+            "rate_limit_wait_s": round(throttled, 2),
+            "tasks": {
+                task: {"ok": c["ok"], "failed": c["failed"], "skipped": c["skipped"],
+                       "avg_ms": round(c["elapsed"] / (c["ok"] + c["failed"] - c["invalid"]) * 1000, 1)
+                       if c["ok"] + c["failed"] > c["invalid"] else 0.0}
+                for task, c in counts.items()
+            },
+        }
+
+    workers = max(1, min(CONCURRENCY if CONCURRENCY and CONCURRENCY > 0 else SAPConfig.BULK_CONCURRENCY, len(rows)))
+    try:
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    except BaseException:
+        # 取消時同步寫入，避免 to_thread 本身被取消
+        bulk_job_store.finish(job_id, "interrupted", summary())
+        raise
+    run = summary()
+    failed = sum(c["failed"] for c in counts.values())
+    await asyncio.to_thread(bulk_job_store.finish, job_id, "done" if not failed else "failed", run)
+    progress = await asyncio.to_thread(bulk_job_store.progress, job_id)
+    return json.dumps({
+        "status": "OK" if not failed else "PARTIAL",
+        "job_id": job_id,
+        "total": total,
+        "ok": progress["ok"],
+        **run,
+        "failures": progress["failures"],
+    }, ensure_ascii=False, indent=2)
+
+@mcp.tool()
+def get_master_data_job(JOB_ID: str = "") -> str:
+    """查詢主資料批次作業 (run_master_data_job) 的進度
+
+    參數:
+        JOB_ID: 作業代號；未指定時列出最近的作業
+
+    回傳:
+        JSON 格式的作業狀態 (running / done / failed / interrupted)、各維護項目的結果統計、
+        最後一次執行的吞吐量摘要與失敗明細 (最多 50 筆)
+    """
+    if not JOB_ID.strip():
+        return json.dumps({"jobs": bulk_job_store.recent()}, ensure_ascii=False, indent=2)
+    progress = bulk_job_store.progress(JOB_ID.strip())
+    if progress is None:
+        return json.dumps({"job_id": JOB_ID.strip(), "error": "找不到此作業"}, ensure_ascii=False)
+    return json.dumps(progress, ensure_ascii=False, indent=2)
+
+@mcp.tool()
+def get_bulk_rate_limit_stats() -> str:
+    """查詢批次作業各服務 token bucket 的設定與等待統計
+
+    回傳:
+        JSON 格式的每秒上限 (rate)、突發上限 (burst)、取得次數與需要等待的次數 / 秒數
+    """
+    return json.dumps({key: bucket.stats() for key, bucket in bulk_rate_limits.items()}, ensure_ascii=False, indent=2)
+
+# ==============================================================================
+# 背景作業 (Background Jobs)
+# ==============================================================================
+class BackgroundJob:
+    """在背景執行的一次工具呼叫"""
+    __slots__ = ("job_id", "tool", "session_id", "task", "state", "progress", "total", "message",
+                 "result", "error", "created", "finished", "published", "_changed")
+
+    def __init__(self, job_id: str, tool: str, session_id: str):
+        self.job_id = job_id
+        self.tool = tool
+        self.session_id = session_id
+        self.task = None
+        self.state = "running"
+        self.progress = 0.0
+        self.total = None
+        self.message = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.published = 0.0
+        self._changed = asyncio.Event()
+
+    def changed(self) -> asyncio.Event:
+        """下一次進度更新或結束時 set() 的 Event"""
+        return self._changed
+
+    def notify(self):
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+
+    def snapshot(self, include_result: bool = True) -> dict:
+        end = self.finished or time.time()
+        data = {
+            "job_id": self.job_id,
+            "tool": self.tool,
+            "state": self.state,
+            "progress": self.progress,
+            "total": self.total,
+            "message": self.message,
+            "elapsed_s": round(end - self.created, 2),
+            "session": self.session_id,
+        }
+        if include_result and self.state == "done":
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+class _JobContext:
+    """背景作業中傳給工具的 ctx：固定為啟動者的工作階段，report_progress 寫入作業進度"""
+    def __init__(self, job: BackgroundJob, store: "BackgroundJobStore"):
+        self.job = job
+        self.session_id = job.session_id
+        self._store = store
+
+    async def report_progress(self, progress: float, total: float = None, message: str = None):
+        job = self.job
+        job.progress, job.total, job.message = progress, total, message
+        job.notify()
+        await self._store.publish(job)
+
+class BackgroundJobStore:
+    """背景作業的登錄 (有上限)
+
+    每個程序最多同時執行 max_running 個作業；完成 (done / failed / cancelled) 的作業保留
+    ttl 秒，最多 max_results 個，超過時移除最早完成的。只有啟動作業的工作階段可以查詢、
+    等待或取消。設定 backend (多工作程序部署) 時作業狀態與結果同時寫入共用儲存
+    (進度每秒最多一次，於執行緒中寫入)，其他工作程序可以查詢與等待，但只有執行中的
+    工作程序可以取消。
+    """
+    def __init__(self, max_running: int, max_results: int, ttl: float, backend=None):
+        self.max_running = max_running
+        self.max_results = max_results
+        self.ttl = ttl
+        self.backend = backend
+        self._jobs = OrderedDict()
+        self.started = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.evicted = 0
+
+    def _prune(self):
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.finished is not None]
+        finished.sort(key=lambda job: job.finished)
+        overflow = len(finished) - self.max_results
+        for index, job in enumerate(finished):
+            if index < overflow or now - job.finished > self.ttl:
+                del self._jobs[job.job_id]
+                self.evicted += 1
+
+    def running(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.finished is None)
+
+    def start(self, tool: str, call, session_id: str) -> BackgroundJob:
+        """建立並啟動作業：call(ctx) 執行名為 tool 的工具；同時執行的作業已達上限時拋出 RuntimeError"""
+        self._prune()
+        if self.running() >= self.max_running:
+            self.rejected += 1
+            raise RuntimeError(f"同時執行的背景作業已達上限 ({self.max_running})，請等待其他作業完成")
+        job = BackgroundJob(f"job-{os.urandom(8).hex()}", tool, session_id)
+        self._jobs[job.job_id] = job
+        self.started += 1
+        job.task = asyncio.ensure_future(self._run(job, call))
+        return job
+
+    async def _run(self, job: BackgroundJob, call):
+        try:
+            await self.publish(job, force=True)
+            job.result = await call(_JobContext(job, self))
+            job.state = "done"
+            self.completed += 1
+        except asyncio.CancelledError:
+            job.state = "cancelled"
+            self.cancelled += 1
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e)
+            self.failed += 1
+        finally:
+            job.finished = time.time()
+            job.task = None
+            job.notify()
+            await asyncio.shield(self.publish(job, force=True))
+
+    async def publish(self, job: BackgroundJob, force: bool = False):
+        """將作業狀態寫入共用儲存 (執行中的進度每秒最多一次)"""
+        if self.backend is None:
+            return
+        now = time.monotonic()
+        if not force and now - job.published < 1.0:
+            return
+        job.published = now
+        await asyncio.to_thread(self.backend.set, "job", job.job_id, job.snapshot(), self.ttl)
+
+    async def get(self, job_id: str, session_id: str):
+        """回傳 (本程序的 BackgroundJob 或 None, 快照 dict 或 None)；非本工作階段的作業視為不存在"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return (job, job.snapshot()) if job.session_id == session_id else (None, None)
+        if self.backend is not None:
+            snapshot = await asyncio.to_thread(self.backend.get, "job", job_id)
+            if snapshot is not None and snapshot.get("session") == session_id:
+                return None, snapshot
+        return None, None
+
+    def list(self, session_id: str) -> list:
+        self._prune()
+        return [
+            {k: v for k, v in job.snapshot(include_result=False).items() if k != "session"}
+            for job in self._jobs.values() if job.session_id == session_id
+        ]
+
+    def stats(self) -> dict:
+        self._prune()
+        return {
+            "running": self.running(),
+            "stored": len(self._jobs),
+            "max_running": self.max_running,
+            "max_results": self.max_results,
+            "ttl": self.ttl,
+            "shared": self.backend is not None,
+            "started": self.started,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "evicted": self.evicted,
+        }
+
+background_jobs = BackgroundJobStore(
+    max_running=SAPConfig.JOB_MAX_RUNNING,
+    max_results=SAPConfig.JOB_MAX_RESULTS,
+    ttl=SAPConfig.JOB_RESULT_TTL,
+    backend=state_backend if state_backend.shared else None,
+)
+
+def _job_response(snapshot: dict) -> str:
+    data = {k: v for k, v in snapshot.items() if k != "session"}
+    result = data.get("result")
+    # 工具回傳 JSON 文字時直接內嵌，避免二次跳脫
+    if isinstance(result, str) and result[:1] in ("{", "["):
+        try:
+            data["result"] = json.loads(result)
+        except json.JSONDecodeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+def _job_not_found(job_id: str) -> str:
+    return json.dumps({"job_id": job_id, "state": "not_found",
+                       "error": "找不到此作業 (已過期、屬於其他工作階段，或在其他工作程序執行)"}, ensure_ascii=False)
+
+@mcp.tool()
+async def start_background_job(
+    TOOL: str,
+    ARGUMENTS: Optional[dict] = None,
+    ctx: Context = None
+) -> str:
+    """以背景作業執行呼叫 SAP 的工具，立即回傳 job_id (不等待 SAP 回應)
+
+    可執行以 @background_tool 登錄的建立 / 維護 / 狀態查詢工具，適用於耗時的 BAPI
+    或批次工具 (例如 run_master_data_job、run_kitting_pipeline、check_kitting_status_many)。作業使用目前工作階段的 SAP 憑證；工具回報的進度
+    可由 get_background_job 查詢，或在 await_background_job 等待時以進度通知轉送。
+
+    參數:
+        TOOL: 工具名稱
+        ARGUMENTS: 工具參數 (與直接呼叫該工具相同)
+
+    回傳:
+        JSON 格式的 job_id 與狀態 (running)；工具或參數錯誤時 state 為 rejected
+    """
+    session_id = _get_session_id(ctx)
+    entry = _background_tools.get(TOOL)
+    if entry is None:
+        return json.dumps({"tool": TOOL, "state": "rejected", "error": f"無法在背景執行的工具: {TOOL}"},
+                          ensure_ascii=False)
+    fn, model = entry
+    try:
+        # 先驗證參數，錯誤時直接回報而不是建立一個立即失敗的作業
+        arguments = dict(model.model_validate(dict(ARGUMENTS or {})))
+    except ValueError as e:
+        return json.dumps({"tool": TOOL, "state": "rejected", "error": f"參數錯誤: {e}"}, ensure_ascii=False)
+    try:
+        job = background_jobs.start(TOOL, lambda job_ctx: fn(**arguments, ctx=job_ctx), session_id)
+    except RuntimeError as e:
+        return json.dumps({"tool": TOOL, "state": "rejected", "error": str(e)}, ensure_ascii=False)
+    return _job_response(job.snapshot())
+
+@mcp.tool()
+async def get_background_job(JOB_ID: str = "", ctx: Context = None) -> str:
+    """查詢背景作業的狀態、進度與結果 (不等待)
+
+    參數:
+        JOB_ID: start_background_job 回傳的 job_id；未指定時列出本工作階段的作業 (不含結果)
+
+    回傳:
+        JSON 格式的 state (running / done / failed / cancelled)、progress / total / message、
+        耗時，完成時附上工具的回傳結果 (result)
+    """
+    session_id = _get_session_id(ctx)
+    if not JOB_ID.strip():
+        return json.dumps({"jobs": background_jobs.list(session_id)}, ensure_ascii=False, indent=2)
+    _, snapshot = await background_jobs.get(JOB_ID.strip(), session_id)
+    return _job_response(snapshot) if snapshot is not None else _job_not_found(JOB_ID.strip())
+
+@mcp.tool()
+async def await_background_job(JOB_ID: str, TIMEOUT_SECONDS: float = 60, ctx: Context = None) -> str:
+    """等待背景作業完成，等待期間以進度通知轉送作業回報的進度
+
+    參數:
+        JOB_ID: start_background_job 回傳的 job_id
+        TIMEOUT_SECONDS: 最長等待秒數 (上限 SAP_JOB_MAX_WAIT)；逾時仍回傳目前狀態，作業繼續執行
+
+    回傳:
+        與 get_background_job 相同
+    """
+    session_id = _get_session_id(ctx)
+    job_id = JOB_ID.strip()
+    deadline = time.monotonic() + min(max(TIMEOUT_SECONDS or 0, 0), SAPConfig.JOB_MAX_WAIT)
+    while True:
+        job, snapshot = await background_jobs.get(job_id, session_id)
+        if snapshot is None:
+            return _job_not_found(job_id)
+        remaining = deadline - time.monotonic()
+        if snapshot["state"] != "running" or remaining <= 0:
+            return _job_response(snapshot)
+        if job is not None:
+            changed = job.changed()
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                continue
+            if job.state == "running":
+                await _report_progress(ctx, job.progress, job.total, job.message)
+        else:
+            # 作業在其他工作程序執行：輪詢共用儲存
+            await asyncio.sleep(min(1.0, remaining))
+            await _report_progress(ctx, snapshot["progress"], snapshot["total"], snapshot["message"])
+
+@mcp.tool()
+async def cancel_background_job(JOB_ID: str, ctx: Context = None) -> str:
+    """取消執行中的背景作業
+
+    已送到 SAP 且使用 UUID 的請求仍會完成並寫入冪等日誌，之後以同一 UUID 重新呼叫
+    可直接取得結果；run_master_data_job 可用同一 JOB_ID 接續。
+
+    參數:
+        JOB_ID: start_background_job 回傳的 job_id
+
+    回傳:
+        JSON 格式的作業狀態 (取消後為 cancelled；已結束的作業維持原狀態)
+    """
+    session_id = _get_session_id(ctx)
+    job_id = JOB_ID.strip()
+    job, snapshot = await background_jobs.get(job_id, session_id)
+    if snapshot is None:
+        return _job_not_found(job_id)
+    if job is None:
+        if snapshot["state"] == "running":
+            snapshot = dict(snapshot, error="作業在其他工作程序執行，無法由此工作程序取消")
+        return _job_response(snapshot)
+    task = job.task
+    if task is not None:
+        task.cancel()
+        # 等作業處理完取消再回傳最終狀態
+        await asyncio.wait([task], timeout=5)
+    return _job_response(job.snapshot())
+
+@mcp.tool()
+def get_background_job_stats() -> str:
+    """查詢背景作業登錄的統計 (執行中 / 保留中的作業數與累計結果)
+
+    回傳:
+        JSON 格式的統計資訊
+    """
+    return json.dumps(background_jobs.stats(), ensure_ascii=False, indent=2)
+
+# ==============================================================================
+# 部署 (Deployment)
+# ==============================================================================
+def http_app():
+    """streamable-HTTP 的 ASGI 應用程式 (uvicorn 的每個工作程序各自呼叫一次)"""
+    # 多個工作程序時同一個 MCP 工作階段的請求可能落在不同程序，只能使用無狀態模式
+    if SAPConfig.HTTP_WORKERS > 1 and not SAPConfig.HTTP_STATELESS:
+        logging.warning("SAP_HTTP_WORKERS=%d 需要無狀態 HTTP，忽略 SAP_HTTP_STATELESS=0", SAPConfig.HTTP_WORKERS)
+    mcp.settings.stateless_http = SAPConfig.HTTP_STATELESS or SAPConfig.HTTP_WORKERS > 1
+    return mcp.streamable_http_app()
+
+def main():
+    if SAPConfig.TRANSPORT == "stdio":
+        mcp.run()
+        return
+    if SAPConfig.TRANSPORT not in ("http", "streamable-http"):
+        raise SystemExit(f"未知的 SAP_TRANSPORT: {SAPConfig.TRANSPORT} (可用: stdio, streamable-http)")
+    if SAPConfig.HTTP_WORKERS > 1 and not state_backend.shared:
+        logging.warning("SAP_HTTP_WORKERS=%d 但 SAP_STATE_BACKEND=memory：憑證與快取不會在工作程序間共用",
+                        SAPConfig.HTTP_WORKERS)
+    import uvicorn
 
-    return str(body_dict)
+    # 工作程序以匯入字串載入本模組 (不是 __main__)
+    here = os.path.dirname(os.path.abspath(__file__))
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    uvicorn.run(
+        f"{module}:http_app",
+        factory=True,
+        host=SAPConfig.HTTP_HOST,
+        port=SAPConfig.HTTP_PORT,
+        workers=SAPConfig.HTTP_WORKERS,
+        app_dir=here,
+        log_level=mcp.settings.log_level.lower(),
+    )
 
 if __name__ == "__main__":
-    mcp.run()
\ No newline at end of file
+    main()
\ No newline at end of file
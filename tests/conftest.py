@@ -0,0 +1,62 @@
+"""測試共用設定：以 benchmarks/sap_stub.py 的本機模擬伺服器取代 SAP
+
+匯入 sap_server 前設定預設憑證與暫存的 SQLite 路徑 (冪等日誌 / 維護快取 / 批次作業)，
+測試不會寫入專案目錄。模擬伺服器只接受 SAP_USER / SAP_PASSWORD 這組 Basic 認證。
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+_tmp = tempfile.mkdtemp(prefix="sap-tests-")
+os.environ["SAP_USER"] = "TESTER"
+os.environ["SAP_PASSWORD"] = "secret"
+os.environ["SAP_JOURNAL_PATH"] = os.path.join(_tmp, "journal.sqlite3")
+os.environ["SAP_STATE_PATH"] = os.path.join(_tmp, "state.sqlite3")
+
+import sap_server  # noqa: E402
+from sap_stub import SAPStubServer  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def stub():
+    with SAPStubServer(user="TESTER", password="secret") as server:
+        sap_server.SAPConfig.set_base_url(server.base_url)
+        yield server
+
+
+@pytest.fixture
+def sent(stub):
+    """sent(key) -> 模擬伺服器目前收到的 key 服務請求數"""
+    return lambda key: sum(stub.counters.get(key, {}).values())
+
+
+class _Request:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class _RequestContext:
+    def __init__(self, request):
+        self.request = request
+
+
+class _Session:
+    def __init__(self, client_params):
+        self.client_params = client_params
+
+
+class FakeContext:
+    """只提供 _get_session_id 需要的屬性：HTTP 標頭 (headers 為 None 表示 stdio) 與 client_params"""
+    def __init__(self, headers=None, client_params=None):
+        self.request_context = _RequestContext(None if headers is None else _Request(headers))
+        self.session = _Session(client_params)
+
+
+@pytest.fixture
+def make_ctx():
+    return FakeContext
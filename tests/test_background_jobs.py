@@ -0,0 +1,47 @@
+"""背景作業：只可執行以 @background_tool 登錄的工具，參數在建立作業前驗證"""
+import asyncio
+import json
+
+import sap_server
+
+
+def _start(tool: str, arguments: dict, ctx=None) -> dict:
+    return json.loads(asyncio.run(sap_server.start_background_job(TOOL=tool, ARGUMENTS=arguments, ctx=ctx)))
+
+
+def test_unregistered_tools_are_rejected():
+    for tool in ("get_service_metrics", "start_background_job", "no_such_tool"):
+        result = _start(tool, {})
+        assert result["state"] == "rejected"
+        assert tool in result["error"]
+    assert "create_sto_po" in sap_server._background_tools
+    assert "get_service_metrics" not in sap_server._background_tools
+
+
+def test_invalid_arguments_are_rejected_before_starting():
+    started = sap_server.background_jobs.started
+    missing = _start("create_sto_po", {"PR_NUMBER": "10000001"})
+    wrong_type = _start("create_sto_po", {"PR_NUMBER": "10000001", "PR_ITEM": "00010", "RAW": "maybe"})
+    for result in (missing, wrong_type):
+        assert result["state"] == "rejected"
+        assert result["error"].startswith("參數錯誤")
+    assert sap_server.background_jobs.started == started
+
+
+def test_job_runs_tool_with_validated_arguments(stub, sent, make_ctx):
+    ctx = make_ctx({"x-sap-session": "job-owner"})
+    asyncio.run(sap_server.set_sap_credentials("TESTER", "secret", ctx=ctx))
+    before = sent("STO")
+
+    async def main():
+        job = json.loads(await sap_server.start_background_job(
+            TOOL="create_sto_po", ARGUMENTS={"PR_NUMBER": "10000001", "PR_ITEM": "00010", "RAW": False}, ctx=ctx,
+        ))
+        assert job["state"] == "running"
+        return json.loads(await sap_server.await_background_job(JOB_ID=job["job_id"], TIMEOUT_SECONDS=10, ctx=ctx))
+
+    done = asyncio.run(main())
+    assert done["state"] == "done"
+    assert done["tool"] == "create_sto_po"
+    assert done["result"]["status"] == "OK"
+    assert sent("STO") - before == 1
@@ -0,0 +1,66 @@
+"""斷路器：連續失敗後 open 不再送出，reset_timeout 後 half_open 只放行一個探測請求"""
+import asyncio
+import time
+
+import sap_server
+
+
+def test_opens_after_consecutive_failures():
+    breaker = sap_server.CircuitBreaker("STO", failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    # 成功會重設連續失敗次數
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow() and breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    stats = breaker.stats()
+    assert (stats["state"], stats["trips"], stats["rejected"]) == ("open", 1, 1)
+    assert 0 < stats["retry_after"] <= 60
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = sap_server.CircuitBreaker("STO", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.stats()["state"] == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # 探測失敗再次 open；探測成功回到 closed
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.trips == 2
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert all(breaker.allow() for _ in range(3))
+
+
+def test_zero_threshold_disables_breaker():
+    breaker = sap_server.CircuitBreaker("STO", failure_threshold=0, reset_timeout=60)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_open_breaker_rejects_without_sending():
+    client = sap_server.SAPClient("STO", "TESTER", "secret")
+    client.breaker = sap_server.CircuitBreaker("STO", failure_threshold=2, reset_timeout=60)
+    # 沒有服務在監聽的位址：每次都是連線錯誤
+    client.url = "http://127.0.0.1:9/sap/bc/srt/rfc/sap/zsd_sto_create"
+    body = "<PR_NUMBER>10000001</PR_NUMBER>"
+
+    async def main():
+        return [await client.apost_soap_dict(body) for _ in range(3)]
+
+    results = asyncio.run(main())
+    assert all(found is None for found, _ in results)
+    assert client.breaker.trips == 1
+    assert "斷路器" not in results[1][1]
+    assert "斷路器開啟中" in results[2][1]
+    assert client.breaker.rejected == 1
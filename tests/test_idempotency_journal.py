@@ -0,0 +1,149 @@
+"""UUID 冪等日誌：同一 (SAP 主機, 服務, UUID) 只送出一次，且其他帳號或密碼錯誤的工作階段無法取得保存的回應"""
+import asyncio
+import hashlib
+import sqlite3
+import time
+import uuid as uuidlib
+
+import pytest
+
+import sap_server
+
+
+def _sto_body(pr_number: str) -> str:
+    return f"<PR_NUMBER>{pr_number}</PR_NUMBER>"
+
+
+def test_same_user_replays_stored_response(stub, sent):
+    uuid = uuidlib.uuid4().hex
+    client = sap_server.SAPClient("STO", "TESTER", "secret")
+    before = sent("STO")
+
+    async def main():
+        first = await client.apost_soap_once(uuid, _sto_body("10000001"))
+        second = await client.apost_soap_once(uuid, _sto_body("10000001"))
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first[1] is None
+    assert second == first
+    assert sent("STO") - before == 1
+
+
+def test_other_user_cannot_reuse_uuid(stub, sent):
+    uuid = uuidlib.uuid4().hex
+    owner = sap_server.SAPClient("STO", "TESTER", "secret")
+    other = sap_server.SAPClient("STO", "MALLORY", "wrong")
+    conflicts = sap_server.idempotency_journal.conflicts
+
+    async def main():
+        stored = await owner.apost_soap_once(uuid, _sto_body("10000002"))
+        before = sent("STO")
+        replayed = await other.apost_soap_once(uuid, _sto_body("10000002"))
+        return stored, replayed, sent("STO") - before
+
+    stored, replayed, requests = asyncio.run(main())
+    assert stored[1] is None
+    body, error = replayed
+    assert body is None
+    assert error.startswith("UUID 衝突")
+    assert requests == 0
+    assert sap_server.idempotency_journal.conflicts == conflicts + 1
+
+
+def test_different_request_with_same_uuid_conflicts(stub):
+    uuid = uuidlib.uuid4().hex
+    client = sap_server.SAPClient("STO", "TESTER", "secret")
+
+    async def main():
+        await client.apost_soap_once(uuid, _sto_body("10000003"))
+        return await client.apost_soap_once(uuid, _sto_body("10000004"))
+
+    body, error = asyncio.run(main())
+    assert body is None
+    assert error.startswith("UUID 衝突")
+
+
+def test_wrong_password_cannot_replay(stub, sent):
+    uuid = uuidlib.uuid4().hex
+    owner = sap_server.SAPClient("STO", "TESTER", "secret")
+    guesser = sap_server.SAPClient("STO", "TESTER", "guess")
+    replayed = sap_server.idempotency_journal.replayed
+
+    async def main():
+        await owner.apost_soap_once(uuid, _sto_body("10000005"))
+        return await guesser.apost_soap_once(uuid, _sto_body("10000005"))
+
+    body, error = asyncio.run(main())
+    assert body is None
+    assert error.startswith("UUID 衝突")
+    assert sap_server.idempotency_journal.replayed == replayed
+
+
+def _journal(tmp_path, **kwargs):
+    options = dict(max_age=3600, max_entries=100, pending_timeout=600)
+    options.update(kwargs)
+    return sap_server.IdempotencyJournal(str(tmp_path / "journal.sqlite3"), **options)
+
+
+def test_same_uuid_on_two_sap_systems_does_not_collide(tmp_path):
+    journal = _journal(tmp_path)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        return {"n": len(calls)}
+
+    async def main():
+        first = await journal.run("STO", "u-1", b"<x/>", call, host="https://prd:443")
+        second = await journal.run("STO", "u-1", b"<x/>", call, host="https://qas:443")
+        again = await journal.run("STO", "u-1", b"<x/>", call, host="https://prd:443")
+        return first, second, again
+
+    first, second, again = asyncio.run(main())
+    assert (first, second, again) == ({"n": 1}, {"n": 2}, {"n": 1})
+    assert journal.forget("STO", "u-1", "https://qas:443")
+    assert journal.stats()["entries"] == 1
+
+
+def test_pending_poll_stops_at_tool_deadline(tmp_path):
+    journal = _journal(tmp_path)
+    # 模擬另一個程序已取得同一 UUID、尚未完成
+    assert journal._claim("https://prd:443", "STO", "u-2", "other-digest", "OTHER") == ("claimed", None)
+
+    async def main():
+        with sap_server.sap_deadline(0.3):
+            return await journal.run("STO", "u-2", b"<x/>", lambda: None, host="https://prd:443")
+
+    # 不同 digest 立即衝突；相同 digest 才需要等待
+    with pytest.raises(sap_server.IdempotencyConflict):
+        asyncio.run(main())
+
+    request = b"<x/>"
+    journal._execute(
+        "UPDATE journal SET digest = ? WHERE uuid = 'u-2'",
+        (hashlib.sha256(b"\x00\x00" + request).hexdigest(),),
+    )
+    started = time.monotonic()
+    with pytest.raises(sap_server.SAPUnavailable):
+        asyncio.run(main())
+    assert time.monotonic() - started < 2
+
+
+def test_legacy_journal_is_migrated(tmp_path):
+    path = tmp_path / "journal.sqlite3"
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE journal (service TEXT NOT NULL, uuid TEXT NOT NULL, digest TEXT NOT NULL,"
+        " user TEXT, state TEXT NOT NULL, response TEXT, created REAL NOT NULL, PRIMARY KEY (service, uuid))"
+    )
+    db.execute("INSERT INTO journal VALUES ('STO', 'old', 'legacy', 'A', 'done', '[1]', ?)", (time.time(),))
+    db.commit()
+    db.close()
+
+    journal = _journal(tmp_path)
+    assert journal.stats()["entries"] == 1
+    host = sap_server._base_host(sap_server.SAPConfig.BASE_URL)
+    # 舊紀錄的 digest 與新格式不同：重送視為衝突，不會再次送出
+    with pytest.raises(sap_server.IdempotencyConflict):
+        asyncio.run(journal.run("STO", "old", b"<x/>", lambda: None, host=host))
@@ -0,0 +1,86 @@
+"""多明細工具的輸入驗證：未指定 ITEMS 時單一明細欄位必填，ITEMS 的每筆明細須有必要欄位
+
+兩者的錯誤都是 status=INVALID 的精簡 JSON (run_kitting_pipeline 依此判斷步驟失敗)
+"""
+import asyncio
+import json
+
+import pytest
+
+import sap_server
+
+
+def _call(name: str, arguments: dict) -> str:
+    content, _ = asyncio.run(sap_server.mcp.call_tool(name, arguments))
+    return content[0].text
+
+
+HEADERS = {
+    "create_sales_order": ("SO", {"CUST_PO": "PO-TEST", "CUST_PO_DATE": "2026-01-01"}),
+    "create_outbound_delivery": ("DN", {"PO_NUMBER": "4500000001"}),
+    "change_kitting_qty": ("QTY", {"KITTING_PO": "4500000001"}),
+}
+
+
+@pytest.mark.parametrize("tool, single", [
+    ("create_sales_order", {}),
+    ("create_sales_order", {"MATERIAL": "MAT-1"}),
+    ("create_sales_order", {"MATERIAL": "MAT-1", "QTY": 0}),
+    ("create_sales_order", {"MATERIAL": " ", "QTY": 5}),
+    ("create_outbound_delivery", {"QUANTITY": 5}),
+    ("create_outbound_delivery", {"ITEM_NO": "00010", "QUANTITY": -1}),
+    ("change_kitting_qty", {"QUANTITY": 5}),
+    ("change_kitting_qty", {"PO_ITEM": "00010"}),
+])
+def test_invalid_single_item_is_not_sent(stub, sent, tool, single):
+    key, header = HEADERS[tool]
+    before = sent(key)
+    result = json.loads(_call(tool, dict(header, **single)))
+    assert result["service"] == key
+    assert result["status"] == "INVALID"
+    assert result["error"].startswith("未指定 ITEMS 時")
+    assert sent(key) == before
+
+
+@pytest.mark.parametrize("tool, single", [
+    ("create_sales_order", {"MATERIAL": "MAT-1", "QTY": 5}),
+    ("create_outbound_delivery", {"ITEM_NO": "00010", "QUANTITY": 5}),
+    ("change_kitting_qty", {"PO_ITEM": "00010", "QUANTITY": 5}),
+])
+def test_valid_single_item_is_sent(stub, sent, tool, single):
+    key, header = HEADERS[tool]
+    before = sent(key)
+    assert json.loads(_call(tool, dict(header, **single)))["status"] == "OK"
+    assert sent(key) - before == 1
+
+
+def test_items_missing_required_field(stub, sent):
+    before = sent("SO")
+    result = json.loads(_call("create_sales_order", dict(
+        HEADERS["create_sales_order"][1], ITEMS=[{"MATERIAL": "MAT-1", "QTY": 1}, {"MATERIAL": "MAT-2"}]
+    )))
+    assert result["status"] == "INVALID"
+    assert "第 2 筆明細缺少 QTY" in result["error"]
+    assert sent("SO") == before
+
+
+def test_items_ignore_single_item_fields(stub, sent):
+    before = sent("QTY")
+    result = json.loads(_call("change_kitting_qty", dict(
+        HEADERS["change_kitting_qty"][1], ITEMS=[{"QUANTITY": 5}, {"PO_ITEM": "00030", "QUANTITY": 2}]
+    )))
+    assert result["status"] == "OK"
+    assert [line["item_no"] for line in result["lines"]] == ["00010", "00030"]
+    assert sent("QTY") - before == 1
+
+
+def test_pipeline_reports_invalid_single_item_as_failed_step(stub, sent):
+    before = sent("SO")
+    result = json.loads(_call("run_kitting_pipeline", {
+        "CUST_PO": "PO-TEST", "CUST_PO_DATE": "2026-01-01", "MATERIAL": "MAT-1", "QTY": 0,
+    }))
+    assert result["status"] == "FAILED"
+    assert result["failed_step"] == "SO"
+    assert result["steps"][0]["status"] == "ERROR"
+    assert "QTY 必須大於 0" in result["steps"][0]["detail"]
+    assert sent("SO") == before
@@ -0,0 +1,67 @@
+"""主資料「已維護」快取：相同憑證與參數才直接回傳，其他帳號或密碼錯誤的工作階段仍送到 SAP"""
+import asyncio
+import json
+import uuid as uuidlib
+
+import sap_server
+
+
+def _maintain(ctx, material: str) -> dict:
+    return json.loads(asyncio.run(sap_server.maintain_sales_view(
+        MATERIAL=material, SALES_ORG="TW01", DISTR_CHAN="03", RAW=False, ctx=ctx
+    )))
+
+
+def test_same_user_hits_cache(stub, sent, make_ctx):
+    material = f"MAT-{uuidlib.uuid4().hex[:8]}"
+    ctx = make_ctx({"x-sap-session": "cache-owner"})
+    asyncio.run(sap_server.set_sap_credentials("TESTER", "secret", ctx=ctx))
+    before = sent("MAT")
+
+    assert _maintain(ctx, material)["status"] == "OK"
+    assert _maintain(ctx, material)["status"] == "OK"
+    assert sent("MAT") - before == 1
+
+
+def test_other_user_does_not_get_cached_success(stub, sent, make_ctx):
+    material = f"MAT-{uuidlib.uuid4().hex[:8]}"
+    owner = make_ctx({"x-sap-session": "cache-owner"})
+    intruder = make_ctx({"x-sap-session": "cache-intruder"})
+    asyncio.run(sap_server.set_sap_credentials("TESTER", "secret", ctx=owner))
+    asyncio.run(sap_server.set_sap_credentials("MALLORY", "wrong", ctx=intruder))
+
+    assert _maintain(owner, material)["status"] == "OK"
+    hits = sap_server.maintenance_cache.hits
+    before = sent("MAT")
+    result = _maintain(intruder, material)
+    assert result["status"] == "HTTP_ERROR"
+    assert sent("MAT") - before == 1
+    assert sap_server.maintenance_cache.hits == hits
+
+
+def test_wrong_password_does_not_get_cached_success(stub, sent, make_ctx):
+    material = f"MAT-{uuidlib.uuid4().hex[:8]}"
+    owner = make_ctx({"x-sap-session": "cache-owner"})
+    guesser = make_ctx({"x-sap-session": "cache-guesser"})
+    asyncio.run(sap_server.set_sap_credentials("TESTER", "secret", ctx=owner))
+    asyncio.run(sap_server.set_sap_credentials("TESTER", "guess", ctx=guesser))
+
+    assert _maintain(owner, material)["status"] == "OK"
+    hits = sap_server.maintenance_cache.hits
+    before = sent("MAT")
+    assert _maintain(guesser, material)["status"] == "HTTP_ERROR"
+    assert sent("MAT") - before == 1
+    assert sap_server.maintenance_cache.hits == hits
+
+
+def test_cache_key_includes_credentials():
+    values = {"MATERIAL": "MAT-1", "UUID": "u-1"}
+    right = sap_server.credential_fingerprint("TESTER", "secret")
+    wrong = sap_server.credential_fingerprint("TESTER", "guess")
+    assert right != wrong
+    assert right == sap_server.credential_fingerprint("TESTER", "secret")
+    assert "secret" not in right
+    key = sap_server.MaintenanceCache._key("maintain_sales_view", values, right)
+    assert key != sap_server.MaintenanceCache._key("maintain_sales_view", values, wrong)
+    # UUID 不屬於維護內容
+    assert key == sap_server.MaintenanceCache._key("maintain_sales_view", dict(values, UUID="u-2"), right)
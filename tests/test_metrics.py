@@ -0,0 +1,74 @@
+"""效能指標：Histogram 分桶、ServiceMetrics 摘要與 Prometheus 輸出，以及建立 / 維護工具的 format 階段"""
+import asyncio
+import json
+
+import sap_server
+
+
+def test_histogram_buckets_are_upper_inclusive():
+    hist = sap_server.Histogram((1, 2, 5))
+    for value in (0.5, 1, 1.5, 2, 7):
+        hist.observe(value)
+    # le 語意：等於上界的值落在該桶，超過最後一個上界落在 +Inf
+    assert hist.counts == [2, 2, 0, 1]
+    assert (hist.count, hist.sum) == (5, 12.0)
+    assert 1 < hist.quantile(0.5) <= 2
+    assert hist.quantile(0.99) == 5
+    assert sap_server.Histogram((1,)).quantile(0.5) == 0.0
+
+
+def test_stats_summary_and_reset():
+    metrics = sap_server.ServiceMetrics()
+    metrics.observe("SO", "network", 0.004)
+    metrics.observe("SO", "network", 0.006)
+    with metrics.timer("SO", "format"):
+        pass
+    metrics.exchange("SO", 1000, 300, 200)
+    metrics.exchange("SO", 1000, 50, 500)
+    metrics.error("SO", "timeout")
+
+    so = metrics.stats()["services"]["SO"]
+    assert list(so["phases"]) == ["network", "format"]
+    assert so["phases"]["network"]["count"] == 2
+    assert so["phases"]["network"]["avg_ms"] == 5.0
+    assert so["http_status"] == {"200": 1, "500": 1}
+    assert so["errors"] == {"http": 1, "timeout": 1}
+
+    metrics.reset()
+    assert metrics.stats()["services"] == {}
+    metrics.enabled = False
+    metrics.observe("SO", "network", 0.001)
+    metrics.error("SO", "timeout")
+    assert metrics.stats()["services"] == {}
+
+
+def test_prometheus_exposition():
+    metrics = sap_server.ServiceMetrics()
+    metrics.observe("STO", "parse", 0.0002)
+    metrics.observe("STO", "parse", 3)
+    metrics.exchange("STO", 200, 100, 200)
+    metrics.error("STO", "parse")
+    lines = metrics.prometheus().splitlines()
+
+    assert "# TYPE sap_soap_phase_seconds histogram" in lines
+    buckets = [line for line in lines if line.startswith('sap_soap_phase_seconds_bucket{service="STO",phase="parse"')]
+    assert len(buckets) == len(sap_server.LATENCY_BUCKETS) + 1
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    # 累計值單調遞增，+Inf 等於總數
+    assert counts == sorted(counts)
+    assert 'sap_soap_phase_seconds_bucket{service="STO",phase="parse",le="0.00025"} 1' in lines
+    assert 'sap_soap_phase_seconds_bucket{service="STO",phase="parse",le="+Inf"} 2' in lines
+    assert 'sap_soap_phase_seconds_count{service="STO",phase="parse"} 2' in lines
+    assert 'sap_soap_responses_total{service="STO",code="200"} 1' in lines
+    assert 'sap_soap_errors_total{service="STO",type="parse"} 1' in lines
+
+
+def test_create_tools_record_format_phase(stub):
+    sap_server.service_metrics.reset()
+    result = json.loads(sap_server._format_result("MAT", "", (None, "HTTP 錯誤 500: x"), False))
+    assert result["status"] == "HTTP_ERROR"
+
+    asyncio.run(sap_server.create_sto_po(PR_NUMBER="10000009", PR_ITEM="00010", RAW=False))
+    phases = sap_server.service_metrics.stats()["services"]
+    assert phases["MAT"]["phases"]["format"]["count"] == 1
+    assert set(phases["STO"]["phases"]) >= {"build", "network", "parse", "format"}
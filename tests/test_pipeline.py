@@ -0,0 +1,61 @@
+"""run_kitting_pipeline 的補救次數：剩餘次數不足時先執行可執行的補救，再回報次數已用盡"""
+import asyncio
+import json
+
+import sap_server
+
+
+def _outcome(status: str, documents: dict = None, messages=()) -> str:
+    return json.dumps({
+        "status": status,
+        "documents": documents or {},
+        "messages": [{"type": t, "id": "06", "number": "218", "message": m} for t, m in messages],
+    })
+
+
+def _run(monkeypatch, max_remediations: int) -> tuple:
+    calls = []
+
+    def tool(name, text):
+        async def fake(**kwargs):
+            calls.append(name)
+            return text
+        fake.__name__ = name
+        monkeypatch.setattr(sap_server, name, fake)
+
+    tool("create_sales_order", _outcome("OK", {"PR_NUMBER": "10000001", "PR_ITEM": "00010"}))
+    # 同時缺少資訊記錄與貨源清單
+    tool("create_sto_po", _outcome("ERROR", messages=[
+        ("E", "No info record for vendor ICC-CP60"), ("E", "Material not in source list"),
+    ]))
+    for name in ("maintain_info_record", "maintain_source_list"):
+        tool(name, _outcome("OK"))
+
+    result = json.loads(asyncio.run(sap_server.run_kitting_pipeline(
+        CUST_PO="PO-1", CUST_PO_DATE="2026-01-01", MATERIAL="MAT-1", QTY=1, MAX_REMEDIATIONS=max_remediations,
+    )))
+    return result, calls
+
+
+def test_remediations_within_budget_are_applied(monkeypatch):
+    result, calls = _run(monkeypatch, 1)
+    assert result["status"] == "FAILED"
+    assert result["failed_step"] == "STO"
+    assert calls == ["create_sales_order", "create_sto_po", "maintain_info_record"]
+    assert "補救次數已用盡" in result["reason"]
+    assert "maintain_source_list" in result["reason"]
+
+
+def test_no_budget_reports_exhaustion(monkeypatch):
+    result, calls = _run(monkeypatch, 0)
+    assert calls == ["create_sales_order", "create_sto_po"]
+    assert "maintain_info_record, maintain_source_list" in result["reason"]
+
+
+def test_enough_budget_retries_step(monkeypatch):
+    result, calls = _run(monkeypatch, 2)
+    # 補救後重試仍失敗，且沒有新的補救可執行
+    assert calls == ["create_sales_order", "create_sto_po", "maintain_info_record", "maintain_source_list",
+                     "create_sto_po"]
+    assert result["failed_step"] == "STO"
+    assert "reason" not in result
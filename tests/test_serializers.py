@@ -0,0 +1,53 @@
+"""REQUEST_SCHEMAS 序列化：所有值 (含表格列與結構) 都經過 XML 跳脫，空值套用預設值或省略"""
+from xml.etree import ElementTree
+
+import sap_server
+
+
+def _body(key: str, values: dict) -> ElementTree.Element:
+    envelope = ElementTree.fromstring(sap_server.REQUEST_SCHEMAS[key].serialize(values))
+    return envelope[1][0]
+
+
+def test_values_are_escaped_everywhere():
+    nasty = "A&B</MATERIAL><X>"
+    values = {
+        "UUID": "u<1>",
+        "CUST_PO": nasty,
+        "IT_SO_ITEM": [{"MATERIAL_NO": "10", "MATERIAL": nasty, "QTY": 1}, {"MATERIAL": "M2", "QTY": "2&3"}],
+    }
+    body = _body("SO", values)
+    assert body.find("UUID").text == "u<1>"
+    assert body.find("CUST_PO").text == nasty
+    rows = body.findall("IT_SO_ITEM/item")
+    assert [r.find("MATERIAL").text for r in rows] == [nasty, "M2"]
+    assert rows[1].find("QTY").text == "2&3"
+
+    mat = _body("MAT", {"HEADDATA": {"MATERIAL": nasty}, "SALESDATA": {"SALES_ORG": "<TW>"}})
+    assert mat.find("HEADDATA/MATERIAL").text == nasty
+    assert mat.find("SALESDATA/SALES_ORG").text == "<TW>"
+
+
+def test_empty_values_use_defaults_or_are_omitted():
+    body = _body("SO", {"UUID": "", "CUST_PO": None, "IT_SO_ITEM": [{"MATERIAL": "M1", "QTY": 0}]})
+    assert body.find("UUID") is None
+    assert body.find("CUST_PO").text == "TEST_PO"
+    row = body.find("IT_SO_ITEM/item")
+    assert row.find("UNIT").text == "PCE"
+    assert row.find("QTY").text == "0"
+    assert row.find("DELIVERY_DATE").text is None
+
+    mat = _body("MAT", {"HEADDATA": {"MATERIAL": "M1"}, "PLANTDATA": {}})
+    assert mat.find("PLANTDATA/PLANT").text == "TP01"
+    assert mat.find("SALESDATA") is None
+
+
+def test_serialize_into_appends_to_reusable_buffer():
+    schema = sap_server.REQUEST_SCHEMAS["STATUS"]
+    buf = bytearray()
+    for batch_id in ("0001", "0002"):
+        buf.clear()
+        assert schema.serialize_into({"BATCH_ID": batch_id}, buf) is buf
+        assert bytes(buf) == schema.serialize({"BATCH_ID": batch_id})
+    schema.serialize_into({"BATCH_ID": "0003"}, buf)
+    assert buf.count(sap_server.SOAP_ENVELOPE_OPEN) == 2
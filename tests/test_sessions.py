@@ -0,0 +1,41 @@
+"""工作階段識別：無狀態 HTTP 的匿名請求不可共用由 str(None) 產生的 ID 與他人的憑證"""
+import asyncio
+
+import sap_server
+
+
+def test_anonymous_stateless_requests_use_default(make_ctx):
+    first = make_ctx(headers={})
+    second = make_ctx(headers={"user-agent": "other"})
+    assert sap_server._get_session_id(first) == "default"
+    assert sap_server._get_session_id(second) == "default"
+
+
+def test_anonymous_stateless_request_cannot_set_credentials(make_ctx):
+    ctx = make_ctx(headers={})
+    result = asyncio.run(sap_server.set_sap_credentials("MALLORY", "wrong", ctx=ctx))
+    assert result.startswith("[ERROR]")
+    # 其他匿名請求仍只使用環境變數的預設憑證
+    assert sap_server.session_registry.get_credentials("default")["user"] == "TESTER"
+
+
+def test_session_header_isolates_credentials(make_ctx):
+    alice = make_ctx(headers={"x-sap-session": "alice"})
+    bob = make_ctx(headers={"x-sap-session": "bob"})
+    assert sap_server._get_session_id(alice) != sap_server._get_session_id(bob)
+
+    asyncio.run(sap_server.set_sap_credentials("ALICE", "a", ctx=alice))
+    asyncio.run(sap_server.set_sap_credentials("BOB", "b", ctx=bob))
+    assert "ALICE" in asyncio.run(sap_server.check_session_credentials(ctx=alice))
+    assert "BOB" in asyncio.run(sap_server.check_session_credentials(ctx=bob))
+    # 同一標頭的新請求 (無狀態 HTTP 每次都是新的 MCP 工作階段) 取得相同的憑證
+    again = make_ctx(headers={"x-sap-session": "alice"})
+    assert "ALICE" in asyncio.run(sap_server.check_session_credentials(ctx=again))
+
+
+def test_stdio_sessions_hash_client_params(make_ctx):
+    one = make_ctx(client_params="clientInfo={'name': 'agent-1'}")
+    two = make_ctx(client_params="clientInfo={'name': 'agent-2'}")
+    uninitialized = make_ctx()
+    assert sap_server._get_session_id(one) not in ("default", sap_server._get_session_id(two))
+    assert sap_server._get_session_id(uninitialized) == "default"
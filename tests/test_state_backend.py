@@ -0,0 +1,61 @@
+"""共用狀態儲存 (SQLite)：事件迴圈中的讀寫都在執行緒中進行，存有密碼的檔案只允許目前使用者讀寫"""
+import asyncio
+import os
+import stat
+import threading
+
+import sap_server
+
+
+class RecordingBackend(sap_server.SQLiteStateBackend):
+    """記錄每次讀寫所在的執行緒"""
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = []
+
+    def _execute(self, sql, params=()):
+        self.threads.append(threading.get_ident())
+        return super()._execute(sql, params)
+
+
+def test_shared_state_is_accessed_off_the_event_loop(tmp_path):
+    backend = RecordingBackend(str(tmp_path / "state" / "state.sqlite3"))
+    registry = sap_server.SessionRegistry(max_sessions=10, ttl=60, backend=backend)
+    cache = sap_server.TTLCache(maxsize=10, ttl=60, backend=backend, namespace="status")
+    jobs = sap_server.BackgroundJobStore(max_running=2, max_results=10, ttl=60, backend=backend)
+    registry.set_credentials("s1", "ALICE", "a")
+
+    async def fetch():
+        return ["found", None]
+
+    async def noop(ctx):
+        return "done"
+
+    async def main():
+        loop_thread = threading.get_ident()
+        backend.threads.clear()
+        client = await registry.aclient("s1", "STATUS")
+        assert await cache.get_or_fetch("k", fetch) == ["found", None]
+        job = jobs.start("noop", noop, "s1")
+        await job.task
+        # 其他工作程序的作業只能由共用儲存查詢
+        jobs._jobs.clear()
+        _, snapshot = await jobs.get(job.job_id, "s1")
+        assert snapshot["state"] == "done"
+        # 等 TTLCache 在執行緒池中寫入共用儲存
+        await asyncio.sleep(0.05)
+        return loop_thread, client
+
+    loop_thread, client = asyncio.run(main())
+    assert client.user == "ALICE"
+    assert backend.threads
+    assert loop_thread not in backend.threads
+
+
+def test_state_file_is_private(tmp_path):
+    path = tmp_path / "nested" / "state.sqlite3"
+    backend = sap_server.SQLiteStateBackend(str(path))
+    backend.set("credentials", "s1", {"user": "ALICE", "password": "a"}, 60)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(path.parent).st_mode) == 0o700
+
@@ -0,0 +1,73 @@
+"""check_kitting_status 結果快取：TTL / LRU、同時進行的相同查詢合併，以及依憑證區分"""
+import asyncio
+
+import sap_server
+
+
+def _counting_fetch(calls: list, value, delay: float = 0.0):
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return value
+    return fetch
+
+
+def test_concurrent_lookups_share_one_fetch():
+    cache = sap_server.TTLCache(maxsize=10, ttl=60)
+    calls = []
+
+    async def main():
+        fetch = _counting_fetch(calls, ("found", None), delay=0.05)
+        results = await asyncio.gather(*(cache.get_or_fetch("k", fetch) for _ in range(5)))
+        again = await cache.get_or_fetch("k", fetch)
+        return results, again
+
+    results, again = asyncio.run(main())
+    assert results == [("found", None)] * 5
+    assert again == ("found", None)
+    assert len(calls) == 1
+    assert (cache.misses, cache.coalesced, cache.hits) == (1, 4, 1)
+
+
+def test_failed_results_and_zero_ttl_are_not_cached():
+    failed = sap_server.TTLCache(maxsize=10, ttl=60, cache_if=lambda result: result[1] is None)
+    disabled = sap_server.TTLCache(maxsize=10, ttl=0)
+    calls = []
+
+    async def main():
+        for cache, value in ((failed, (None, "連線錯誤: x")), (disabled, ("found", None))):
+            await cache.get_or_fetch("k", _counting_fetch(calls, value))
+            await cache.get_or_fetch("k", _counting_fetch(calls, value))
+
+    asyncio.run(main())
+    assert len(calls) == 4
+    assert failed.stats()["size"] == disabled.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = sap_server.TTLCache(maxsize=2, ttl=60)
+    calls = []
+
+    async def main():
+        for key in ("a", "b", "a", "c", "a", "b"):
+            await cache.get_or_fetch(key, _counting_fetch(calls, key))
+
+    asyncio.run(main())
+    # a 最近使用過，c 加入時淘汰 b；之後 b 需要重新查詢
+    assert len(calls) == 4
+    assert cache.evictions == 2
+
+
+def test_wrong_password_does_not_get_cached_status(stub, sent, make_ctx):
+    owner = make_ctx({"x-sap-session": "status-owner"})
+    guesser = make_ctx({"x-sap-session": "status-guesser"})
+    asyncio.run(sap_server.set_sap_credentials("TESTER", "secret", ctx=owner))
+    asyncio.run(sap_server.set_sap_credentials("TESTER", "guess", ctx=guesser))
+    batch_id = "7300000000000042"
+
+    owned = asyncio.run(sap_server.check_kitting_status(BATCH_ID=batch_id, ctx=owner))
+    assert not owned.startswith("[ERROR]")
+    before = sent("STATUS")
+    guessed = asyncio.run(sap_server.check_kitting_status(BATCH_ID=batch_id, ctx=guesser))
+    assert guessed.startswith("[ERROR]")
+    assert sent("STATUS") > before
@@ -0,0 +1,62 @@
+"""SOAPStreamExtractor 串流擷取，以及 HTTP 200 但沒有 RETURN_DATA / 無法解析的狀態查詢結果"""
+import sap_server
+
+RESPONSE = (
+    b'<soap-env:Envelope xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/"><soap-env:Header/>'
+    b'<soap-env:Body><n0:ZAI_FLOW_STATUSResponse xmlns:n0="urn:sap-com:document:sap:rfc:functions">'
+    b"<RETURN_DATA><LAST_ACTION>PICK</LAST_ACTION><LAST_IMPORT>{&quot;A&quot;: 1}</LAST_IMPORT><LAST_EXPORT/></RETURN_DATA>"
+    b"<RETURN><item><TYPE>S</TYPE></item><item><TYPE>W</TYPE></item></RETURN>"
+    b"</n0:ZAI_FLOW_STATUSResponse></soap-env:Body></soap-env:Envelope>"
+)
+
+
+def _extract(data: bytes, paths, chunk: int = 7):
+    extractor = sap_server.SOAPStreamExtractor(paths)
+    for i in range(0, len(data), chunk):
+        extractor.feed(data[i:i + chunk])
+    return extractor
+
+
+def test_chunked_feed_matches_names_and_path_suffixes():
+    extractor = _extract(RESPONSE, ["RETURN_DATA", "RETURN/item", "Body/Fault/faultstring"])
+    extractor.close()
+    found = extractor.results()
+    assert found["RETURN_DATA"] == {"LAST_ACTION": "PICK", "LAST_IMPORT": '{"A": 1}', "LAST_EXPORT": None}
+    # 只擷取第一個符合的元素；不存在的目標為 None
+    assert found["RETURN/item"] == {"TYPE": "S"}
+    assert found["Body/Fault/faultstring"] is None
+    assert sap_server.extract_soap_fields(RESPONSE.decode("utf-8"), ["LAST_ACTION"]) == {"LAST_ACTION": "PICK"}
+
+
+def test_stops_once_all_targets_are_found():
+    extractor = sap_server.SOAPStreamExtractor(["LAST_ACTION"])
+    cut = RESPONSE.index(b"</LAST_ACTION>") + len(b"</LAST_ACTION>")
+    assert extractor.feed(RESPONSE[:cut])
+    # 之後的內容 (即使不完整) 不再解析
+    assert extractor.feed(b"<<garbage")
+    extractor.close()
+    assert extractor.results() == {"LAST_ACTION": "PICK"}
+
+
+def test_missing_or_empty_return_data_is_no_data():
+    client = sap_server.SAPClient("STATUS", "TESTER", "secret")
+    for body in (b"", b"<RETURN_DATA/>"):
+        data = RESPONSE.replace(RESPONSE[RESPONSE.index(b"<RETURN_DATA>"):RESPONSE.index(b"<RETURN>")], body)
+        found, error = client._extracted(_extract(data, ["RETURN_DATA"]))
+        assert found is None
+        assert error.startswith("無資料:")
+        text = sap_server._format_status("0000000000000001", found, error)
+        assert text.startswith("[NO_DATA]")
+        assert "HTTP" not in text.splitlines()[0]
+        assert sap_server._status_error_type(error) == "NO_DATA"
+
+
+def test_truncated_response_is_parse_error():
+    client = sap_server.SAPClient("STATUS", "TESTER", "secret")
+    found, error = client._extracted(_extract(RESPONSE[:RESPONSE.index(b"<RETURN_DATA>") + 20], ["RETURN_DATA"]))
+    assert found is None
+    assert error.startswith("解析錯誤:")
+    assert sap_server._format_status("0000000000000001", found, error).startswith("[ERROR] 回應解析失敗")
+    assert sap_server._status_error_type(error) == "PARSE"
+    projected = sap_server._project_status("0000000000000001", found, error, "/LAST_ACTION", "", 0, False)
+    assert projected.startswith("[ERROR] 回應解析失敗")
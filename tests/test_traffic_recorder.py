@@ -0,0 +1,52 @@
+"""流量紀錄：record() 只放進緩衝區，由背景執行緒批次寫入 gzip JSON Lines，close() 寫完剩餘紀錄"""
+import gzip
+import json
+import time
+
+import sap_server
+
+
+def _record(recorder, n: int):
+    now = time.perf_counter()
+    recorder.record("STO", f"<PASSWORD>s3cret</PASSWORD><PR_NUMBER>{n}</PR_NUMBER>".encode(), 200,
+                    b"<ok/>", now - 0.01, now, 0.005)
+
+
+def _lines(path) -> list:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_records_are_buffered_and_written_on_close(tmp_path):
+    path = tmp_path / "traffic.jsonl.gz"
+    recorder = sap_server.TrafficRecorder(str(path), flush_interval=60)
+    for n in range(3):
+        _record(recorder, n)
+    # 呼叫端執行緒不寫檔
+    assert recorder.stats()["pending"] + recorder.stats()["records"] == 3
+    recorder.close()
+
+    lines = _lines(path)
+    assert [line["request"] for line in lines] == [
+        f"<PASSWORD>***</PASSWORD><PR_NUMBER>{n}</PR_NUMBER>" for n in range(3)
+    ]
+    assert lines[0]["service"] == "STO" and lines[0]["response"] == "<ok/>"
+    assert recorder.stats()["records"] == 3
+
+    # close() 之後仍可繼續記錄 (附加新的 gzip member)
+    _record(recorder, 3)
+    recorder.close()
+    assert len(_lines(path)) == 4
+
+
+def test_full_buffer_is_flushed_without_waiting(tmp_path):
+    path = tmp_path / "traffic.jsonl.gz"
+    recorder = sap_server.TrafficRecorder(str(path), flush_interval=60)
+    recorder.MAX_PENDING = 4
+    for n in range(4):
+        _record(recorder, n)
+    deadline = time.monotonic() + 5
+    while recorder.stats()["records"] < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert recorder.stats()["records"] == 4
+    recorder.close()